@@ -1,10 +1,21 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed# analyzer.py
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
-from tqdm import tqdm
 import json
+import threading
+import time
 from datetime import datetime,timedelta
 from collections import defaultdict
 from db_manager import DBManager
+from snapshot_store import SnapshotStore, HourlyRollup, MISSING
+from bounded_cache import BoundedCache
+from shared_store import SharedStoreReader
+from checkpoint import save_checkpoint, load_checkpoint
+from spatial_index import StationSpatialIndex
+from response_cache import EncodedBody
+from single_flight import SingleFlight
+from downsample import RESOLUTIONS, bucket_aggregate, bucket_seconds_for, lttb
+import numpy as np
 
 class StationLog:
     def __init__(self, timestamp: datetime, available_spaces: int):
@@ -12,41 +23,134 @@ class StationLog:
         self.available_spaces = available_spaces
 
 class Analyzer:
-    def __init__(self, db_manager: DBManager):
+    # 滾動視窗：已自統計扣除的過期列累積到這個數量才實際從 snapshot_store 移除 (整批搬移一次)
+    EVICT_BATCH = 60
+    # 範圍快取失效的時間桶大小 (秒)
+    RANGE_BUCKET = 3600
+    # /range?resolution=... 可直接讀取彙總表的解析度與彙總方式 (last 不在彙總表中)
+    ROLLUP_RESOLUTIONS = {"1h": "hour", "1d": "day"}
+    ROLLUP_AGGREGATES = {"avg": "avg_available", "min": "min_available", "max": "max_available"}
+    # sync_from_db 落後超過這個秒數時改用分段批次讀取補上缺口
+    CATCHUP_BULK_SECONDS = 3600
+
+    def __init__(self, db_manager: DBManager, snapshot_cache_bytes=64 * 2**20, range_cache_bytes=256 * 2**20,
+                 response_cache_bytes=128 * 2**20, window_days=7):
         self.db_manager = db_manager
-        
-        # 三種快取
-        self.snapshot_cache = {}        # {timestamp_unix: 已格式化快照列表}
-        self.range_cache = {}           # {(station_no, start_ts, end_ts): [StationLog]}
-        self.hourly_cache = {}          # {station_no: hourly_avg_list}
-        self.delta_cache = {}           # {station_no: hourly_delta_dict}
+        self.window_days = window_days
+        self._range_cache_bytes = range_cache_bytes
+
+        # snapshot_store / hourly_rollup 會被寫入端 (排程抓取、/upload 的 writer 執行緒) 就地更新，
+        # 讀取與寫入都需持有此鎖；其餘快取 (BoundedCache) 各自有鎖
+        self._store_lock = threading.RLock()
+        # 快取未命中時同一個 key 只由一個執行緒計算 (DB 查詢、序列化)，其他執行緒等待結果
+        self._flights = SingleFlight()
+        # 失效通知：新快照併入時只讓受影響的快取失效，不再定時全部清空
+        # - 範圍快取：移除與新時間點重疊的項目，並記錄該時間桶最後一次有新資料的序號 (避免併入前開始的查詢寫回舊結果)
+        # - 每站統計：遞增該站的變動次數，回應快取的 key 與 ETag 以此區分版本
+        self._bucket_versions = {}                              # {timestamp_unix // RANGE_BUCKET: 序號}
+        self._data_seq = 0                                      # 每次失效通知加一
+        self._station_changes = np.zeros(0, dtype=np.int64)     # 依 station_index 欄位排列
+        self._stats_epoch = (0, 0)                              # 最近一次整批載入 / 重建統計時的 data_version
+
+        # 快取
+        self.snapshot_store = SnapshotStore()   # 最近 window_days 天快照 (欄式陣列，時間 × 站點)
+        # snapshot_store 開頭已滑出視窗、已自 hourly_rollup 扣除但尚未移除的列數
+        self._expired_rows = 0
+        # {timestamp_unix: 已格式化快照列表} 僅存放預載範圍外、由 DB 查回的快照 (歷史資料不變，TTL 較長)
+        self.snapshot_cache = BoundedCache("snapshot", snapshot_cache_bytes, ttl=24 * 3600)
+        # {(station_no, start_ts, end_ts): [StationLog]}
+        self.range_cache = BoundedCache("range", range_cache_bytes, ttl=3600)
+        self.hourly_rollup = HourlyRollup()     # {站點 × 小時} 串流統計，寫入快照時即時更新
+        # {(種類, 參數..., 資料版本): EncodedBody} 預先序列化與壓縮好的回應內容，版本改變後舊項目自然被 LRU 淘汰
+        self.response_cache = BoundedCache("response", response_cache_bytes, sizeof=lambda body: body.nbytes)
+        self.shared_reader = None               # 多 worker 模式：改由共享記憶體讀取上面兩者
+        self.station_index = StationSpatialIndex([])    # 站點座標的網格空間索引 (/api/nearby)
+
+        # 每次 save_snapshot 成功 (排程抓取或 /upload) 後同步更新快取
+        self.db_manager.add_snapshot_listener(self.update_cache_after_upload)
 
     # -------------------------------------------------
     # 1. 取得單一快照（/data/<ts>）
     # -------------------------------------------------
+    def has_snapshot(self, ts_unix: int):
+        """
+        記憶體中的快照是否包含 ts_unix：True / False；
+        ts_unix 早於記憶體涵蓋的範圍 (需查 DB 才知道) 時回傳 None。
+        """
+        with self._store_lock:
+            self._refresh_shared()
+            store = self.snapshot_store
+            if not len(store) or ts_unix < store.timestamps[0]:
+                return None
+            return ts_unix in store
+
     def get_snapshot_by_timestamp(self, dt: datetime):
         ts_unix = int(dt.timestamp())
-        if ts_unix in self.snapshot_cache:
-            return self.snapshot_cache[ts_unix]
-        
+        with self._store_lock:
+            self._refresh_shared()
+            if ts_unix in self.snapshot_store:
+                return self.snapshot_store.get_snapshot(ts_unix)
+        cached = self.snapshot_cache.get(ts_unix)
+        if cached is not None:
+            return cached
+        return self._flights.do(("snapshot", ts_unix), lambda: self._load_snapshot(dt, ts_unix))
+
+    def _load_snapshot(self, dt: datetime, ts_unix: int):
+        # 等待 single-flight 期間可能已由其他執行緒填入
+        cached = self.snapshot_cache.get(ts_unix, count=False)
+        if cached is not None:
+            return cached
+
         result = self.db_manager.get_snapshot_by_timestamp(dt)
         formatted = []
         for item in result:
             ts = item.pop('timestamp')
             item['timestamp'] = ts.isoformat().split('.')[0] if isinstance(ts, datetime) else ts
             formatted.append(item)
-        
-        self.snapshot_cache[ts_unix] = formatted
+
+        # 空結果不快取：該時間點之後可能才補進資料
+        if formatted:
+            self.snapshot_cache.put(ts_unix, formatted)
         return formatted
 
     # -------------------------------------------------
     # 2. 範圍查詢（/range）
     # -------------------------------------------------
+    def _cached_logs_in_range(self, station_no: str, start: datetime, end: datetime):
+        """由 range_cache 取得 [start, end] 的紀錄；未命中回傳 None。"""
+        with self._store_lock:
+            # 多 worker 模式：loader 發布新資料時，先讓重疊的範圍快取失效再查詢
+            self._refresh_shared()
+        start_ts, end_ts = int(start.timestamp()), int(end.timestamp())
+        key = (station_no, start_ts, end_ts)
+
+        # 同站且涵蓋 [start, end] 的快取範圍也可重用，切出所需區段即可
+        def covers(cached_key):
+            cached_station, cached_start, cached_end = cached_key
+            return cached_station == station_no and cached_start <= start_ts and cached_end >= end_ts
+
+        hit_key, logs = self.range_cache.lookup(key, covers)
+        if logs is None or hit_key == key:
+            return logs
+        # 以 Unix 秒比較：start / end 可能帶時區 (例如 +08:00)，log.timestamp 則是本地時間的 naive datetime
+        lo = bisect_left(logs, start_ts, key=lambda log: int(log.timestamp.timestamp()))
+        hi = bisect_right(logs, end_ts, key=lambda log: int(log.timestamp.timestamp()))
+        return logs[lo:hi]
+
     def get_logs_in_range(self, station_no: str, start: datetime, end: datetime):
+        logs = self._cached_logs_in_range(station_no, start, end)
+        if logs is not None:
+            return logs
         key = (station_no, int(start.timestamp()), int(end.timestamp()))
-        if key in self.range_cache:
-            return self.range_cache[key]
-        
+        return self._flights.do(("range",) + key, lambda: self._load_logs_in_range(key, start, end))
+
+    def _load_logs_in_range(self, key, start: datetime, end: datetime):
+        logs = self.range_cache.get(key, count=False)
+        if logs is not None:
+            return logs
+
+        station_no, start_ts, end_ts = key
+        version = self._range_version(start_ts, end_ts)
         db_records = self.db_manager.get_range_logs(station_no, start, end)
         logs = []
         for r in db_records:
@@ -54,136 +158,562 @@ class Analyzer:
             if isinstance(ts, str):
                 ts = datetime.fromisoformat(ts)
             logs.append(StationLog(ts, r['available_spaces']))
-        
-        self.range_cache[key] = logs
+
+        # 查詢期間有新資料併入重疊的時間桶時，結果可能少了新資料，不寫入快取
+        if self._range_version(start_ts, end_ts) == version:
+            self.range_cache.put(key, logs)
         return logs
 
-    # -------------------------------------------------
-    # 3. 每小時平均（使用快取中的過去七天快照）
-    # -------------------------------------------------
-    def get_hourly_avg(self, station_no: str):
-        if station_no in self.hourly_cache:
-            return self.hourly_cache[station_no]
+    def iter_logs_in_range(self, station_no: str, start: datetime, end: datetime):
+        """
+        串流版本的 get_logs_in_range (/range?format=ndjson)：依時間順序逐筆產生 StationLog，
+        快取未命中時直接由 DB 分片讀取並邊讀邊送出，不整批載入也不寫入 range_cache，
+        記憶體用量與範圍長度無關。
+        """
+        logs = self._cached_logs_in_range(station_no, start, end)
+        if logs is not None:
+            yield from logs
+            return
+        for r in self.db_manager.iter_range_logs(station_no, start, end):
+            ts = r['timestamp']
+            if isinstance(ts, str):
+                ts = datetime.fromisoformat(ts)
+            yield StationLog(ts, r['available_spaces'])
+
+    def data_version(self):
+        """
+        快照資料的版本 (時間點數量, 最新時間點)，有新快照併入或重新載入時才改變；
+        由資料內容決定，多個 worker 載入相同資料時版本一致，可直接作為 HTTP ETag。
+        """
+        with self._store_lock:
+            self._refresh_shared()
+            store = self.snapshot_store
+            n = len(store)
+            return n, (int(store.timestamps[n - 1]) if n else 0)
+
+    def cache_stats(self):
+        """各快取的使用量與命中 / 未命中 / 淘汰計數。"""
+        with self._store_lock:
+            self._refresh_shared()
+            store_stats = {
+                "timestamps": len(self.snapshot_store),
+                "stations": len(self.snapshot_store.station_nos),
+                "bytes": self.snapshot_store.nbytes,
+                "allocated_bytes": self.snapshot_store.allocated_nbytes,
+            }
+        return {
+            "snapshot_store": store_stats,
+            "snapshot_cache": self.snapshot_cache.stats(),
+            "range_cache": self.range_cache.stats(),
+            "response_cache": self.response_cache.stats(),
+            "single_flight": self._flights.stats(),
+        }
 
-        hourly_data = defaultdict(list)
+    def cached_response(self, key):
+        """已編碼的回應；尚未產生時回傳 None (不會呼叫 build)。"""
+        return self.response_cache.get(key)
 
-        for ts, snapshot in self.snapshot_cache.items():
-            hour = datetime.fromtimestamp(ts).hour
-            for item in snapshot:
-                if item["station_no"] == station_no:
-                    hourly_data[hour].append(item["available_spaces"])
+    def encoded_response(self, key, build):
+        """
+        取得預先序列化的回應內容；同一個 key 只呼叫 build() 並 encode / 壓縮一次。
+        :param key: 須包含資料版本 (例如 data_version())，資料改變時 key 也跟著改變
+        :param build: 產生回應資料 (dict / list) 的函式
+        """
+        body = self.response_cache.get(key)
+        if body is not None:
+            return body
 
-        result = [
-            round(sum(hourly_data[h]) / len(hourly_data[h]), 2) if hourly_data[h] else 0.0
-            for h in range(24)
+        def fill():
+            cached = self.response_cache.get(key, count=False)
+            if cached is not None:
+                return cached
+            encoded = EncodedBody(build())
+            self.response_cache.put(key, encoded)
+            return encoded
+
+        return self._flights.do(("response", key), fill)
+
+    def get_logs_downsampled(self, station_no: str, start: datetime, end: datetime,
+                             resolution=None, max_points=None, agg="avg", mode="bucket"):
+        """
+        降採樣的範圍查詢 (/range?resolution=... 或 ?max_points=...)，回傳格式與 format_logs_as_json 相同。
+        :param resolution: RESOLUTIONS 中的時間桶 (5m / 15m / 1h / 1d)
+        :param max_points: 最多回傳幾個點；與 resolution 同時指定時以 resolution 為準
+        :param agg: 時間桶內的彙總方式 avg / min / max / last
+        :param mode: "bucket" 依時間桶彙總；"lttb" 以 LTTB 挑選原始點 (需指定 max_points)
+        """
+        if mode == "bucket" and resolution in self.ROLLUP_RESOLUTIONS and agg in self.ROLLUP_AGGREGATES:
+            return self._downsample_from_rollup(station_no, start, end, resolution, agg)
+        return self._downsample_logs(station_no, start, end, resolution, max_points, agg, mode)
+
+    def _downsample_logs(self, station_no: str, start: datetime, end: datetime,
+                         resolution=None, max_points=None, agg="avg", mode="bucket"):
+        """以原始紀錄降採樣 (參數同 get_logs_downsampled)。"""
+        logs = self.get_logs_in_range(station_no, start, end)
+        timestamps = np.fromiter((int(log.timestamp.timestamp()) for log in logs), dtype=np.int64, count=len(logs))
+        values = np.fromiter((log.available_spaces for log in logs), dtype=np.float64, count=len(logs))
+
+        if mode == "lttb":
+            if not max_points:
+                raise ValueError("mode=lttb 需要指定 max_points")
+            return self.format_logs_as_json([logs[i] for i in lttb(timestamps, values, max_points)])
+        if mode != "bucket":
+            raise ValueError(f"不支援的 mode: {mode}")
+
+        start_ts, end_ts = int(start.timestamp()), int(end.timestamp())
+        if resolution is not None:
+            if resolution not in RESOLUTIONS:
+                raise ValueError(f"不支援的 resolution: {resolution}")
+            bucket_seconds = RESOLUTIONS[resolution]
+            # 固定解析度的桶對齊當地時間 (例如 1d 從當地午夜開始)
+            offset = int(start.astimezone().utcoffset().total_seconds())
+        elif max_points:
+            bucket_seconds = bucket_seconds_for(start_ts, end_ts, max_points)
+            # 桶從 start_ts 開始切，範圍內最多 max_points 個桶
+            offset = -start_ts
+        else:
+            raise ValueError("需要指定 resolution 或 max_points")
+
+        bucket_ts, result = bucket_aggregate(timestamps, values, bucket_seconds, agg, offset)
+        return self._format_buckets(bucket_ts.tolist(), result.tolist())
+
+    @staticmethod
+    def _format_buckets(bucket_ts, values):
+        return [
+            {"timestamp": datetime.fromtimestamp(ts).isoformat(), "available_spaces": round(v, 2)}
+            for ts, v in zip(bucket_ts, values)
         ]
 
-        self.hourly_cache[station_no] = result
-        return result
+    def _downsample_from_rollup(self, station_no: str, start: datetime, end: datetime, resolution, agg):
+        """
+        1h / 1d 的 avg / min / max：完整落在範圍內且已彙總完成的桶直接讀 station_hourly / station_daily，
+        只有頭尾不完整的桶 (以及彙總進度之後的資料) 才讀原始紀錄。
+        """
+        start_ts, end_ts = int(start.timestamp()), int(end.timestamp())
+        bucket_seconds = RESOLUTIONS[resolution]
+        offset = int(start.astimezone().utcoffset().total_seconds())
+        watermark = self.db_manager.get_rollup_watermark()
+
+        # [first_full, last_end) 為完整的桶：開始於範圍內，且結束不晚於範圍終點與彙總進度
+        first_full = -(-(start_ts + offset) // bucket_seconds) * bucket_seconds - offset
+        upper = end_ts if watermark is None else min(end_ts, watermark)
+        last_end = (upper + 1 + offset) // bucket_seconds * bucket_seconds - offset
+        if watermark is None or last_end <= first_full:
+            return self._downsample_logs(station_no, start, end, resolution=resolution, agg=agg)
+
+        def raw(lo, hi):
+            if lo > hi:
+                return []
+            return self._downsample_logs(station_no, datetime.fromtimestamp(lo), datetime.fromtimestamp(hi),
+                                         resolution=resolution, agg=agg)
+
+        column = self.ROLLUP_AGGREGATES[agg]
+        rows = self.db_manager.get_rollup_range(
+            station_no, datetime.fromtimestamp(first_full), datetime.fromtimestamp(last_end - 1),
+            self.ROLLUP_RESOLUTIONS[resolution],
+        )
+        middle = self._format_buckets([r['bucket_unix'] for r in rows], [float(r[column]) for r in rows])
+        return raw(start_ts, first_full - 1) + middle + raw(last_end, end_ts)
+
+    # -------------------------------------------------
+    # 2-1. 範圍彙總（/range/aggregate，讀取 station_hourly / station_daily）
+    # -------------------------------------------------
+    def get_aggregates_in_range(self, station_no: str, start: datetime, end: datetime, resolution="hour"):
+        if resolution not in self.db_manager.ROLLUP_TABLES:
+            raise ValueError(f"不支援的 resolution: {resolution}")
+
+        rows = self.db_manager.get_rollup_range(station_no, start, end, resolution)
+        return [{
+            "timestamp": datetime.fromtimestamp(r['bucket_unix']).isoformat(),
+            "count": r['sample_count'],
+            "min": r['min_available'],
+            "max": r['max_available'],
+            "avg": float(r['avg_available']),
+            "delta": r['delta_sum'],
+        } for r in rows]
+
+    # -------------------------------------------------
+    # 3. 每小時平均（使用快取中的過去七天快照）
+    # -------------------------------------------------
+    def get_hourly_avg(self, station_no: str):
+        with self._store_lock:
+            self._refresh_shared()
+            col = self.snapshot_store.station_index.get(station_no)
+            return self.hourly_rollup.hourly_avg(col)
 
     # -------------------------------------------------
     # 4. 每小時變化量（使用快取中的過去七天快照）
-     -------------------------------------------------
+    # -------------------------------------------------
     def get_hourly_avg_delta(self, station_no: str):
-        if station_no in self.delta_cache:
-            return self.delta_cache[station_no]
-
-        hourly_flow = defaultdict(float)
-        prev_spaces = None
-        prev_hour = None
-
-        for ts in sorted(self.snapshot_cache.keys()):
-            hour = datetime.fromtimestamp(ts).hour
-            item = next(
-                (it for it in self.snapshot_cache[ts] if it["station_no"] == station_no),
-                None,
-            )
-            if item:
-                curr = item["available_spaces"]
-                if prev_spaces is not None and prev_hour == hour:
-                    hourly_flow[hour] += abs(curr - prev_spaces)
-                prev_spaces = curr
-                prev_hour = hour
-
-        result = {h: round(hourly_flow[h], 2) for h in range(24)}
-        self.delta_cache[station_no] = result
-        return result
+        with self._store_lock:
+            self._refresh_shared()
+            col = self.snapshot_store.station_index.get(station_no)
+            return self.hourly_rollup.hourly_delta(col)
     # -------------------------------------------------
-    # 5. 背景更新：每30分鐘清空並重新載入所有快取
+    # 多站批次查詢：一次走訪 Analyzer 的陣列，回傳欄式 (columnar) 結果
+    # -------------------------------------------------
+    def get_hourly_avg_many(self, station_nos):
+        """:return: {"station_ids": [...], "hours": [0..23], "values": [[24 個平均], ...]}"""
+        with self._store_lock:
+            self._refresh_shared()
+            cols = [self.snapshot_store.station_index.get(sno) for sno in station_nos]
+            values = self.hourly_rollup.hourly_avg_many(cols)
+        return {"station_ids": list(station_nos), "hours": list(range(24)), "values": values}
+
+    def get_hourly_delta_many(self, station_nos):
+        """:return: {"station_ids": [...], "hours": [0..23], "values": [[24 個變化量], ...]}"""
+        with self._store_lock:
+            self._refresh_shared()
+            cols = [self.snapshot_store.station_index.get(sno) for sno in station_nos]
+            values = self.hourly_rollup.hourly_delta_many(cols)
+        return {"station_ids": list(station_nos), "hours": list(range(24)), "values": values}
+
+    def get_range_many(self, station_nos, start: datetime, end: datetime):
+        """
+        多站範圍查詢。範圍在預載的 snapshot_store 內時直接切出陣列，否則以一個 IN (...) 查詢向 DB 取得。
+        :return: {"station_ids": [...], "timestamps": [ISO 字串], "available_spaces": [[每站一列，缺值為 None], ...]}
+        """
+        start_ts, end_ts = int(start.timestamp()), int(end.timestamp())
+        station_nos = list(station_nos)
+
+        with self._store_lock:
+            self._refresh_shared()
+            store = self.snapshot_store
+            values = None
+            if len(store) and start_ts >= store.timestamps[0]:
+                timestamps, values = store.range_matrix(start_ts, end_ts, station_nos)
+                timestamps = timestamps.tolist()
+
+        if values is not None:
+            rows = [
+                [None if v == MISSING else v for v in column]
+                for column in values.T.tolist()
+            ]
+        else:
+            timestamps, series = self.db_manager.get_range_matrix(station_nos, start, end)
+            rows = [series[sno] for sno in station_nos]
+
+        return {
+            "station_ids": station_nos,
+            "timestamps": [datetime.fromtimestamp(ts).isoformat() for ts in timestamps],
+            "available_spaces": rows,
+        }
+
+    # -------------------------------------------------
+    # 5. 全部重置 (啟動時)；之後新資料改由失效通知 (_notify_data_changed) 只讓受影響的項目失效
     # -------------------------------------------------
     def refresh_all_cache(self):
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 開始更新快取...")
         #self.snapshot_cache.clear()
-        self.range_cache.clear()
-        self.hourly_cache.clear()
-        self.delta_cache.clear()
+        # 換上新的快取物件而不是就地清空：正在讀取舊快取的 request 不受影響
+        self.range_cache = BoundedCache("range", self._range_cache_bytes, ttl=3600)
         print("所有快取已更新完成")
 
     # -------------------------------------------------
     # 6. 上傳新資料後立即更新快取（讓最新一筆馬上可用）
     # -------------------------------------------------
+    def update_cache_after_upload(self, converted_data: dict, timestamp_unix: int):
+        """
+        將剛寫入 DB 的快照併入 snapshot_store 與 hourly_rollup，成本為 O(站點數)。
+        :param converted_data: Youbike_API._convert_youbike_full 的輸出
+        """
+        if self.shared_reader is not None:
+            # 共享記憶體為唯讀，由 loader 行程 sync_from_db 後重新發布
+            return
+        if not timestamp_unix or timestamp_unix in self.snapshot_store:
+            return
+
+        iso_str = datetime.fromtimestamp(timestamp_unix).isoformat().split('.')[0]
+        formatted_data = []
+        for station in converted_data.get("stations", []):
+            detail = station.get("available_spaces_detail", {})
+            formatted_data.append({
+                "station_no": station.get("station_no"),
+                "parking_spaces": station.get("parking_spaces"),
+                "available_spaces": station.get("available_spaces"),
+                "empty_spaces": station.get("empty_spaces"),
+                "yb2": detail.get("yb2", 0),
+                "eyb": detail.get("eyb", 0),
+                "forbidden_spaces": station.get("forbidden_spaces"),
+                "available_level": station.get("available_spaces_level"),
+                "timestamp": iso_str,
+            })
+        self._ingest_snapshot(timestamp_unix, formatted_data)
+
+    def _ingest_snapshot(self, timestamp_unix: int, formatted_data: list):
+        with self._store_lock:
+            if timestamp_unix in self.snapshot_store:
+                return
+            store = self.snapshot_store
+            in_order = not len(store) or timestamp_unix > store.timestamps[len(store) - 1]
+            if not in_order:
+                # 亂序插入會移動列索引，也會重建統計：先移除已自統計扣除的過期列
+                self._compact_window()
+            row = store.append(timestamp_unix, formatted_data)
+            self.snapshot_cache.pop(timestamp_unix)
+
+            if in_order:
+                n_st = len(store.station_nos)
+                values = store.columns["available_spaces"][row, :n_st]
+                self.hourly_rollup.add(timestamp_unix, int(store.hours[row]), values)
+                self._bump_stations(np.flatnonzero(values != MISSING))
+            else:
+                # 亂序的舊資料會打斷「上一筆」的順序，直接重建統計
+                self.hourly_rollup = HourlyRollup.from_store(store)
+                self._reset_station_versions()
+            self._slide_window()
+            self._notify_data_changed(timestamp_unix, timestamp_unix,
+                                      {r["station_no"] for r in formatted_data})
+
+    def _slide_window(self):
+        """
+        以最新時間點為終點維持 window_days 天的滾動視窗：
+        滑出視窗的列逐列自 hourly_rollup 扣除 (每列 O(站點數))，累積 EVICT_BATCH 列後再一次移除。
+        """
+        store = self.snapshot_store
+        if not len(store):
+            return
+        cutoff = int(store.timestamps[store.size - 1]) - self.window_days * 24 * 3600
+        n_st = len(store.station_nos)
+        while self._expired_rows < store.size and store.timestamps[self._expired_rows] < cutoff:
+            self.hourly_rollup.remove_row(store, self._expired_rows)
+            self._bump_stations(np.flatnonzero(store.columns["available_spaces"][self._expired_rows, :n_st] != MISSING))
+            self._expired_rows += 1
+        if self._expired_rows >= self.EVICT_BATCH:
+            self._compact_window()
+
+    def _compact_window(self):
+        """實際移除已自統計扣除的過期列，讓 snapshot_store 與 hourly_rollup 涵蓋相同的時間點。"""
+        if not self._expired_rows:
+            return
+        store = self.snapshot_store
+        store.evict_before(int(store.timestamps[self._expired_rows - 1]) + 1)
+        self._expired_rows = 0
+
+    def sync_from_db(self, days=None):
+        """
+        從 DB 補上 snapshot_store 最新時間點之後的所有快照 (例如其他 worker 經 /upload 寫入的資料)。
+        store 為空時從 days (預設 window_days) 天前開始。回傳補上的時間點數。
+        """
+        days = days or self.window_days
+        store = self.snapshot_store
+        now_ts = int(datetime.now().timestamp())
+        start_ts = int(store.timestamps[len(store) - 1]) + 1 if len(store) else now_ts - days * 24 * 3600
+
+        if len(store) and now_ts - start_ts > self.CATCHUP_BULK_SECONDS:
+            return self._bulk_catch_up(start_ts, now_ts)
+
+        synced = 0
+        for ts, state in self.db_manager.iter_snapshot_states(start_ts, now_ts,
+                                                            station_nos=self.db_manager.ALL_STATIONS):
+            self._ingest_snapshot(ts, list(state.values()))
+            synced += 1
+        return synced
+
+    def _bulk_catch_up(self, start_ts, end_ts):
+        """
+        落後較久 (例如從過期的 checkpoint 啟動) 時，以預熱的分段批次讀取補上缺口，
+        不逐時間點建立 dict；補完再整段接到 snapshot_store 後面並更新統計。
+        """
+        loaded = self._bulk_load(start_ts, end_ts, base=self.snapshot_store)
+        if loaded is None:
+            return 0
+        gap, _ = loaded
+        with self._store_lock:
+            store = self.snapshot_store
+            if len(store) and gap.timestamps[0] <= store.timestamps[len(store) - 1]:
+                # 讀取期間已有新資料寫入，缺口與現有資料重疊：只接上較新的部分
+                gap.evict_before(int(store.timestamps[len(store) - 1]) + 1)
+            rows = store.extend(gap)
+            n_st = len(store.station_nos)
+            for row in rows:
+                self.snapshot_cache.pop(int(store.timestamps[row]))
+                values = store.columns["available_spaces"][row, :n_st]
+                self.hourly_rollup.add(int(store.timestamps[row]), int(store.hours[row]), values)
+                self._bump_stations(np.flatnonzero(values != MISSING))
+            if len(rows):
+                self._slide_window()
+                self._notify_data_changed(int(store.timestamps[rows.start]),
+                                          int(store.timestamps[rows.stop - 1]), None)
+        return len(rows)
+
+    # -------------------------------------------------
+    # 7. 多 worker 共用：attach loader 行程發布的共享記憶體
+    # -------------------------------------------------
+    def attach_shared_store(self, name="youbike_snapshots"):
+        self.shared_reader = SharedStoreReader(name)
+        if not self._refresh_shared():
+            print(f"共享快照 {name} 尚未發布，等待 loader 行程")
+
+    def _refresh_shared(self):
+        if self.shared_reader is None:
+            return False
+        store = self.snapshot_store
+        prev_latest = int(store.timestamps[len(store) - 1]) if len(store) else None
+        if not self.shared_reader.refresh():
+            return False
+        self.snapshot_store = store = self.shared_reader.store
+        self.hourly_rollup = self.shared_reader.rollup
+        # loader 行程補上的新時間點：讓重疊的範圍快取失效 (本行程不會收到 update_cache_after_upload)
+        latest = int(store.timestamps[len(store) - 1]) if len(store) else None
+        if prev_latest is not None and latest is not None and latest > prev_latest:
+            self._notify_data_changed(prev_latest + 1, latest)
+        return True
+
+    # -------------------------------------------------
+    # 8. 啟動預熱：優先使用磁碟 checkpoint，只向 DB 補上 watermark 之後的資料
+    # -------------------------------------------------
+    def warm_start(self, checkpoint_path=None, days=None):
+        days = days or self.window_days
+        loaded = load_checkpoint(checkpoint_path) if checkpoint_path else None
+        window_start = int(datetime.now().timestamp()) - days * 24 * 3600
+        if not loaded or loaded[2] is None or loaded[2] < window_start:
+            # 沒有 checkpoint 或已整個落在視窗外，改為完整載入
+            self.load_previous_week_snapshots(days=days)
+            return
 
-    def load_previous_week_snapshots(self):
-    
-        # 1. 確定時間範圍
-        # 如果快取中有資料，以快取中最新的時間為終點，否則以現在時間為終點
-        #end_ts = max(self.snapshot_cache.keys()) if self.snapshot_cache else int(datetime.now().timestamp())
-        # 計算 7 天前的時間點
-        #start_ts = end_ts - 7 * 24 * 3600
+        start_time = time.time()
+        with self._store_lock:
+            self.snapshot_store, self.hourly_rollup, watermark = loaded
+            self._expired_rows = 0
+            self._reset_station_versions()
+        synced = self.sync_from_db(days=days)
+        with self._store_lock:
+            # checkpoint 中已滑出視窗的舊資料 (沒有新資料可補時 _ingest_snapshot 不會處理到)
+            self._slide_window()
+        print(
+            f"由 checkpoint 啟動（watermark {watermark}），共 {len(self.snapshot_store)} 個時間點，"
+            f"自 DB 補上 {synced} 個，耗時 {time.time() - start_time:.1f} 秒"
+        )
 
-        start_ts = int(datetime(2025, 12, 1, 0, 0, 0).timestamp())
-        end_ts = int(datetime(2025, 12, 8, 0, 0, 0).timestamp())
-        # 2. 取得所有在範圍內的唯一 timestamp
-        ts_query = """
-        SELECT DISTINCT timestamp_unix
-        FROM station_records
-        WHERE timestamp_unix >= %s AND timestamp_unix <= %s
-        ORDER BY timestamp_unix
+    def publish(self, publisher):
+        """
+        在 store 鎖內發布到共享記憶體 (loader 行程用；排程抓取的執行緒可能同時併入新快照)。
+        :return: 發布內容的 data_version
         """
-        timestamps = [row['timestamp_unix'] for row in 
-                    self.db_manager._execute_query(ts_query, (start_ts, end_ts), fetch_all=True)]
+        with self._store_lock:
+            publisher.publish(self.snapshot_store, self.hourly_rollup)
+            return self.data_version()
 
-        if not timestamps:
+    def save_checkpoint(self, checkpoint_path):
+        if self.shared_reader is not None:
+            # worker 不持有自己的資料，由 loader 行程負責
+            return None
+        with self._store_lock:
+            # checkpoint 只保存視窗內的列，與 hourly_rollup 的統計範圍一致
+            self._compact_window()
+            return save_checkpoint(checkpoint_path, self.snapshot_store, self.hourly_rollup)
+
+    def load_previous_week_snapshots(self, days=None, partitions=4, chunk_size=50000):
+        """
+        預熱：以「最近 days 天」的滾動視窗批次載入快照到新的 SnapshotStore。
+        - 時間範圍切成 partitions 段，各段一個依時間排序的不緩衝查詢，平行讀取
+        - 每 chunk_size 筆以向量化方式寫入陣列，不建立逐站 dict
+        - 全部讀完後依關鍵幀補值 (相容 delta 儲存模式)，再整個替換舊的 store
+        """
+        start_time = time.time()
+        days = days or self.window_days
+
+        # 1. 確定時間範圍：以現在時間為終點往前 days 天
+        end_ts = int(datetime.now().timestamp())
+        start_ts = end_ts - days * 24 * 3600
+
+        loaded = self._bulk_load(start_ts, end_ts, partitions, chunk_size)
+        if loaded is None:
             print("前一週無快照資料")
             return
+        store, total_rows = loaded
 
-        # 3. 定義單個 timestamp 的載入函數 (作為內部 helper 函式)
-        def load_single_snapshot(ts):
-            # 注意：這裡使用 fromisoformat().split('.')[0] 是為了確保格式化輸出，
-            # 其實也可以直接從 data_snapshots 表中獲取 timestamp_iso，但如果只存 timestamp_unix 則維持此邏輯。
-            iso_str = datetime.fromtimestamp(ts).isoformat().split('.')[0]
-        
-            # 查詢該時間點的所有站點記錄
-            query = """
-            SELECT station_no, parking_spaces, available_spaces, empty_spaces,
-                yb2, eyb, forbidden_spaces, available_level
-            FROM station_records
-            WHERE timestamp_unix = %s
-            """
-            rows = self.db_manager._execute_query(query, (ts,), fetch_all=True)
-        
-            # 格式化資料
-            formatted_data = [{
-                "station_no": row['station_no'],
-                "parking_spaces": row['parking_spaces'],
-                "available_spaces": row['available_spaces'],
-                "empty_spaces": row['empty_spaces'],
-                "yb2": row['yb2'],
-                "eyb": row['eyb'],
-                "forbidden_spaces": row['forbidden_spaces'],
-                "available_level": row['available_level'],
-                "timestamp": iso_str,
-            } for row in rows]
-        
-            return ts, formatted_data
+        # 整批替換，讀取端不會看到載入到一半的資料
+        rollup = HourlyRollup.from_store(store)
+        with self._store_lock:
+            self.snapshot_store = store
+            self.hourly_rollup = rollup
+            self._expired_rows = 0
+            self._reset_station_versions()
+        print(
+            f"前一週快照（{start_ts} ~ {end_ts}）已載入，共 {len(store)} 個時間點、"
+            f"{total_rows} 筆記錄，耗時 {time.time() - start_time:.1f} 秒"
+        )
 
-        # 使用 tqdm 顯示進度條
-        for ts in tqdm(timestamps, desc="載入前一週快照"):
-            ts_key, formatted_data = load_single_snapshot(ts)
-            self.snapshot_cache[ts_key] = formatted_data
+    def _bulk_load(self, start_ts, end_ts, partitions=4, chunk_size=50000, base=None):
+        """
+        把 [start_ts, end_ts] 的快照批次載入到新的 SnapshotStore (不動到 self.snapshot_store)。
+        base 為起點之前的 store 時，以其最後一列作為補值起點，省去 as-of 查詢。
+        :return: (store, 讀取的記錄數)；範圍內沒有快照時回傳 None
+        """
+        # 1. 取得範圍內的所有快照時間點
+        ticks = self.db_manager.get_snapshot_ticks(start_ts, end_ts)
+        if not ticks:
+            return None
+
+        timestamps = [t['timestamp_unix'] for t in ticks]
+        keyframes = [bool(t['is_keyframe']) for t in ticks]
+        store = SnapshotStore()
+        store.reserve_ticks(timestamps)
+
+        # 2. 第一個時間點若不是關鍵幀，先以 as-of 還原完整狀態作為補值的起點
+        if not keyframes[0] and base is None:
+            for ts, state in self.db_manager.iter_snapshot_states(timestamps[0], timestamps[0],
+                                                                station_nos=self.db_manager.ALL_STATIONS):
+                store.load_rows([
+                    (ts, sno, *(row[c] for c in self.db_manager.STATE_COLUMNS))
+                    for sno, row in state.items()
+                ], fields=self.db_manager.STATE_COLUMNS)
+
+        # 3. 依時間分段平行讀取；網路與解碼在各自執行緒，寫入陣列時持有鎖
+        write_lock = threading.Lock()
+        span = (timestamps[-1] - timestamps[0]) // partitions + 1
+        bounds = [
+            (timestamps[0] + i * span, min(timestamps[0] + (i + 1) * span - 1, timestamps[-1]))
+            for i in range(partitions)
+        ]
+
+        def load_partition(bound):
+            loaded_rows = 0
+            for chunk in self.db_manager.iter_record_chunks(*bound, chunk_size=chunk_size):
+                with write_lock:
+                    store.load_rows(chunk, fields=self.db_manager.STATE_COLUMNS)
+                loaded_rows += len(chunk)
+            return loaded_rows
+
+        with ThreadPoolExecutor(max_workers=partitions) as executor:
+            total_rows = sum(executor.map(load_partition, bounds))
+
+        if not keyframes[0] and base is not None:
+            store.seed_first_row(base)
+        store.fill_forward(keyframes)
+        return store, total_rows
 
-        print(f"前一週快照（{start_ts} ~ {end_ts}）已載入，共 {len(timestamps)} 個時間點") 
 
+    # -------------------------------------------------
+    # 9. 附近站點（/api/nearby）：空間索引 + station_latest 即時狀態
+    # -------------------------------------------------
+    def refresh_station_index(self, stations=None):
+        """
+        重建空間索引。通常註冊為 StationRegistry 的 listener，登錄資料變動時才呼叫。
+        :param stations: 站點登錄資料列表，省略時由 station_meta 讀取
+        """
+        if stations is None:
+            stations = self.db_manager.get_station_meta(active_only=True)
+        index = StationSpatialIndex(stations)
+        self.station_index = index
+        print(f"Analyzer: 空間索引已建立，共 {len(index)} 站")
+        return len(index)
+
+    def get_nearby_stations(self, lat: float, lng: float, radius=None, k=10):
+        """
+        :return: 依距離排序的站點列表，每站包含名稱、座標、距離 (公尺) 與最新的可借 / 可還數量
+        """
+        found = self.station_index.nearby(lat, lng, radius=radius, k=k)
+        latest = self.db_manager.get_latest_states([station["station_no"] for _, station in found])
+        result = []
+        for distance, station in found:
+            item = dict(station)
+            item["distance_m"] = round(distance, 1)
+            item.update(latest.get(station["station_no"], {}))
+            result.append(item)
+        return result
 
     def format_logs_as_json(self, logs):
         # 保持不變
@@ -194,3 +724,76 @@ class Analyzer:
                 "available_spaces": log.available_spaces
             } for log in logs
         ]
+
+    # -------------------------------------------------
+    # 10. 失效通知：由寫入路徑 (排程抓取、/upload、sync_from_db) 觸發，只影響與新資料重疊的部分
+    # -------------------------------------------------
+    def _notify_data_changed(self, start_ts, end_ts, station_nos=None):
+        """
+        [start_ts, end_ts] 內有新資料：遞增重疊時間桶的版本，並移除重疊的範圍快取。
+        :param station_nos: 有新資料的站點，None 表示所有站點
+        """
+        with self._store_lock:
+            self._data_seq += 1
+            for bucket in range(start_ts // self.RANGE_BUCKET, end_ts // self.RANGE_BUCKET + 1):
+                self._bucket_versions[bucket] = self._data_seq
+            self._prune_bucket_versions()
+
+        def overlaps(key):
+            cached_station, cached_start, cached_end = key
+            if cached_start > end_ts or cached_end < start_ts:
+                return False
+            return station_nos is None or cached_station is None or cached_station in station_nos
+
+        self.range_cache.invalidate(overlaps)
+
+    def _prune_bucket_versions(self):
+        """
+        只保留最近約 window_days 天的時間桶 (須持有 _store_lock)，數量超過兩倍時才整理一次。
+        被移除的桶只會讓進行中的查詢誤判為「有新資料」而不寫入快取，不會寫回舊結果。
+        """
+        keep = self.window_days * 24 * 3600 // self.RANGE_BUCKET
+        if len(self._bucket_versions) <= 2 * keep:
+            return
+        oldest = max(self._bucket_versions) - keep
+        for bucket in [b for b in self._bucket_versions if b < oldest]:
+            del self._bucket_versions[bucket]
+
+    def _range_version(self, start_ts, end_ts):
+        """[start_ts, end_ts] 涵蓋的時間桶中最後一次有新資料的序號；期間有新資料併入時一定變大。"""
+        lo, hi = start_ts // self.RANGE_BUCKET, end_ts // self.RANGE_BUCKET
+        with self._store_lock:
+            versions = self._bucket_versions
+            if hi - lo + 1 <= len(versions):
+                return max((versions.get(bucket, 0) for bucket in range(lo, hi + 1)), default=0)
+            return max((v for bucket, v in versions.items() if lo <= bucket <= hi), default=0)
+
+    def _bump_stations(self, cols):
+        """這些站點 (station_index 欄位) 的每小時統計已改變。"""
+        n_st = len(self.snapshot_store.station_nos)
+        if self._station_changes.shape[0] < n_st:
+            self._station_changes = np.pad(self._station_changes, (0, n_st - self._station_changes.shape[0]))
+        self._station_changes[cols] += 1
+
+    def _reset_station_versions(self):
+        """整批載入或重建統計後，以新的 data_version 作為所有站點版本的基準。"""
+        store = self.snapshot_store
+        n = len(store)
+        self._station_changes = np.zeros(len(store.station_nos), dtype=np.int64)
+        self._stats_epoch = (n, int(store.timestamps[n - 1]) if n else 0)
+
+    def station_version(self, station_nos):
+        """
+        站點每小時統計 (平均 / 變化量) 的版本，作為回應快取 key 與 ETag 的一部分；
+        只在這些站點的統計改變時才改變。多 worker 共享記憶體模式下退回 data_version()。
+        """
+        with self._store_lock:
+            self._refresh_shared()
+            if self.shared_reader is not None:
+                return self.data_version()
+            index = self.snapshot_store.station_index
+            changes = self._station_changes
+            cols = [index.get(sno) for sno in station_nos]
+            return self._stats_epoch + tuple(
+                int(changes[col]) if col is not None and col < changes.shape[0] else 0 for col in cols
+            )
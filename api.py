@@ -1,57 +1,145 @@
+import asyncio
+import hashlib
 import requests
 import json
 import time
-import random
 from math import radians, cos, sin, asin, sqrt
 # import os # 移除 os 相關操作
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from db_manager import DBManager # <-- 新增: 引入資料庫管理器
+from station_registry import StationRegistry
 # -------------------------
-# 擷取資料內retVal中的sno,data
+# 逐站抓取車輛資訊用的 token bucket 限速器
 # -------------------------
-# 函式 _fetch_station 保持不變，因為它只負責網路抓取，不涉及 JSON 讀寫。
-def _fetch_station(sno):
-    url = f"https://apis.youbike.com.tw/api/front/bike/lists?station_no={sno}"
-    headers = {"User-Agent": "Mozilla/5.0"}
-    try:
-        resp = requests.get(url, headers=headers, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        if isinstance(data.get("retVal"), list):
-            return sno, data["retVal"]
-        else:
-            return sno, data
-    except Exception as e:
-        return sno, {"error": str(e)}
+class TokenBucket:
+    """每秒補充 rate 個 token，最多累積 capacity 個；取不到 token 時非同步等待。"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
 
 
 # -------------------------
-# 解取官方文件中每一站的車輛資訊 by thread (修改為不存 JSON)
+# 擷取資料內retVal中的sno,data
 # -------------------------
-def get_all_bike_threaded(official_stations, max_workers=10):
-    start_time = time.time()  # 計時一次抓完時間用
-    station_nos = [item.get("sno") for item in official_stations]
+BIKE_LIST_URL = "https://apis.youbike.com.tw/api/front/bike/lists"
+
+
+async def _fetch_station(session, bucket, semaphore, sno):
+    url = BIKE_LIST_URL
+    async with semaphore:
+        await bucket.acquire()
+        try:
+            async with session.get(url, params={"station_no": sno}) as resp:
+                resp.raise_for_status()
+                data = await resp.json(content_type=None)
+            if isinstance(data.get("retVal"), list):
+                return sno, data["retVal"]
+            else:
+                return sno, data
+        except Exception as e:
+            return sno, {"error": str(e)}
+
+
+async def _batched_writer(queue, write_batch, batch_size, flush_interval):
+    """從 queue 取出結果，湊滿 batch_size 筆或等待超過 flush_interval 秒就寫入一次 (在執行緒中執行，不阻塞 event loop)。"""
+    loop = asyncio.get_running_loop()
+    batch = []
+    deadline = None
+    done = False
+    while not done:
+        timeout = None if deadline is None else max(0.0, deadline - loop.time())
+        try:
+            item = await asyncio.wait_for(queue.get(), timeout=timeout)
+            if item is None:
+                done = True
+            else:
+                if not batch:
+                    deadline = loop.time() + flush_interval
+                batch.append(item)
+        except asyncio.TimeoutError:
+            pass
+        if batch and (done or len(batch) >= batch_size or loop.time() >= deadline):
+            try:
+                await loop.run_in_executor(None, write_batch, batch)
+            except Exception as e:
+                print(f"批次寫入失敗 ({len(batch)} 筆): {e}")
+            batch = []
+            deadline = None
+
+
+async def fetch_all_bikes(official_stations, write_batch=None, concurrency=20, rate=10.0, burst=10,
+                          batch_size=100, flush_interval=1.0):
+    """
+    以 asyncio 抓取官方清單中每一站的車輛資訊。
+    - 共用一個 keep-alive 連線池，同時最多 concurrency 個請求
+    - token bucket 限制平均每秒 rate 個請求 (可瞬間 burst 個)，取代隨機 sleep
+    - write_batch(list of (sno, result)) 若有提供，結果會邊抓邊分批寫入
+    :param official_stations: StationRegistry.records() 的站點列表
+    """
+    import aiohttp
+
+    station_nos = [item.get("station_no") for item in official_stations]
     all_results = {}
+    bucket = TokenBucket(rate, burst)
+    semaphore = asyncio.Semaphore(concurrency)
+    queue = asyncio.Queue()
 
-    # 使用 ThreadPoolExecutor
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(_fetch_station, sno): sno for sno in station_nos}
+    writer = None
+    if write_batch is not None:
+        writer = asyncio.create_task(_batched_writer(queue, write_batch, batch_size, flush_interval))
 
-        for future in as_completed(futures):
-            sno, result = future.result()
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=30)
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                     headers={"User-Agent": "Mozilla/5.0"}) as session:
+        tasks = [asyncio.create_task(_fetch_station(session, bucket, semaphore, sno)) for sno in station_nos]
+        for task in asyncio.as_completed(tasks):
+            sno, result = await task
             all_results[sno] = result
-            print(
-                f"完成站點 {sno}, 車輛數: {len(result) if isinstance(result, list) else 'error'}"
-            )
-            time.sleep(random.uniform(0.3, 1.0))  # 控制速率，避免被封鎖(顯然沒什麼用)
+            if writer is not None:
+                queue.put_nowait((sno, result))
+
+    if writer is not None:
+        queue.put_nowait(None)
+        await writer
+    return all_results
+
 
-    end_time = time.time()
-    elapsed = end_time - start_time
+# -------------------------
+# 解取官方文件中每一站的車輛資訊 (asyncio，修改為不存 JSON)
+# -------------------------
+def get_all_bike_async(official_stations, db_manager: DBManager = None, **kwargs):
+    start_time = time.time()  # 計時一次抓完時間用
+    write_batch = None
+    if db_manager is not None:
+        sweep_ts = int(start_time)
+        write_batch = lambda batch: db_manager.save_station_bikes(sweep_ts, batch)
+
+    all_results = asyncio.run(fetch_all_bikes(official_stations, write_batch=write_batch, **kwargs))
+
+    errors = sum(1 for result in all_results.values() if not isinstance(result, list))
+    elapsed = time.time() - start_time
     print(f"執行時間: {elapsed:.4f} 秒")
-    print(f"完成！所有站點資料已擷取到記憶體中，數量: {len(all_results)}")
-    # 回傳擷取到的結果，以便上層呼叫者 (如 run 函式) 處理或寫入 DB
+    print(f"完成！所有站點資料已擷取到記憶體中，數量: {len(all_results)}，失敗: {errors}")
+    # 回傳擷取到的結果，以便上層呼叫者 (如 run 函式) 處理
     return all_results
+
+
 # -------------------------
 # 計算兩點距離 (公尺)
 # -------------------------
@@ -69,31 +157,23 @@ def haversine(lat1, lon1, lat2, lon2):
 
 
 # -------------------------
-# 抓官方高雄 YouBike JSON 
+# 官方高雄 YouBike 站點列表 (由 StationRegistry 維護，不再每次重新下載)
 # -------------------------
-def save_official_youbike(db_manager: DBManager):
+def save_official_youbike(registry: StationRegistry):
     """
-    抓取官方資料並寫入資料庫 (或僅回傳，因為 App.py 主要使用 Youbike_API 類別方法)
-    這裡假設我們只關心回傳資料，不保存官方靜態站點列表。
+    以條件請求向官方更新站點登錄資料 (未變動時不寫入 DB)，並回傳目前的站點列表。
     """
-    url = "https://api.kcg.gov.tw/Api/Service/Get/b4dd9c40-9027-4125-8666-06bef1756092"
-    headers = {"User-Agent": "Mozilla/5.0"}
-    try:
-        resp = requests.get(url, headers=headers, timeout=10)
-        resp.raise_for_status()
-        official_data_raw = resp.json()
-        official_data = official_data_raw["data"]["data"]["retVal"]
-
-        print(f"官方 JSON 已抓取, 站點數量: {len(official_data)}")
-        # 回傳站點列表和一個虛擬的檔案名 (或 None) 以保持簽名一致性
-        return official_data, None 
-    except Exception as e:
-        print("抓取官方資料失敗:", e)
-        return [], None
+    registry.refresh()
+    return load_official_youbike(registry)
         
-def load_official_youbike(db_manager: DBManager):
-    print("載入官方資料函式被呼叫，重新抓取最新官方站點列表...")
-    return save_official_youbike(db_manager) 
+def load_official_youbike(registry: StationRegistry):
+    """由記憶體中的站點登錄資料取得官方站點列表，不連網 (尚未載入時先由 DB 載入)。"""
+    if not len(registry):
+        registry.load()
+    official_data = registry.records()
+    print(f"官方站點登錄資料, 站點數量: {len(official_data)}")
+    # 回傳站點列表和一個虛擬的檔案名 (或 None) 以保持簽名一致性
+    return official_data, None
 
 # -------------------------
 # 抓自訂圓心範圍站點 (不涉及 JSON 讀寫，保持不變)
@@ -104,7 +184,7 @@ def get_youbike_stations():
 
 def get_all_bike(official_stations):
     """單執行緒版本，修改為不存 JSON"""
-    station_nos = [item.get("sno") for item in official_stations]
+    station_nos = [item.get("station_no") for item in official_stations]
     all_results = {}
     print(f"\n完成！所有站點已擷取到記憶體中，數量: {len(all_results)}")
     return all_results
@@ -113,15 +193,14 @@ def get_all_bike(official_stations):
 # -------------------------
 # 篩選自抓站點存在官方的站點 (修改為不存 JSON)
 # -------------------------
-def filter_against_official(local_stations, official_stations):
+def filter_against_official(local_stations, registry: StationRegistry):
     """
     篩選自抓站點存在官方的站點，並回傳結果，不再存成 JSON 檔案。
+    直接比對記憶體中的站點登錄資料，不重新抓取官方列表。
     """
-    #官方站點
-    official_station_nos = {item.get("sno") for item in official_stations}
     #只擷取與官方站點相同的
     filtered = [
-        s for s in local_stations if s.get("station_no") in official_station_nos
+        s for s in local_stations if s.get("station_no") in registry
     ]
     
     print(f"篩選完成，總站點數: {len(filtered)}")
@@ -130,10 +209,14 @@ def filter_against_official(local_stations, official_stations):
 
 
 class Youbike_API:
-    def __init__(self, YOUBIKE_API, db_manager: DBManager):
+    def __init__(self, YOUBIKE_API, db_manager: DBManager, registry: StationRegistry = None):
         self.YOUBIKE_API = YOUBIKE_API
+        self.registry = registry    # 站點登錄資料；抓到新站或座標變動時順便更新
         # 移除 self.DATASET_FOLDER
         self.db_manager = db_manager # <-- 新增: 儲存 DBManager 實例
+        # 上游變更偵測：上次寫入的回應雜湊，以及每站的來源更新時間 {sno: mday}
+        self._feed_digest = None
+        self._station_update_times = {}
 
     def get_YouBike2_API(self):
         """抓取原始 JSON，轉換格式，並寫入 MySQL 資料庫。"""
@@ -147,18 +230,65 @@ class Youbike_API:
             print(f"[{datetime.now().isoformat()}] 正在抓取 YouBike API 資料...")
             response = requests.get(self.YOUBIKE_API, headers=HEADERS, timeout=10)
             response.raise_for_status()
+
+            # 回應內容與上次完全相同：上游尚未更新，不必解析也不寫入
+            digest = hashlib.sha1(response.content).hexdigest()
+            if digest == self._feed_digest:
+                print("上游資料未更新 (雜湊相同)，略過寫入")
+                return
             raw_json = response.json()
 
+            update_times = self._station_update_times_of(raw_json)
+            changed_stations = self._changed_stations(update_times)
+            if not changed_stations:
+                # 雜湊不同但沒有任何站點的來源時間前進 (例如外層欄位變動)
+                print("上游資料未更新 (各站來源時間未變)，略過寫入")
+                self._feed_digest = digest
+                return
+
+            # 新站或站名 / 座標變動時更新登錄資料 (記憶體比對，沒有差異不寫 DB)
+            if self.registry is not None:
+                self.registry.observe(raw_json["data"]["data"]["retVal"])
+
             # 轉換格式，得到 {"timestamp": "...", "stations": [...]}
             converted = self._convert_youbike_full(raw_json)
 
             # 寫入 MySQL 資料庫
-            unix_timestamp = self.db_manager.save_snapshot(converted)
-            print(f"抓取完成，資料已成功寫入 DB, Unix Time: {unix_timestamp}")
-            
+            unix_timestamp = self.db_manager.save_snapshot(converted, changed_stations=changed_stations)
+            print(f"抓取完成，資料已成功寫入 DB, Unix Time: {unix_timestamp}，來源時間變動 {len(changed_stations)} 站")
+
+            # 寫入成功後才更新指紋，失敗時下一次排程會重試
+            self._feed_digest = digest
+            self._station_update_times = update_times
+
         except Exception as e:
             print(f"抓取、轉換或寫入 DB 失敗: {e}")
 
+    @staticmethod
+    def _station_update_times_of(raw_json):
+        """取出每站的來源更新時間 {sno: mday}；缺少時間欄位的站點為 None。"""
+        try:
+            retVal = raw_json["data"]["data"]["retVal"]
+        except KeyError:
+            raise ValueError("輸入 JSON 結構不符合預期，找不到 retVal")
+        return {
+            item.get("sno", ""): item.get("mday") or item.get("srcUpdateTime")
+            for item in retVal
+        }
+
+    def _changed_stations(self, update_times):
+        """
+        與上次寫入時的來源時間比較，回傳需要重新寫入的站點：
+        來源時間改變、新出現、沒有時間欄位 (無法判斷) 的站點，以及已消失的站點。
+        """
+        previous = self._station_update_times
+        changed = {
+            sno for sno, updated in update_times.items()
+            if updated is None or previous.get(sno) != updated
+        }
+        changed |= previous.keys() - update_times.keys()
+        return changed
+
     # 保持 _convert_youbike_full 函式不變，因為它只涉及運算邏輯和格式轉換
     def _convert_youbike_full(self, raw_json):
         """將原始 JSON 轉換成 stations 陣列格式，帶 timestamp"""
@@ -210,17 +340,18 @@ if __name__ == "__main__":
     }
 
     DB_MANAGER_STANDALONE = DBManager(DB_CONFIG_STANDALONE) 
+    REGISTRY_STANDALONE = StationRegistry(DB_MANAGER_STANDALONE)
 
 def run2():
     print(datetime.now())
-    official_stations, _ = save_official_youbike(DB_MANAGER_STANDALONE) # 這裡重新抓取
+    official_stations, _ = load_official_youbike(REGISTRY_STANDALONE) # 使用記憶體中的登錄資料，不重新抓取
     local_stations = get_youbike_stations()
-    filtered_stations, _ = filter_against_official(local_stations, official_stations)
+    filtered_stations, _ = filter_against_official(local_stations, REGISTRY_STANDALONE)
 
 def run():
     print(datetime.now())
-    official_stations, _ = save_official_youbike(DB_MANAGER_STANDALONE) # 這裡重新抓取
-    bike_details = get_all_bike_threaded(official_stations)
+    official_stations, _ = load_official_youbike(REGISTRY_STANDALONE) # 使用記憶體中的登錄資料，不重新抓取
+    bike_details = get_all_bike_async(official_stations, db_manager=DB_MANAGER_STANDALONE)
 
 # -------------------------
 # 主程式
@@ -229,6 +360,7 @@ if __name__ == "__main__":
     # 獨立執行時，使用 Youbike_API 類別來執行任務
     api_instance = Youbike_API(
         YOUBIKE_API="https://api.kcg.gov.tw:443/api/service/Get/b4dd9c40-9027-4125-8666-06bef1756092",
-        db_manager=DB_MANAGER_STANDALONE
+        db_manager=DB_MANAGER_STANDALONE,
+        registry=REGISTRY_STANDALONE
     )
     api_instance.get_YouBike2_API() # 呼叫主任務
@@ -2,6 +2,8 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import json 
 import os
+import math
+import hashlib
 import logging
 from logging.handlers import RotatingFileHandler
 from datetime import datetime
@@ -9,8 +11,12 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from analyzer import Analyzer 
 from api import Youbike_API 
 from db_manager import DBManager
+from station_registry import StationRegistry
+from http_cache import conditional, is_not_modified, make_etag, send_encoded, stream_ndjson, wants_ndjson, REVALIDATE
+from write_queue import WriteBehindQueue, WriteQueueFull, WriteQueueClosed
 from threading import Thread
 from functools import wraps
+import atexit
 import jwt
 
 # -------------------------
@@ -75,12 +81,32 @@ CORS(app)
 
 YOUBIKE_API = "https://api.kcg.gov.tw:443/api/service/Get/b4dd9c40-9027-4125-8666-06bef1756092"
 
+# standalone: 本行程自行載入前一週快照 (預設)
+# worker: 多 worker 部署時 attach cache_loader.py 發布的共享記憶體，不各自載入，
+#         排程抓取與維護工作也只由 cache_loader.py 執行
+CACHE_ROLE = os.environ.get("YOUBIKE_CACHE_ROLE", "standalone")
+
 # 創建資料庫管理器實例
-db_manager = DBManager(DB_CONFIG)
+# storage_mode="delta"：只寫入有變化的站點 (每小時一個完整關鍵幀)，可大幅縮小 station_records
+# delta 的差異基準 (_stored_state) 只存在單一行程內：worker 的 /upload 一律寫完整關鍵幀，
+# 多個行程同時寫入才不會產生互相矛盾的差異
+STORAGE_MODE = "full"
+db_manager = DBManager(DB_CONFIG, storage_mode="full" if CACHE_ROLE == "worker" else STORAGE_MODE)
+
+# 站點登錄資料 (站名、行政區、座標、車柱數)，常駐記憶體
+# worker 只讀 station_meta，不各自向官方抓取站點清單
+registry = StationRegistry(db_manager, read_only=CACHE_ROLE == "worker")
 
 # 將 DBManager 實例傳遞給 Analyzer 和 Youbike_API
 analyzer = Analyzer(db_manager=db_manager) 
-API = Youbike_API(YOUBIKE_API=YOUBIKE_API, db_manager=db_manager)
+API = Youbike_API(YOUBIKE_API=YOUBIKE_API, db_manager=db_manager, registry=registry)
+# 登錄資料變動時重建空間索引
+registry.add_listener(analyzer.refresh_station_index)
+
+# /upload 的 write-behind 佇列：request 只排入並回傳 ticket，由專屬執行緒合併寫入
+write_queue = WriteBehindQueue(db_manager, max_pending=256, max_batch=32)
+# 行程結束前把已排入的快照寫完
+atexit.register(write_queue.shutdown)
 
 # --- Token 驗證裝飾器 ---
 def token_required(f):
@@ -129,9 +155,22 @@ def preload_all_hourly_data():
         analyzer.get_hourly_avg_delta(station_no)
     
     print(f"預載完成，共 {len(stations)} 個站點")
+SHARED_STORE_NAME = os.environ.get("YOUBIKE_SHARED_STORE", "youbike_snapshots")
+# 快照 checkpoint：重啟時 mmap 此檔，只向 DB 補上之後的新資料
+CHECKPOINT_PATH = os.environ.get("YOUBIKE_CHECKPOINT", "./cache/snapshots.ckpt")
+
 with app.app_context():
+    # 既有資料庫尚未執行 migration 時補上快照寫入需要的欄位
+    db_manager.ensure_schema()
     analyzer.refresh_all_cache()
-    analyzer.load_previous_week_snapshots()
+    # station_latest 的記憶體鏡像：即時狀態與個人頁查詢直接讀 dict
+    db_manager.load_latest()
+    # 站點登錄資料 (載入後透過 listener 建立 /api/nearby 的空間索引)
+    registry.load()
+    if CACHE_ROLE == "worker":
+        analyzer.attach_shared_store(SHARED_STORE_NAME)
+    else:
+        analyzer.warm_start(CHECKPOINT_PATH)
     
 # -------------------------
 # API
@@ -144,64 +183,257 @@ def upload():
             return jsonify({"error": "Empty request body"}), 400
         raw_json = json.loads(raw_body)
         processed_data = API.process_raw_data(raw_json)
-        if not processed_data:
+        if not processed_data or not processed_data.get("stations"):
             return jsonify({"error": "No valid stations"}), 400
         
-        timestamp_unix = db_manager.save_snapshot(processed_data)
-        
-        # 立即更新快取，讓下一次呼叫馬上看到最新資料
-        analyzer.update_cache_after_upload(processed_data, timestamp_unix)
+        # 排入 write-behind 佇列；寫入提交後 save_snapshots 會呼叫 analyzer.update_cache_after_upload
+        ticket = write_queue.submit(processed_data)
         
         return jsonify({
-            "status": "ok",
-            "saved_timestamp": timestamp_unix,
-            "record_count": len(processed_data)
-        }), 200
+            "status": "accepted",
+            "ticket": ticket,
+            "record_count": len(processed_data["stations"])
+        }), 202
+    except WriteQueueFull as e:
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = "1"
+        return response, 429
+    except WriteQueueClosed as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/upload/status/<ticket>', methods=['GET'])
+def upload_status(ticket):
+    status = write_queue.status(ticket)
+    if status is None:
+        return jsonify({"error": "Unknown ticket"}), 404
+    return jsonify(status)
+
 # 以下路由由於調用的是 Analyzer 內的方法，且回傳格式不變，故不需要修改
 @app.route('/data/<ts>', methods=['GET'])
 def get_data(ts):
     try:
         dt = datetime.fromisoformat(ts)
-        # Analyzer 內部會改為從 DB 查詢
-        result = analyzer.get_snapshot_by_timestamp(dt) 
-        return jsonify(result)
+        ts_unix = int(dt.timestamp())
+        _, latest_ts = analyzer.data_version()
+        if ts_unix > latest_ts:
+            # 尚未發生的時間點不快取 (Analyzer 內部會改為從 DB 查詢)
+            return jsonify(registry.annotate(analyzer.get_snapshot_by_timestamp(dt)))
+        # 已寫入的歷史快照不會再變動，但回應帶有站名與行政區：以時間戳與站點清單摘要當 ETag，
+        # 每次使用前向伺服器確認 (登錄資料改變時才需重新下載)；回應內容預先序列化並壓縮，同一個快照只 encode 一次
+        key = ("snapshot", ts_unix, registry.content_tag)
+        etag = make_etag(*key)
+
+        def respond(build):
+            return conditional(
+                etag,
+                lambda: analyzer.encoded_response(key, build),
+                last_modified=ts_unix,
+                cache_control=REVALIDATE,
+                make_response=send_encoded,
+            )
+
+        def annotated(snapshot):
+            return registry.annotate([dict(row) for row in snapshot])
+
+        # 依序檢查 If-None-Match、時間點是否在記憶體中、已編碼的快取，都不需要還原整個快照
+        # (空結果不會帶 ETag 也不會進快取，符合的 ETag 一定來自有資料的回應)
+        in_store = analyzer.has_snapshot(ts_unix)
+        if is_not_modified(etag) or in_store or analyzer.cached_response(key) is not None:
+            return respond(lambda: annotated(analyzer.get_snapshot_by_timestamp(dt)))
+        if in_store is False:
+            # 記憶體涵蓋此時間但沒有這個快照；之後可能補進資料 (例如延遲的 /upload)，不快取
+            return jsonify([])
+
+        # 早於記憶體範圍：只有這裡需要先向 DB 取得快照才能判斷是否為空
+        snapshot = analyzer.get_snapshot_by_timestamp(dt)
+        if not snapshot:
+            return jsonify([])
+        return respond(lambda: annotated(snapshot))
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+# 批次查詢 (?ids=a,b,c) 一次最多幾站
+MAX_BATCH_IDS = 200
+# /range?max_points=... 的上限
+MAX_RANGE_POINTS = 10000
+
+def parse_station_ids(raw):
+    """'a,b,c' → 去除重複並保留順序的站號 list；超過 MAX_BATCH_IDS 時丟出 ValueError。"""
+    ids = list(dict.fromkeys(sid.strip() for sid in raw.split(',') if sid.strip()))
+    if not ids:
+        raise ValueError("ids 不可為空")
+    if len(ids) > MAX_BATCH_IDS:
+        raise ValueError(f"ids 最多 {MAX_BATCH_IDS} 個站點")
+    return ids
+
 @app.route('/range', methods=['GET'])
 def range_query():
     try:
         start = datetime.fromisoformat(request.args['start'])
         end = datetime.fromisoformat(request.args['end'])
         station_no = request.args.get('station_id')
-        
+
+        # ?ids=a,b,c：多站一次查詢，回傳欄式結果
+        if request.args.get('ids'):
+            station_nos = parse_station_ids(request.args['ids'])
+            return jsonify(analyzer.get_range_many(station_nos, start, end))
+
+        if not station_no:
+            return jsonify({"error": "需指定 station_id (多站請用 ids)"}), 400
+
+        # ?resolution=5m|15m|1h|1d 或 ?max_points=600：伺服器端降採樣
+        #   &agg=avg|min|max|last (時間桶彙總方式)，&mode=lttb 以 LTTB 保留曲線形狀
+        resolution = request.args.get('resolution')
+        max_points = int(request.args['max_points']) if request.args.get('max_points') else None
+        if resolution or max_points:
+            if max_points is not None and not 3 <= max_points <= MAX_RANGE_POINTS:
+                return jsonify({"error": f"max_points 需介於 3 與 {MAX_RANGE_POINTS} 之間"}), 400
+            return jsonify(analyzer.get_logs_downsampled(
+                station_no, start, end, resolution=resolution, max_points=max_points,
+                agg=request.args.get('agg', 'avg'), mode=request.args.get('mode', 'bucket'),
+            ))
+
+        # ?format=ndjson 或 Accept: application/x-ndjson：由 DB 分片邊讀邊送，不整批載入記憶體
+        if wants_ndjson():
+            return stream_ndjson(
+                {"timestamp": log.timestamp.isoformat(), "available_spaces": log.available_spaces}
+                for log in analyzer.iter_logs_in_range(station_no, start, end)
+            )
+
         # Analyzer 內部會改為從 DB 查詢
         logs = analyzer.get_logs_in_range(station_no, start, end)
         return jsonify(analyzer.format_logs_as_json(logs))
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@app.route('/range/aggregate', methods=['GET'])
+def range_aggregate():
+    try:
+        start = datetime.fromisoformat(request.args['start'])
+        end = datetime.fromisoformat(request.args['end'])
+        station_no = request.args.get('station_id')
+        resolution = request.args.get('resolution', 'hour')  # 'hour' 或 'day'
+
+        # 直接讀取彙總表，不掃描 station_records
+        return jsonify(analyzer.get_aggregates_in_range(station_no, start, end, resolution))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/hourly_avg', methods=['GET'])
+def hourly_avg_batch():
+    # /api/hourly_avg?ids=500101001,500101002
+    try:
+        station_nos = parse_station_ids(request.args.get('ids', ''))
+        _, latest_ts = analyzer.data_version()
+        version = analyzer.station_version(station_nos)
+        key = ("hourly_avg_many", tuple(station_nos), version)
+        digest = hashlib.sha1(repr((station_nos, version)).encode()).hexdigest()[:16]
+        return conditional(
+            make_etag("hourly_avg", digest),
+            lambda: analyzer.encoded_response(key, lambda: analyzer.get_hourly_avg_many(station_nos)),
+            last_modified=latest_ts,
+            make_response=send_encoded,
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/hourly_delta', methods=['GET'])
+def hourly_delta_batch():
+    try:
+        station_nos = parse_station_ids(request.args.get('ids', ''))
+        _, latest_ts = analyzer.data_version()
+        version = analyzer.station_version(station_nos)
+        key = ("hourly_delta_many", tuple(station_nos), version)
+        digest = hashlib.sha1(repr((station_nos, version)).encode()).hexdigest()[:16]
+        return conditional(
+            make_etag("hourly_delta", digest),
+            lambda: analyzer.encoded_response(key, lambda: analyzer.get_hourly_delta_many(station_nos)),
+            last_modified=latest_ts,
+            make_response=send_encoded,
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
 @app.route('/api/hourly_avg/<station_id>', methods=['GET'])
 def hourly_avg(station_id):
     try:
-        # Analyzer 內部會改為從 DB 查詢
-        avg = analyzer.get_hourly_avg(station_id) 
-        return jsonify(avg)
+        # 只有該站統計改變時才會改變，以站點版本當 ETag
+        _, latest_ts = analyzer.data_version()
+        version = analyzer.station_version([station_id])
+        return conditional(
+            make_etag("hourly_avg", station_id, *version),
+            lambda: analyzer.encoded_response(
+                ("hourly_avg", station_id, version), lambda: analyzer.get_hourly_avg(station_id)
+            ),
+            last_modified=latest_ts,
+            make_response=send_encoded,
+        )
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @app.route('/api/hourly_delta/<station_id>', methods=['GET'])
 def hourly_delta(station_id):
     try:
-        # Analyzer 內部會改為從 DB 查詢
-        delta = analyzer.get_hourly_avg_delta(station_id) 
-        return jsonify(delta)
+        _, latest_ts = analyzer.data_version()
+        version = analyzer.station_version([station_id])
+        return conditional(
+            make_etag("hourly_delta", station_id, *version),
+            lambda: analyzer.encoded_response(
+                ("hourly_delta", station_id, version), lambda: analyzer.get_hourly_avg_delta(station_id)
+            ),
+            last_modified=latest_ts,
+            make_response=send_encoded,
+        )
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@app.route('/api/stations/latest', methods=['GET'])
+def stations_latest():
+    # ?ids=500101001,500101002；省略時回傳所有站點
+    ids = request.args.get('ids')
+    station_nos = [sid for sid in ids.split(',') if sid] if ids else None
+    latest_ts = db_manager.latest_timestamp()
+
+    def build():
+        states = db_manager.get_latest_states(station_nos)
+        registry.annotate(states.values())
+        return states
+
+    etag = make_etag("latest", ids or "all", latest_ts, registry.content_tag) if latest_ts is not None else None
+    return conditional(etag, build, last_modified=latest_ts, cache_control=REVALIDATE)
+
+@app.route('/api/station/<station_id>/latest', methods=['GET'])
+def station_latest(station_id):
+    state = db_manager.get_latest_states([station_id]).get(station_id)
+    if state is None:
+        return jsonify({"error": "Unknown station"}), 404
+    registry.annotate([state])
+    return jsonify(state)
+
+@app.route('/api/nearby', methods=['GET'])
+def nearby():
+    # /api/nearby?lat=22.62&lng=120.30&radius=500&k=10 (radius 公尺，可省略)
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        radius = float(request.args['radius']) if request.args.get('radius') else None
+        k = int(request.args.get('k', 10))
+        if not (math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180):
+            return jsonify({"error": "lat / lng 超出範圍"}), 400
+        if k <= 0 or (radius is not None and not (math.isfinite(radius) and radius > 0)):
+            return jsonify({"error": "radius 與 k 必須大於 0"}), 400
+        return jsonify(analyzer.get_nearby_stations(lat, lng, radius=radius, k=k))
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    stats = analyzer.cache_stats()
+    stats["write_queue"] = write_queue.stats()
+    return jsonify(stats)
+
 @app.route('/api/user/click', methods=['POST'])
 @token_required # 套用裝飾器，此 API 會被保護
 def record_click(current_user_id):
@@ -264,6 +496,8 @@ def get_user_profile(current_user_id):
     """
     try:
         data = db_manager.get_user_activity(current_user_id)
+        registry.annotate(data["recent_stations"])
+        registry.annotate(data["favorite_stations"])
         return jsonify({
             "status": "success",
             "data": data
@@ -275,18 +509,61 @@ def empty():
     return "", 200  # 即使是空字串，也會帶上頭
 # 每分鐘執行一次
 scheduler = BackgroundScheduler()
-# # API.get_YouBike2_API 內部會執行資料擷取和寫入 DB
-scheduler.add_job(API.get_YouBike2_API, 'interval', minutes=1, coalesce=True, misfire_grace_time=30,)
-# scheduler.start()
-
 # Thread(target=preload_all_hourly_data, daemon=True).start()
+
+# 寫入與維護工作在多 worker 部署時只能有一個行程執行 (由 cache_loader.py 負責)：
+# 重複抓取會以不同時間戳寫入多份快照，compact_rollups 併發會重複累計彙總表
+if CACHE_ROLE != "worker":
+    # # API.get_YouBike2_API 內部會執行資料擷取和寫入 DB
+    scheduler.add_job(API.get_YouBike2_API, 'interval', minutes=1, coalesce=True, misfire_grace_time=30,)
+    # 每 5 分鐘將新資料增量彙總到 station_hourly / station_daily
+    scheduler.add_job(
+        func=db_manager.compact_rollups,
+        trigger="interval",
+        minutes=5,
+        coalesce=True,
+        max_instances=1,
+        misfire_grace_time=60
+    )
+    # 每 30 分鐘寫一次快照 checkpoint
+    scheduler.add_job(
+        func=analyzer.save_checkpoint,
+        args=[CHECKPOINT_PATH],
+        trigger="interval",
+        minutes=30,
+        coalesce=True,
+        max_instances=1,
+        misfire_grace_time=60
+    )
+    # 每 6 小時以條件請求比對官方站點清單，只寫入差異 (變動時 listener 會重建空間索引)
+    scheduler.add_job(
+        func=registry.refresh,
+        trigger="interval",
+        hours=6,
+        coalesce=True,
+        max_instances=1,
+        misfire_grace_time=60
+    )
+else:
+    # worker 只讀：每 6 小時由 station_meta 重新載入 loader 寫入的登錄資料
+    scheduler.add_job(
+        func=registry.load,
+        trigger="interval",
+        hours=6,
+        coalesce=True,
+        max_instances=1,
+        misfire_grace_time=60
+    )
+# 每分鐘重新載入 station_latest 鏡像 (唯讀，取得其他行程寫入的更新)
 scheduler.add_job(
-    func=analyzer.refresh_all_cache,
+    func=db_manager.load_latest,
     trigger="interval",
-    minutes=60,
+    minutes=1,
     coalesce=True,
-    misfire_grace_time=60
+    max_instances=1,
+    misfire_grace_time=30
 )
+# 不再定時清空 Analyzer 快取：新快照併入時由失效通知只移除重疊的範圍快取、更新受影響站點的版本
 scheduler.start()
 
 if __name__ == '__main__':
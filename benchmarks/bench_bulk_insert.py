@@ -0,0 +1,148 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bulk_writer import BulkWriter
+from db_manager import DBManager
+
+"""
+比較 station_records 各種大量寫入策略的吞吐量 (rows/s)。
+
+    # 連線實際的 MySQL (寫入 station_records_bench，結束時刪除)
+    YOUBIKE_DB="user:password@host:3306/database" python benchmarks/bench_bulk_insert.py
+    # 不連線，只量測 client 端組語句 / 產生 TSV 的成本
+    python benchmarks/bench_bulk_insert.py --offline
+"""
+
+BENCH_TABLE = "station_records_bench"
+
+
+def make_rows(n_rows, start_ts):
+    rng = random.Random(0)
+    n_st = 1500
+    rows = []
+    for i in range(n_rows):
+        ts = start_ts + (i // n_st) * 60
+        rows.append((ts, f"50{i % n_st:05d}", 30, rng.randint(0, 30), rng.randint(0, 30),
+                     rng.randint(0, 20), rng.randint(0, 10), 0, rng.randint(0, 100)))
+    return rows
+
+
+def parse_dsn(dsn):
+    credentials, location = dsn.rsplit("@", 1)
+    user, password = credentials.split(":", 1)
+    host_port, database = location.split("/", 1)
+    host, _, port = host_port.partition(":")
+    return {"user": user, "password": password, "host": host, "port": port or "3306",
+            "database": database, "allow_local_infile": True}
+
+
+class _RecordingCursor:
+    """--offline 用：與 mysql.connector 的 cursor 一樣逐一跳脫參數，但不送出。"""
+
+    def __init__(self):
+        from mysql.connector.conversion import MySQLConverter
+        self.converter = MySQLConverter()
+        self.statements = 0
+
+    def _encode(self, params):
+        conv = self.converter
+        return [conv.quote(conv.escape(conv.to_mysql(v))) for v in params]
+
+    def execute(self, sql, params=None):
+        self.statements += 1
+        if params:
+            self._encode(params)
+
+    def executemany(self, sql, rows):
+        # mysql.connector 會把 INSERT 的 executemany 改寫成多列 VALUES，逐列跳脫參數
+        self.statements += 1
+        for row in rows:
+            self._encode(row)
+
+
+def executemany_baseline(cursor, table, columns, rows):
+    """改版前 _write_snapshot 的寫法"""
+    cursor.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})", rows
+    )
+
+
+def run_offline(sizes, repeat):
+    writer = BulkWriter(local_infile=True)
+    columns = DBManager.RECORD_COLUMNS
+    for n_rows in sizes:
+        rows = make_rows(n_rows, 1_700_000_000)
+        print(f"\n{n_rows:,} 列 (自動選擇: {writer.choose(n_rows)})")
+        for name in ("executemany", "multi_values", "load_data", "staging"):
+            best = float("inf")
+            for _ in range(repeat):
+                cursor = _RecordingCursor()
+                t0 = time.perf_counter()
+                if name == "executemany":
+                    executemany_baseline(cursor, BENCH_TABLE, columns, rows)
+                else:
+                    writer.strategies[name].write(cursor, BENCH_TABLE, columns, rows)
+                best = min(best, time.perf_counter() - t0)
+            print(f"  {name:<13} {n_rows / best:>14,.0f} rows/s (client 端，{cursor.statements} 個語句)")
+
+
+def run_mysql(db_config, sizes, repeat):
+    import mysql.connector
+
+    writer = BulkWriter(local_infile=True)
+    columns = DBManager.RECORD_COLUMNS
+    conn = mysql.connector.connect(**db_config)
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+    cursor.execute(f"CREATE TABLE {BENCH_TABLE} LIKE station_records")
+    try:
+        for n_rows in sizes:
+            rows = make_rows(n_rows, 1_700_000_000)
+            print(f"\n{n_rows:,} 列 (自動選擇: {writer.choose(n_rows)})")
+            for name in ("executemany", "multi_values", "load_data", "staging"):
+                best = float("inf")
+                for _ in range(repeat):
+                    cursor.execute(f"TRUNCATE TABLE {BENCH_TABLE}")
+                    t0 = time.perf_counter()
+                    try:
+                        if name == "executemany":
+                            executemany_baseline(cursor, BENCH_TABLE, columns, rows)
+                        else:
+                            writer.strategies[name].write(cursor, BENCH_TABLE, columns, rows)
+                        conn.commit()
+                    except mysql.connector.Error as err:
+                        conn.rollback()
+                        print(f"  {name:<13} 失敗: {err}")
+                        break
+                    best = min(best, time.perf_counter() - t0)
+                else:
+                    print(f"  {name:<13} {n_rows / best:>14,.0f} rows/s")
+    finally:
+        cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        cursor.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="500,5000,50000")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--offline", action="store_true")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    dsn = os.environ.get("YOUBIKE_DB")
+    if args.offline or not dsn:
+        if not args.offline:
+            print("未設定 YOUBIKE_DB，只執行 --offline 量測")
+        run_offline(sizes, args.repeat)
+    else:
+        run_mysql(parse_dsn(dsn), sizes, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
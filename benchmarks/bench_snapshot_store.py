@@ -0,0 +1,109 @@
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from snapshot_store import SnapshotStore
+
+"""比較舊版 snapshot_cache (list of dict) 與 SnapshotStore 的記憶體與延遲 (使用合成資料，不需連線 DB)"""
+
+
+def make_snapshots(n_ts, n_st, start_ts):
+    rng = random.Random(0)
+    for i in range(n_ts):
+        ts = start_ts + i * 60
+        iso_str = datetime.fromtimestamp(ts).isoformat().split('.')[0]
+        yield ts, [{
+            "station_no": f"50{j:05d}",
+            "parking_spaces": 30,
+            "available_spaces": rng.randint(0, 30),
+            "empty_spaces": rng.randint(0, 30),
+            "yb2": rng.randint(0, 20),
+            "eyb": rng.randint(0, 10),
+            "forbidden_spaces": 0,
+            "available_level": rng.randint(0, 100),
+            "timestamp": iso_str,
+        } for j in range(n_st)]
+
+
+# 舊版 Analyzer 的實作 (逐筆走訪 dict)
+def legacy_hourly_avg(cache, station_no):
+    hourly_data = defaultdict(list)
+    for ts, snapshot in cache.items():
+        hour = datetime.fromtimestamp(ts).hour
+        for item in snapshot:
+            if item["station_no"] == station_no:
+                hourly_data[hour].append(item["available_spaces"])
+    return [
+        round(sum(hourly_data[h]) / len(hourly_data[h]), 2) if hourly_data[h] else 0.0
+        for h in range(24)
+    ]
+
+
+def legacy_hourly_delta(cache, station_no):
+    hourly_flow = defaultdict(float)
+    prev_spaces = None
+    prev_hour = None
+    for ts in sorted(cache.keys()):
+        hour = datetime.fromtimestamp(ts).hour
+        item = next((it for it in cache[ts] if it["station_no"] == station_no), None)
+        if item:
+            curr = item["available_spaces"]
+            if prev_spaces is not None and prev_hour == hour:
+                hourly_flow[hour] += abs(curr - prev_spaces)
+            prev_spaces = curr
+            prev_hour = hour
+    return {h: round(hourly_flow[h], 2) for h in range(24)}
+
+
+def timed(fn, *args, repeat=3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--timestamps", type=int, default=1440)
+    parser.add_argument("--stations", type=int, default=1000)
+    args = parser.parse_args()
+    start_ts = int(datetime(2025, 12, 1).timestamp())
+
+    tracemalloc.start()
+    cache = dict(make_snapshots(args.timestamps, args.stations, start_ts))
+    legacy_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    store = SnapshotStore()
+    for ts, rows in make_snapshots(args.timestamps, args.stations, start_ts):
+        store.append(ts, rows)
+
+    station_no = f"50{args.stations // 2:05d}"
+    ts = start_ts + (args.timestamps // 2) * 60
+
+    print(f"{args.timestamps} 個時間點 × {args.stations} 站")
+    print(f"記憶體   legacy: {legacy_bytes / 2**20:10.1f} MiB   store: {store.nbytes / 2**20:10.1f} MiB"
+          f" (已配置 {store.allocated_nbytes / 2**20:.1f} MiB)")
+
+    for name, legacy, columnar in [
+        ("hourly_avg", lambda: legacy_hourly_avg(cache, station_no), lambda: store.hourly_avg(station_no)),
+        ("hourly_delta", lambda: legacy_hourly_delta(cache, station_no), lambda: store.hourly_delta(station_no)),
+        ("snapshot", lambda: cache[ts], lambda: store.get_snapshot(ts)),
+    ]:
+        t_old, r_old = timed(legacy)
+        t_new, r_new = timed(columnar)
+        assert r_old == r_new, name
+        print(f"{name:<13} legacy: {t_old * 1000:10.2f} ms   store: {t_new * 1000:10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+from collections import OrderedDict
+import sys
+import threading
+import time
+
+"""有容量上限 (位元組) 與 TTL 的 LRU 快取，並提供命中 / 未命中 / 淘汰計數"""
+
+
+def estimate_size(value, _depth=0):
+    """
+    粗估物件佔用的位元組數。
+    list / tuple 只抽樣第一個元素再乘以長度，避免對大型結果逐一走訪。
+    """
+    size = sys.getsizeof(value)
+    if _depth > 3:
+        return size
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        if value:
+            size += len(value) * estimate_size(value[0], _depth + 1)
+    elif hasattr(value, "__dict__"):
+        size += estimate_size(vars(value), _depth + 1)
+    return size
+
+
+class BoundedCache:
+    """
+    執行緒安全的 LRU 快取：
+    - max_bytes: 所有項目估計大小的總上限，超過時由最久未使用的項目開始淘汰
+    - ttl: 預設存活秒數 (None 表示不過期)，put 時可針對單一項目覆寫
+    """
+
+    def __init__(self, name, max_bytes, ttl=None, sizeof=estimate_size):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self._entries = OrderedDict()   # {key: (value, size, expires_at)}
+        self._lock = threading.RLock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key, default=None, count=True):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[0]
+
+    def lookup(self, key, covers=None):
+        """
+        先找完全相同的 key；找不到時以 covers(cached_key) 找出可重用的項目 (例如涵蓋的範圍)。
+        每次呼叫只計一次命中或未命中。
+        :return: (命中的 key, value)，未命中時為 (None, None)
+        """
+        with self._lock:
+            value = self.get(key, count=False)
+            if value is not None:
+                self.hits += 1
+                return key, value
+            if covers is not None:
+                for cached_key in list(self._entries.keys()):
+                    if not covers(cached_key):
+                        continue
+                    value = self.get(cached_key, count=False)
+                    if value is not None:
+                        self.hits += 1
+                        return cached_key, value
+            self.misses += 1
+            return None, None
+
+    def put(self, key, value, ttl=None, size=None):
+        size = self.sizeof(value) if size is None else size
+        if size > self.max_bytes:
+            # 單一項目就超過上限，不快取
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, size, expires_at)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries[key][0]
+            self._drop(key)
+            return value
+
+    def invalidate(self, predicate):
+        """移除所有 predicate(key) 為真的項目 (例如與新資料時間重疊的範圍)，回傳移除的數量。"""
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                self._drop(key)
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def keys(self):
+        """目前所有 key 的快照 (不影響 LRU 順序)。"""
+        with self._lock:
+            return list(self._entries.keys())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,156 @@
+from itertools import chain
+import os
+import tempfile
+import mysql.connector
+
+"""大量寫入 station_records 等資料表的策略：多列 VALUES、LOAD DATA LOCAL INFILE、暫存表 INSERT ... SELECT"""
+
+# 使用方式：
+#   writer = BulkWriter(local_infile=True)
+#   writer.write(cursor, "station_records", columns, rows)   # 依筆數自動挑選策略
+#   writer.write(cursor, ..., strategy="staging")             # 或指定策略
+# 所有策略都只用呼叫端給的 cursor，不會 commit，交易由呼叫端控制。
+
+# LOAD DATA 暫存檔優先放在 tmpfs (記憶體)，沒有時才用系統暫存目錄
+_INFILE_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def _insert_prefix(table, columns, ignore=False):
+    return f"INSERT {'IGNORE ' if ignore else ''}INTO {table} ({', '.join(columns)}) VALUES "
+
+
+class MultiValuesStrategy:
+    """每 chunk_size 列組成一個 INSERT ... VALUES (...), (...) 語句，少量資料時延遲最低。"""
+
+    name = "multi_values"
+
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+
+    def write(self, cursor, table, columns, rows, ignore=False):
+        row_placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        prefix = _insert_prefix(table, columns, ignore)
+        full_sql = prefix + ", ".join([row_placeholder] * self.chunk_size)
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = rows[start:start + self.chunk_size]
+            if len(chunk) == self.chunk_size:
+                sql = full_sql
+            else:
+                sql = prefix + ", ".join([row_placeholder] * len(chunk))
+            cursor.execute(sql, tuple(chain.from_iterable(chunk)))
+        return len(rows)
+
+
+class LoadDataStrategy:
+    """
+    把資料寫成 TSV 後以 LOAD DATA LOCAL INFILE 一次送出，大量資料時吞吐量最高。
+    需要伺服器 local_infile=ON 且連線設定 allow_local_infile=True。
+    mysql.connector 只接受檔案路徑，因此暫存檔放在 tmpfs 上。
+    """
+
+    name = "load_data"
+
+    @staticmethod
+    def _field(value):
+        if value is None:
+            return "\\N"
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+    def _tsv(self, columns, rows):
+        # 快速路徑：整批以一個格式字串組出；只有含 NULL 或需要跳脫字元時才逐欄處理
+        line = "\t".join(["%s"] * len(columns)) + "\n"
+        if not any(None in row for row in rows):
+            text = "".join([line % row for row in rows])
+            if ("\\" not in text and text.count("\n") == len(rows)
+                    and text.count("\t") == len(rows) * (len(columns) - 1)):
+                return text
+        field = self._field
+        return "".join(["\t".join(map(field, row)) + "\n" for row in rows])
+
+    def write(self, cursor, table, columns, rows, ignore=False):
+        fd, path = tempfile.mkstemp(prefix="bulk_", suffix=".tsv", dir=_INFILE_DIR)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                f.write(self._tsv(columns, rows))
+            cursor.execute(
+                f"LOAD DATA LOCAL INFILE '{path}' {'IGNORE ' if ignore else ''}INTO TABLE {table} "
+                f"CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+                f"({', '.join(columns)})"
+            )
+        finally:
+            os.remove(path)
+        return len(rows)
+
+
+class StagingTableStrategy:
+    """
+    先寫入連線專屬的暫存表，再以一個 INSERT ... SELECT 搬進正式表：
+    大量回補時正式表只承受一個語句，鎖定時間集中，且失敗時不會留下部分資料。
+    """
+
+    name = "staging"
+
+    def __init__(self, loader=None):
+        self.loader = loader or MultiValuesStrategy(chunk_size=5000)
+
+    def write(self, cursor, table, columns, rows, ignore=False):
+        staging = f"_staging_{table}"
+        column_list = ", ".join(columns)
+        # CREATE TEMPORARY TABLE 不會造成隱含 commit，只存在於這條連線
+        cursor.execute(f"CREATE TEMPORARY TABLE IF NOT EXISTS {staging} LIKE {table}")
+        try:
+            self.loader.write(cursor, staging, columns, rows)
+            cursor.execute(
+                f"INSERT {'IGNORE ' if ignore else ''}INTO {table} ({column_list}) "
+                f"SELECT {column_list} FROM {staging}"
+            )
+        finally:
+            cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging}")
+        return len(rows)
+
+
+class BulkWriter:
+    """
+    依批次筆數挑選寫入策略：
+    - 少於 small_batch 列：多列 VALUES (單一語句、沒有額外檔案或資料表)
+    - 其餘：LOAD DATA LOCAL INFILE (若可用)，否則達 staging_batch 列時走暫存表，再否則仍用多列 VALUES
+    LOAD DATA 第一次因伺服器未開放而失敗時會自動停用，之後改走其他策略。
+    """
+
+    def __init__(self, local_infile=False, small_batch=2000, staging_batch=20000, chunk_size=1000):
+        self.small_batch = small_batch
+        self.staging_batch = staging_batch
+        self.strategies = {
+            "multi_values": MultiValuesStrategy(chunk_size),
+            "load_data": LoadDataStrategy(),
+            "staging": StagingTableStrategy(),
+        }
+        self.local_infile = local_infile
+
+    def choose(self, n_rows):
+        if n_rows < self.small_batch:
+            return "multi_values"
+        if self.local_infile:
+            return "load_data"
+        if n_rows >= self.staging_batch:
+            return "staging"
+        return "multi_values"
+
+    def write(self, cursor, table, columns, rows, strategy=None, ignore=False):
+        """
+        :param rows: list of tuple，順序與 columns 相同
+        :param strategy: None 表示依筆數自動挑選
+        :return: 寫入的列數
+        """
+        if not rows:
+            return 0
+        name = strategy or self.choose(len(rows))
+        try:
+            return self.strategies[name].write(cursor, table, columns, rows, ignore=ignore)
+        except (mysql.connector.DatabaseError, mysql.connector.InterfaceError) as err:
+            if name != "load_data" or strategy is not None:
+                raise
+            # 伺服器或連線未開放 LOCAL INFILE (例如 errno 1148 / 3948 / 2068)：停用並改用其他策略
+            print(f"BulkWriter: LOAD DATA LOCAL INFILE 無法使用，改用其他策略: {err}")
+            self.local_infile = False
+            return self.write(cursor, table, columns, rows, ignore=ignore)
@@ -0,0 +1,84 @@
+import os
+import signal
+import threading
+from datetime import datetime
+from apscheduler.schedulers.background import BackgroundScheduler
+from analyzer import Analyzer
+from api import Youbike_API
+from db_manager import DBManager
+from shared_store import SharedStorePublisher
+from station_registry import StationRegistry
+
+"""
+獨立的快照 loader 行程：載入前一週快照後發布到共享記憶體，之後定期從 DB 補上新資料並重新發布。
+app.py 以 YOUBIKE_CACHE_ROLE=worker 啟動時只 attach 這裡發布的資料，不再各自載入一份。
+多 worker 部署時只有這個行程執行排程抓取、彙總表壓縮與站點清單更新 (單一寫入者)。
+
+    python cache_loader.py
+    YOUBIKE_CACHE_ROLE=worker gunicorn -w 4 app:app
+"""
+
+# ⚠️ **請根據您的環境修改這些連線設定**
+DB_CONFIG = {
+    "user": "USER_NAME",
+    "password": "PASSWORD",
+    "host": "IP_ADDRESS",
+    "database": "DATABASE",
+    "port": "PORT",
+}
+
+SHARED_STORE_NAME = os.environ.get("YOUBIKE_SHARED_STORE", "youbike_snapshots")
+CHECKPOINT_PATH = os.environ.get("YOUBIKE_CHECKPOINT", "./cache/snapshots.ckpt")
+YOUBIKE_API = "https://api.kcg.gov.tw:443/api/service/Get/b4dd9c40-9027-4125-8666-06bef1756092"
+STORAGE_MODE = "full"       # 與 app.py 相同
+REFRESH_SECONDS = 60
+CHECKPOINT_EVERY = 30       # 每幾次更新寫一次 checkpoint
+
+
+def main():
+    db_manager = DBManager(DB_CONFIG, storage_mode=STORAGE_MODE)
+    analyzer = Analyzer(db_manager=db_manager)
+    registry = StationRegistry(db_manager)
+    api = Youbike_API(YOUBIKE_API=YOUBIKE_API, db_manager=db_manager, registry=registry)
+    publisher = SharedStorePublisher(SHARED_STORE_NAME)
+
+    stop_event = threading.Event()
+
+    def stop(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    db_manager.ensure_schema()
+    registry.load()
+    analyzer.warm_start(CHECKPOINT_PATH)
+    published = analyzer.publish(publisher)
+
+    # 寫入與維護工作 (worker 行程不會執行)；抓取的快照經 snapshot listener 直接併入本行程的 analyzer
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(api.get_YouBike2_API, 'interval', minutes=1, coalesce=True, max_instances=1, misfire_grace_time=30)
+    scheduler.add_job(db_manager.compact_rollups, 'interval', minutes=5, coalesce=True, max_instances=1, misfire_grace_time=60)
+    scheduler.add_job(registry.refresh, 'interval', hours=6, coalesce=True, max_instances=1, misfire_grace_time=60)
+    scheduler.start()
+
+    rounds = 0
+    try:
+        while not stop_event.wait(REFRESH_SECONDS):
+            # worker 經 /upload 寫入的快照由 DB 補上
+            synced = analyzer.sync_from_db()
+            if synced:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 補上 {synced} 個時間點")
+            if analyzer.data_version() != published:
+                published = analyzer.publish(publisher)
+            rounds += 1
+            if rounds % CHECKPOINT_EVERY == 0:
+                analyzer.save_checkpoint(CHECKPOINT_PATH)
+    finally:
+        scheduler.shutdown(wait=False)
+        analyzer.save_checkpoint(CHECKPOINT_PATH)
+        publisher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import os
+import time
+import numpy as np
+from snapshot_store import export_layout, write_layout, import_layout
+
+"""將 SnapshotStore / HourlyRollup 存成單一二進位檔，重啟時以 mmap 直接對映，只需向 DB 補上 watermark 之後的資料"""
+
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(path, store, rollup):
+    """先寫入暫存檔再 os.replace，讀取端不會看到寫到一半的檔案。回傳 watermark (最後一個 timestamp_unix)。"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    header, placed, total = export_layout(
+        store, rollup, extra_meta={"version": CHECKPOINT_VERSION, "saved_at": int(time.time())}
+    )
+    tmp_path = f"{path}.tmp"
+    mm = np.memmap(tmp_path, dtype=np.uint8, mode="w+", shape=(total,))
+    write_layout(memoryview(mm), header, placed)
+    mm.flush()
+    del mm
+    os.replace(tmp_path, path)
+
+    watermark = int(store.timestamps[len(store) - 1]) if len(store) else None
+    print(f"Checkpoint: 已寫入 {path} ({total / 2**20:.1f} MiB，watermark {watermark})")
+    return watermark
+
+
+def load_checkpoint(path):
+    """
+    以 copy-on-write 方式 mmap checkpoint：開啟成本與檔案大小無關，之後寫入的新資料不會改到檔案。
+    :return: (store, rollup, watermark)；檔案不存在或版本不符時回傳 None
+    """
+    if not os.path.exists(path):
+        return None
+    mm = np.memmap(path, dtype=np.uint8, mode="c")
+    store, rollup, meta = import_layout(memoryview(mm), writeable=True)
+    if meta.get("version") != CHECKPOINT_VERSION:
+        print(f"Checkpoint: {path} 版本不符，忽略")
+        return None
+    watermark = int(store.timestamps[len(store) - 1]) if len(store) else None
+    return store, rollup, watermark
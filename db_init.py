@@ -1,6 +1,11 @@
 import mysql.connector
 from mysql.connector import errorcode
+from datetime import datetime
+import argparse
 import getpass
+import json
+import os
+import time
 
 """初始化資料庫"""
 
@@ -21,7 +26,10 @@ TABLES['data_snapshots'] = (
     CREATE TABLE data_snapshots (
         timestamp_unix INT UNSIGNED NOT NULL PRIMARY KEY,
         timestamp_iso DATETIME,
-        record_count INT UNSIGNED
+        record_count INT UNSIGNED,
+        -- 1 = 此時間點寫入了所有站點 (關鍵幀)；0 = delta 模式下只寫入有變化的站點
+        -- 既有資料庫由 migration 001 加入此欄位 (python db_init.py migrate)
+        is_keyframe TINYINT(1) NOT NULL DEFAULT 1
     ) ENGINE=InnoDB
     """
 )
@@ -43,6 +51,8 @@ TABLES['station_records'] = (
         
         -- 複合索引，用於加快時間點和站點編號的查詢
         INDEX idx_timestamp_station (timestamp_unix, station_no),
+        -- 站點優先的索引，單站時間序列查詢只掃描連續的一段 (既有資料庫由 migration 002 / 005 加入)
+        INDEX idx_station_time (station_no, timestamp_unix),
         
         -- 外鍵約束：確保每筆記錄都對應一個有效的快照時間
         FOREIGN KEY (timestamp_unix)
@@ -76,6 +86,85 @@ TABLES['user_favorite_stations'] = (
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """
 )
+
+# 3. 每小時 / 每日彙總表 (由 DBManager.compact_rollups 從 station_records 增量填入)
+ROLLUP_TABLE_DDL = """
+    CREATE TABLE {name} (
+        station_no VARCHAR(10) NOT NULL,
+        bucket_unix INT UNSIGNED NOT NULL,          -- 區間起始時間 (整點 / 當日 00:00)
+        sample_count INT UNSIGNED NOT NULL,
+        sum_available INT UNSIGNED NOT NULL,
+        min_available SMALLINT UNSIGNED NOT NULL,
+        max_available SMALLINT UNSIGNED NOT NULL,
+        avg_available DECIMAL(7,2) AS (sum_available / sample_count) STORED,
+        delta_sum INT UNSIGNED NOT NULL,            -- 區間內相鄰兩筆可借車數的絕對變化量總和
+        first_available SMALLINT UNSIGNED NOT NULL,
+        last_available SMALLINT UNSIGNED NOT NULL,  -- 由每小時彙總合併每日彙總時，補上相鄰小時之間的變化量
+        PRIMARY KEY (station_no, bucket_unix),
+        KEY idx_bucket (bucket_unix)                -- compact_rollups 依時間重算整日的每日彙總
+    ) ENGINE=InnoDB
+    """
+
+TABLES['station_hourly'] = ROLLUP_TABLE_DDL.format(name='station_hourly')
+TABLES['station_daily'] = ROLLUP_TABLE_DDL.format(name='station_daily')
+
+# 彙總進度 (已處理到的 timestamp_unix)
+TABLES['rollup_state'] = (
+    """
+    CREATE TABLE rollup_state (
+        name VARCHAR(32) NOT NULL PRIMARY KEY,
+        last_timestamp_unix INT UNSIGNED NOT NULL
+    ) ENGINE=InnoDB
+    """
+)
+
+# 逐站車輛清單 (api.get_all_bike_async 每次巡查寫入一筆)
+TABLES['station_bike_snapshots'] = (
+    """
+    CREATE TABLE station_bike_snapshots (
+        timestamp_unix INT UNSIGNED NOT NULL,
+        station_no VARCHAR(10) NOT NULL,
+        bike_count SMALLINT UNSIGNED NOT NULL,
+        bikes_json MEDIUMTEXT,
+        PRIMARY KEY (station_no, timestamp_unix)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """
+)
+
+# 每站最新狀態 (與 station_records 在同一個交易中 upsert)，個人頁與即時狀態查詢以主鍵讀取
+TABLES['station_latest'] = (
+    """
+    CREATE TABLE station_latest (
+        station_no VARCHAR(10) NOT NULL PRIMARY KEY,
+        timestamp_unix INT UNSIGNED NOT NULL,
+        parking_spaces SMALLINT UNSIGNED,
+        available_spaces SMALLINT UNSIGNED,
+        empty_spaces SMALLINT UNSIGNED,
+        yb2 SMALLINT UNSIGNED,
+        eyb SMALLINT UNSIGNED,
+        forbidden_spaces SMALLINT UNSIGNED,
+        available_level TINYINT UNSIGNED
+    ) ENGINE=InnoDB
+    """
+)
+
+# 站點登錄資料 (由 station_registry.StationRegistry 依官方清單差異更新)，供空間索引與回應補上站名
+TABLES['station_meta'] = (
+    """
+    CREATE TABLE station_meta (
+        station_no VARCHAR(10) NOT NULL PRIMARY KEY,
+        name VARCHAR(100),
+        area VARCHAR(20),
+        address VARCHAR(255),
+        lat DECIMAL(9,6) NOT NULL,
+        lng DECIMAL(9,6) NOT NULL,
+        capacity SMALLINT UNSIGNED,
+        active TINYINT(1) NOT NULL DEFAULT 1,       -- 官方清單中已消失的站點為 0
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """
+)
+
 def create_database(cursor, db_name):
     """嘗試創建資料庫，如果已存在則忽略。"""
     try:
@@ -104,22 +193,339 @@ def create_tables(cursor):
                 print("創建資料表失敗，請檢查 DDL 語法。")
 
 
-def initialize_db():
-    """主初始化函式"""
-    
-    # 第一次連線：不指定資料庫，以便先創建資料庫
+def backfill_station_latest(cursor):
+    """station_latest 為空時，由 station_records 中每站最新的一筆填入 (既有資料庫只需執行一次)。"""
+    cursor.execute("SELECT COUNT(*) FROM station_latest")
+    if cursor.fetchone()[0]:
+        return
+    print("回填 station_latest: ", end='')
+    cursor.execute("""
+        INSERT INTO station_latest (
+            station_no, timestamp_unix, parking_spaces, available_spaces, empty_spaces,
+            yb2, eyb, forbidden_spaces, available_level
+        )
+        SELECT r.station_no, r.timestamp_unix, r.parking_spaces, r.available_spaces, r.empty_spaces,
+               r.yb2, r.eyb, r.forbidden_spaces, r.available_level
+        FROM station_records r
+        INNER JOIN (
+            SELECT station_no, MAX(id) AS max_id FROM station_records GROUP BY station_no
+        ) AS latest ON r.id = latest.max_id
+        WHERE r.available_spaces IS NOT NULL
+    """)
+    print(f"{cursor.rowcount} 站")
+
+
+# -------------------------
+# 版本化 schema migration
+# -------------------------
+# 依版本號依序執行尚未套用的 migration，並記錄在 schema_migrations。
+# 每個 migration 都先檢查目前結構，已符合時只記錄版本 (新建的資料庫由上面的 DDL 直接建成最新結構)。
+# manual=True 的 migration 成本很高，只有以 --include 指名時才執行。
+MIGRATIONS = []     # [(version, name, func, manual)]
+
+STATE_COLUMNS = (
+    "parking_spaces", "available_spaces", "empty_spaces",
+    "yb2", "eyb", "forbidden_spaces", "available_level",
+)
+
+
+def migration(version, name, manual=False):
+    def register(func):
+        MIGRATIONS.append((version, name, func, manual))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def _column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def _index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def _index_columns(cursor, table, index):
+    cursor.execute("""
+        SELECT COLUMN_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        ORDER BY SEQ_IN_INDEX
+    """, (table, index))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _primary_key_columns(cursor, table):
+    return _index_columns(cursor, table, "PRIMARY")
+
+
+@migration(1, "data_snapshots_is_keyframe")
+def _add_is_keyframe(cnx, cursor):
+    if not _column_exists(cursor, "data_snapshots", "is_keyframe"):
+        cursor.execute("""
+            ALTER TABLE data_snapshots ADD COLUMN is_keyframe TINYINT(1) NOT NULL DEFAULT 1,
+            ALGORITHM=INPLACE, LOCK=NONE
+        """)
+
+
+@migration(2, "station_records_station_time_index")
+def _add_station_time_index(cnx, cursor):
+    """
+    站點優先的索引：單站時間序列 (iter_snapshot_states(station_no=...)) 只需掃描索引中連續的一段，
+    再依主鍵回表取狀態欄位。線上建立 (ALGORITHM=INPLACE, LOCK=NONE)，建立期間寫入不受阻擋。
+    """
+    if not _index_exists(cursor, "station_records", "idx_station_time"):
+        cursor.execute("""
+            ALTER TABLE station_records
+            ADD INDEX idx_station_time (station_no, timestamp_unix),
+            ALGORITHM=INPLACE, LOCK=NONE
+        """)
+
+
+@migration(3, "recluster_station_records", manual=True)
+def _recluster_station_records(cnx, cursor, batch_size=50000):
+    """
+    把 station_records 的叢集索引改為 (station_no, timestamp_unix, id)，單站資料在磁碟上連續。
+    代價是依時間讀取所有站點 (Analyzer 預載) 改走次要索引，適合以單站查詢為主的部署，因此為 manual。
+
+    線上進行：
+    1. 建立新表，依 id 分批複製 (每批一個交易，不長時間鎖表)，直到追上目前的寫入
+    2. 新表的 AUTO_INCREMENT 預留空間後，以 RENAME TABLE 原子性地交換兩張表
+    3. 把交換前最後一刻寫入舊表的資料補進新表；舊表保留為 station_records_old，確認後再手動 DROP
+    """
+    if _primary_key_columns(cursor, "station_records")[:1] == ["station_no"]:
+        return
+    columns = ", ".join(("id", "timestamp_unix", "station_no") + STATE_COLUMNS)
+    state_ddl = ",\n".join(
+        f"            {col} {'TINYINT' if col == 'available_level' else 'SMALLINT'} UNSIGNED"
+        for col in STATE_COLUMNS
+    )
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS station_records_v2 (
+            id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+            timestamp_unix INT UNSIGNED NOT NULL,
+            station_no VARCHAR(10) NOT NULL,
+{state_ddl},
+            PRIMARY KEY (station_no, timestamp_unix, id),
+            KEY idx_id (id),
+            INDEX idx_timestamp_station (timestamp_unix, station_no),
+            FOREIGN KEY (timestamp_unix)
+                REFERENCES data_snapshots(timestamp_unix)
+                ON DELETE CASCADE
+                ON UPDATE CASCADE
+        ) ENGINE=InnoDB
+    """)
+    # 來源資料已通過外鍵檢查，複製時略過以加快速度
+    cursor.execute("SET SESSION foreign_key_checks = 0")
+    try:
+        def copy_from(source, last_id):
+            copied = 0
+            while True:
+                cursor.execute(f"""
+                    INSERT INTO station_records_v2 ({columns})
+                    SELECT {columns} FROM {source}
+                    WHERE id > %s ORDER BY id LIMIT %s
+                """, (last_id, batch_size))
+                cnx.commit()
+                if cursor.rowcount <= 0:
+                    return last_id, copied
+                copied += cursor.rowcount
+                cursor.execute("SELECT MAX(id) FROM station_records_v2")
+                last_id = cursor.fetchone()[0]
+                print(f"  已複製至 id {last_id} (本輪 {copied} 筆)")
+
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM station_records_v2")
+        last_id, _ = copy_from("station_records", cursor.fetchone()[0])
+
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM station_records")
+        headroom = cursor.fetchone()[0] + 1000000
+        cursor.execute(f"ALTER TABLE station_records_v2 AUTO_INCREMENT = {headroom}")
+        cursor.execute("""
+            RENAME TABLE station_records TO station_records_old,
+                         station_records_v2 TO station_records
+        """)
+        # RENAME 前一刻寫入舊表的資料 (id 都小於預留的 AUTO_INCREMENT，不會與新資料衝突)
+        cursor.execute(f"""
+            INSERT INTO station_records ({columns})
+            SELECT {columns} FROM station_records_old WHERE id > %s
+        """, (last_id,))
+        cnx.commit()
+        print(f"  交換完成，補上 {cursor.rowcount} 筆；確認無誤後可執行 DROP TABLE station_records_old")
+    finally:
+        cursor.execute("SET SESSION foreign_key_checks = 1")
+
+
+@migration(4, "rollup_bucket_index")
+def _add_rollup_bucket_index(cnx, cursor):
+    """compact_rollups 由當日所有站點的每小時彙總重算每日彙總，需要依 bucket_unix 的索引。"""
+    for table in ("station_hourly", "station_daily"):
+        if not _index_exists(cursor, table, "idx_bucket"):
+            cursor.execute(f"""
+                ALTER TABLE {table} ADD INDEX idx_bucket (bucket_unix),
+                ALGORITHM=INPLACE, LOCK=NONE
+            """)
+
+
+@migration(5, "narrow_station_time_index")
+def _narrow_station_time_index(cnx, cursor):
+    """
+    早期的 migration 002 把所有狀態欄位放進 idx_station_time (覆蓋索引)，幾乎複製了一份 station_records，
+    每筆寫入也要多維護一份寬索引。改為只含 (station_no, timestamp_unix)；單站查詢的回表量只有一站的列數。
+    """
+    columns = _index_columns(cursor, "station_records", "idx_station_time")
+    if columns and columns != ["station_no", "timestamp_unix"]:
+        cursor.execute("""
+            ALTER TABLE station_records
+            DROP INDEX idx_station_time,
+            ADD INDEX idx_station_time (station_no, timestamp_unix),
+            ALGORITHM=INPLACE, LOCK=NONE
+        """)
+
+
+def run_migrations(cnx, include=()):
+    """套用尚未執行的 migration，回傳本次套用的版本號。"""
+    cursor = cnx.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT UNSIGNED NOT NULL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    applied = {row[0] for row in cursor.fetchall()}
+
+    done = []
+    for version, name, func, manual in MIGRATIONS:
+        if version in applied or (manual and name not in include):
+            continue
+        print(f"套用 migration {version:03d} {name} ...")
+        started = time.perf_counter()
+        func(cnx, cursor)
+        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        cnx.commit()
+        print(f"  完成 ({time.perf_counter() - started:.1f} 秒)")
+        done.append(version)
+    if not done:
+        print("schema 已是最新版本。")
+    cursor.close()
+    return done
+
+
+# -------------------------
+# 主要查詢的 EXPLAIN 與延遲紀錄 (migration 前後比較用)
+# -------------------------
+PLAN_LOG = "./logs/query_plans.jsonl"
+
+PLAN_QUERIES = {
+    # DBManager.iter_snapshot_states(station_no=...)：單站 as-of 還原 (一週)
+    "station_range": (f"""
+        SELECT timestamp_unix, station_no, {', '.join(STATE_COLUMNS)} FROM station_records
+        WHERE timestamp_unix BETWEEN %(week_ago)s AND %(latest)s AND station_no = %(station)s
+        ORDER BY timestamp_unix ASC
+    """),
+    # DBManager.iter_range_logs：/range 與 get_range_logs 的串流查詢 (一週)
+    "station_range_logs": ("""
+        SELECT s.timestamp_unix, s.is_keyframe, r.station_no, r.available_spaces
+        FROM data_snapshots s
+        LEFT JOIN station_records r ON r.timestamp_unix = s.timestamp_unix AND r.station_no = %(station)s
+        WHERE s.timestamp_unix BETWEEN %(week_ago)s AND %(latest)s
+        ORDER BY s.timestamp_unix ASC
+    """),
+    # DBManager.iter_record_chunks：Analyzer 預載 (一小時內所有站點)
+    "time_range_all_stations": (f"""
+        SELECT timestamp_unix, station_no, {', '.join(STATE_COLUMNS)} FROM station_records
+        WHERE timestamp_unix BETWEEN %(hour_ago)s AND %(latest)s
+        ORDER BY timestamp_unix ASC
+    """),
+    # 舊版 get_user_activity / backfill_station_latest 的每站最新一筆
+    "latest_per_station": ("""
+        SELECT station_no, MAX(id) FROM station_records
+        WHERE station_no IN (%(station)s) GROUP BY station_no
+    """),
+    # iter_snapshot_states 的 as-of 關鍵幀
+    "keyframe_as_of": ("""
+        SELECT timestamp_unix FROM data_snapshots
+        WHERE timestamp_unix <= %(latest)s AND is_keyframe = 1
+        ORDER BY timestamp_unix DESC LIMIT 1
+    """),
+}
+
+
+def capture_query_plans(cnx, label, repeat=5):
+    """對 PLAN_QUERIES 執行 EXPLAIN 並量測延遲 (取中位數)，結果附加到 PLAN_LOG。"""
+    cursor = cnx.cursor()
+    cursor.execute("SELECT MAX(timestamp_unix) FROM data_snapshots")
+    latest = cursor.fetchone()[0]
+    if latest is None:
+        print("沒有快照資料，略過 EXPLAIN。")
+        cursor.close()
+        return []
+    cursor.execute("SELECT station_no FROM station_records WHERE timestamp_unix = %s LIMIT 1", (latest,))
+    row = cursor.fetchone()
+    params = {
+        "latest": latest,
+        "hour_ago": latest - 3600,
+        "week_ago": latest - 7 * 86400,
+        "station": row[0] if row else "",
+    }
+
+    captured_at = datetime.now().isoformat(timespec="seconds")
+    results = []
+    for name, sql in PLAN_QUERIES.items():
+        cursor.execute("EXPLAIN " + sql, params)
+        columns = cursor.column_names
+        plan = [
+            {k: v for k, v in zip(columns, plan_row) if k in ("table", "type", "key", "rows", "filtered", "Extra")}
+            for plan_row in cursor.fetchall()
+        ]
+        timings = []
+        n_rows = 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cursor.execute(sql, params)
+            n_rows = len(cursor.fetchall())
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results.append({
+            "label": label, "captured_at": captured_at, "query": name,
+            "plan": plan, "result_rows": n_rows, "median_ms": round(timings[len(timings) // 2], 2),
+        })
+    cursor.close()
+
+    os.makedirs(os.path.dirname(PLAN_LOG), exist_ok=True)
+    with open(PLAN_LOG, "a", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+
+    print(f"\n[{label}] 查詢計畫與延遲 (已附加到 {PLAN_LOG})")
+    for result in results:
+        keys = ", ".join(str(p.get("key")) for p in result["plan"])
+        print(f"  {result['query']:<24} key={keys:<24} {result['result_rows']:>8} 列  {result['median_ms']:>9.2f} ms")
+    return results
+
+
+def connect(database=None):
+    """建立連線；密碼為空時提示輸入。失敗時印出原因並回傳 None。"""
     try:
         # 如果密碼為空，提示使用者輸入
         if not DB_CONFIG['password']:
             print("注意：您的密碼設定為空，請輸入密碼 (如果您沒有密碼，直接按 Enter)")
             DB_CONFIG['password'] = getpass.getpass("MySQL 密碼: ")
             
-        cnx = mysql.connector.connect(
+        return mysql.connector.connect(
             user=DB_CONFIG['user'], 
             password=DB_CONFIG['password'], 
-            host=DB_CONFIG['host']
+            host=DB_CONFIG['host'],
+            **({"database": database} if database else {})
         )
-        cursor = cnx.cursor()
 
     except mysql.connector.Error as err:
         if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
@@ -128,7 +534,30 @@ def initialize_db():
             print(f"連線失敗：無法連線到 MySQL 主機 {DB_CONFIG['host']}。請確保服務已啟動。")
         else:
             print(f"連線失敗：{err}")
+        return None
+
+
+def migrate(include=(), capture=False):
+    """對既有資料庫套用 migration；capture=True 時在前後各記錄一次查詢計畫與延遲。"""
+    cnx = connect(DB_CONFIG['database'])
+    if cnx is None:
+        return
+    if capture:
+        capture_query_plans(cnx, "before")
+    run_migrations(cnx, include)
+    if capture:
+        capture_query_plans(cnx, "after")
+    cnx.close()
+
+
+def initialize_db():
+    """主初始化函式"""
+    
+    # 第一次連線：不指定資料庫，以便先創建資料庫
+    cnx = connect()
+    if cnx is None:
         return
+    cursor = cnx.cursor()
 
     # 1. 創建資料庫
     create_database(cursor, DB_CONFIG['database'])
@@ -143,10 +572,35 @@ def initialize_db():
     # 3. 創建資料表
     create_tables(cursor)
 
+    # 4. 將既有資料表升級到最新結構
+    run_migrations(cnx)
+
+    # 5. 回填衍生資料表
+    backfill_station_latest(cursor)
+    cnx.commit()
+
     cursor.close()
     cnx.close()
     print("\n資料庫初始化完成。")
 
 
 if __name__ == '__main__':
-    initialize_db()
+    parser = argparse.ArgumentParser(description="初始化 / 升級 YouBike 資料庫")
+    subcommands = parser.add_subparsers(dest="command")
+    migrate_parser = subcommands.add_parser("migrate", help="套用尚未執行的 schema migration")
+    migrate_parser.add_argument("--include", nargs="*", default=[],
+                                help="一併執行的 manual migration，例如 recluster_station_records")
+    migrate_parser.add_argument("--capture", action="store_true", help="前後記錄主要查詢的 EXPLAIN 與延遲")
+    explain_parser = subcommands.add_parser("explain", help="記錄主要查詢的 EXPLAIN 與延遲")
+    explain_parser.add_argument("--label", default="manual")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate(include=args.include, capture=args.capture)
+    elif args.command == "explain":
+        cnx = connect(DB_CONFIG['database'])
+        if cnx is not None:
+            capture_query_plans(cnx, args.label)
+            cnx.close()
+    else:
+        initialize_db()
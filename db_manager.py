@@ -1,10 +1,12 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from mysql.connector import pooling
-from datetime import datetime
+from mysql.connector import pooling, errorcode
+from datetime import datetime, timedelta
 import mysql.connector
+import threading
 import time
 import json
 import jwt
+from bulk_writer import BulkWriter
 from werkzeug.security import generate_password_hash, check_password_hash
 
 """sql操作"""
@@ -12,15 +14,50 @@ from werkzeug.security import generate_password_hash, check_password_hash
 class DBManager:
     """管理所有 MySQL 資料庫連線和操作。"""
     
-    def __init__(self, db_config):
+    # 站點狀態欄位 (station_records 中除了 timestamp_unix / station_no 以外的資料)
+    STATE_COLUMNS = (
+        "parking_spaces", "available_spaces", "empty_spaces",
+        "yb2", "eyb", "forbidden_spaces", "available_level",
+    )
+    TOMBSTONE = (None,) * len(STATE_COLUMNS)
+    # iter_snapshot_states 需要還原全部站點時明確傳入 (station_nos=ALL_STATIONS)，避免漏給站號變成全表查詢
+    ALL_STATIONS = object()
+    RECORD_COLUMNS = ("timestamp_unix", "station_no") + STATE_COLUMNS
+    POOL_SIZE = 32
+    # 長時間佔用連線的串流查詢 (/range、預載) 同時最多幾個，其餘連線保留給寫入與一般查詢
+    STREAM_SLOTS = POOL_SIZE // 4
+
+    def __init__(self, db_config, storage_mode="full", keyframe_interval=3600, bulk_writer=None):
+        """
+        :param storage_mode: "full" 每個快照寫入所有站點；
+                             "delta" 只寫入與上次儲存狀態不同的站點，並每 keyframe_interval 秒寫一次完整關鍵幀
+        :param bulk_writer: station_records 的大量寫入引擎；預設依 db_config 的 allow_local_infile 決定是否使用 LOAD DATA
+        """
         print("DBManager: 初始化連線池...")
         self.db_config = db_config
         self.SECRET_KEY = "youbike_app_secret_key_fixed_later"
+        self.snapshot_listeners = []    # save_snapshot 成功後呼叫 callback(converted_data, unix_timestamp)
+        if storage_mode not in ("full", "delta"):
+            raise ValueError(f"不支援的 storage_mode: {storage_mode}")
+        self.storage_mode = storage_mode
+        self.keyframe_interval = keyframe_interval
+        # delta 模式的寫入狀態：{station_no: 欄位 tuple}、上次寫入與上次關鍵幀的時間
+        self._stored_state = None
+        self._last_stored_ts = None
+        self._last_keyframe_ts = None
+        self._since_keyframe = 0        # 本行程自上一個關鍵幀 (含) 起寫入的快照數
+        self._write_lock = threading.Lock()
+        # station_latest 的記憶體鏡像 {station_no: 最新狀態 dict}；None 表示尚未載入
+        self._latest = None
+        self._latest_lock = threading.Lock()
+        # 所有 request 共用：超過 STREAM_SLOTS 的串流查詢排隊等待，不會耗盡連線池
+        self._stream_slots = threading.BoundedSemaphore(self.STREAM_SLOTS)
+        self.bulk_writer = bulk_writer or BulkWriter(local_infile=bool(db_config.get("allow_local_infile")))
         try:
             # 使用連線池來管理資料庫連線
             self.connection_pool = pooling.MySQLConnectionPool(
                 pool_name="youbike_pool",
-                pool_size=32,  # 設置連線池大小
+                pool_size=self.POOL_SIZE,  # 設置連線池大小
                 **self.db_config
             )
             print("DBManager: 連線池創建成功。")
@@ -72,10 +109,45 @@ class DBManager:
         finally:
             conn.close()
     
+    def add_snapshot_listener(self, callback):
+        """註冊快照寫入成功後的回呼，例如 Analyzer 的快取更新。"""
+        self.snapshot_listeners.append(callback)
+
+    def _notify_snapshot_listeners(self, converted_data, unix_timestamp):
+        for callback in self.snapshot_listeners:
+            try:
+                callback(converted_data, unix_timestamp)
+            except Exception as e:
+                # 快取更新失敗不影響已提交的寫入
+                print(f"DBManager: 快照回呼失敗: {e}")
+
     def get_connection(self):
         """從連線池獲取一個連線。"""
         return self.connection_pool.get_connection()
 
+    def ensure_schema(self):
+        """
+        啟動時確認快照寫入需要的欄位存在：尚未執行 db_init.py migrate 的既有資料庫在此補上 is_keyframe
+        (與 migration 001 相同且可重複執行，之後執行 migrate 只會記錄版本)。回傳是否有變更。
+        """
+        column = self._execute_query("""
+            SELECT COUNT(*) AS n FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'data_snapshots' AND COLUMN_NAME = 'is_keyframe'
+        """, fetch_one=True)
+        if column['n']:
+            return False
+        try:
+            self._execute_query("""
+                ALTER TABLE data_snapshots ADD COLUMN is_keyframe TINYINT(1) NOT NULL DEFAULT 1,
+                ALGORITHM=INPLACE, LOCK=NONE
+            """)
+        except mysql.connector.Error as err:
+            # 其他行程同時啟動並已加入欄位
+            if err.errno != errorcode.ER_DUP_FIELDNAME:
+                raise
+        print("DBManager: 已在 data_snapshots 加入 is_keyframe 欄位")
+        return True
+
     def _execute_query(self, query, params=None, fetch_one=False, fetch_all=False):
         """執行資料庫查詢的通用函式。"""
         conn = None
@@ -105,71 +177,166 @@ class DBManager:
             if conn and conn.is_connected():
                 conn.close()
 
-    def save_snapshot(self, converted_data: dict) -> int:
+    def save_snapshot(self, converted_data: dict, changed_stations=None) -> int:
         """
         將轉換後的單次 YouBike 快照資料寫入 data_snapshots 和 station_records 表。
         :param converted_data: 格式為 {"timestamp": "...", "stations": [...]}
+        :param changed_stations: 上游來源時間有變動的站點 (None 表示未知)；
+                                 delta 模式的非關鍵幀只比對這些站點
         :return: 寫入的 Unix 時間戳。
         """
-        if not converted_data or not converted_data.get("stations"):
-            return 0
-        
+        return self.save_snapshots([converted_data], [changed_stations])[0]
+
+    def save_snapshots(self, converted_list, changed_stations_list=None):
+        """
+        在同一個交易中寫入多個快照 (write-behind queue 合併寫入用)，全部成功或全部回滾。
+        :param converted_list: [converted_data]，依時間先後排列
+        :param changed_stations_list: 與 converted_list 對應的 changed_stations (可省略)
+        :return: 每個快照寫入的 Unix 時間戳 (沒有站點資料的快照為 0)
+        """
+        if changed_stations_list is None:
+            changed_stations_list = [None] * len(converted_list)
+        prepared = [
+            self._snapshot_state(converted_data) if converted_data and converted_data.get("stations") else None
+            for converted_data in converted_list
+        ]
+        if not any(prepared):
+            return [0] * len(converted_list)
+
+        writes = []
+        with self._write_lock:
+            # 寫入失敗時還原 delta 狀態，避免下一筆以未提交的資料為基準
+            saved_state = (self._stored_state, self._last_stored_ts, self._last_keyframe_ts, self._since_keyframe)
+            try:
+                if self._foreign_writes_since_keyframe():
+                    # 其他行程 (例如另一個寫入者) 在上次關鍵幀後也寫了快照，差異基準已不可靠，改寫關鍵幀
+                    self._stored_state = None
+                for item, changed_stations in zip(prepared, changed_stations_list):
+                    if item is None:
+                        continue
+                    unix_timestamp, iso_timestamp, record_count, current_state = item
+                    is_keyframe, changed = self._plan_write(unix_timestamp, current_state, changed_stations)
+                    writes.append((unix_timestamp, iso_timestamp, record_count, is_keyframe, changed))
+                    self._advance_state(unix_timestamp, current_state, is_keyframe)
+                self._write_snapshots(writes)
+            except Exception:
+                self._stored_state, self._last_stored_ts, self._last_keyframe_ts, self._since_keyframe = saved_state
+                raise
+
+        for unix_timestamp, _, record_count, _, changed in writes:
+            print(f"DBManager: 快照 {unix_timestamp} (共 {record_count} 筆，寫入 {len(changed)} 筆) 寫入資料庫成功。")
+        for converted_data, item in zip(converted_list, prepared):
+            if item is not None:
+                self._notify_snapshot_listeners(converted_data, item[0])
+        return [item[0] if item is not None else 0 for item in prepared]
+
+    def _snapshot_state(self, converted_data):
+        """整理時間戳與每站的狀態欄位：(unix_timestamp, iso_timestamp, record_count, {station_no: 欄位 tuple})"""
         # 1. 處理時間戳
         iso_timestamp = converted_data["timestamp"]
         dt = datetime.fromisoformat(iso_timestamp)
         unix_timestamp = int(dt.timestamp())
         stations_data = converted_data["stations"]
-        record_count = len(stations_data)
         
+        # 2. 整理每站的狀態欄位
+        current_state = {}
+        for station in stations_data:
+            # 提取 yb2 和 eyb
+            detail = station.get("available_spaces_detail", {})
+            current_state[station.get("station_no")] = (
+                station.get("parking_spaces"),
+                station.get("available_spaces"),
+                station.get("empty_spaces"),
+                detail.get("yb2", 0),
+                detail.get("eyb", 0),
+                station.get("forbidden_spaces"),
+                station.get("available_spaces_level"),
+            )
+        return unix_timestamp, iso_timestamp, len(stations_data), current_state
+
+    def _plan_write(self, unix_timestamp, current_state, changed_stations):
+        """決定是否寫關鍵幀，以及要寫入哪些站點 (須持有 _write_lock)。"""
+        is_keyframe = self._needs_keyframe(unix_timestamp)
+        if is_keyframe:
+            return True, current_state
+        # delta 模式：只保留與上次儲存狀態不同的站點
+        candidates = current_state.keys()
+        if changed_stations is not None:
+            candidates = candidates & set(changed_stations)
+        changed = {
+            sno: current_state[sno] for sno in candidates
+            if self._stored_state.get(sno) != current_state[sno]
+        }
+        # 從資料中消失的站點寫入墓碑列 (所有狀態欄位為 NULL)
+        for sno in self._stored_state.keys() - current_state.keys():
+            changed[sno] = self.TOMBSTONE
+        return False, changed
+
+    def _advance_state(self, unix_timestamp, current_state, is_keyframe):
+        if self.storage_mode != "delta":
+            return
+        if self._last_stored_ts is not None and unix_timestamp <= self._last_stored_ts:
+            # 亂序的舊快照以關鍵幀寫入，下一筆即時資料也強制寫關鍵幀重新對齊
+            self._stored_state = None
+        else:
+            self._stored_state = current_state
+            self._last_stored_ts = unix_timestamp
+            if is_keyframe:
+                self._last_keyframe_ts = unix_timestamp
+                self._since_keyframe = 0
+            self._since_keyframe += 1
+
+    def _foreign_writes_since_keyframe(self):
+        """delta 模式：data_snapshots 中自上次關鍵幀起的快照數多於本行程寫入的數量 (須持有 _write_lock)。"""
+        if self.storage_mode != "delta" or self._stored_state is None:
+            return False
+        row = self._execute_query("""
+            SELECT COUNT(*) AS n FROM data_snapshots WHERE timestamp_unix >= %s
+        """, params=(self._last_keyframe_ts,), fetch_one=True)
+        return bool(row) and row['n'] > self._since_keyframe
+
+    def _needs_keyframe(self, unix_timestamp):
+        if self.storage_mode == "full" or self._stored_state is None:
+            return True
+        if unix_timestamp <= self._last_stored_ts:
+            return True
+        return unix_timestamp - self._last_keyframe_ts >= self.keyframe_interval
+
+    def _write_snapshots(self, writes):
+        """
+        在同一個交易中寫入 data_snapshots 與 station_records。
+        :param writes: [(unix_timestamp, iso_timestamp, record_count, is_keyframe, station_values)]
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
         try:
-            # 2. 寫入 data_snapshots 表
+            # 寫入 data_snapshots 表 (每個 tick 都記錄)
             snapshot_query = """
-            INSERT INTO data_snapshots (timestamp_unix, timestamp_iso, record_count) 
-            VALUES (%s, %s, %s)
-            ON DUPLICATE KEY UPDATE record_count = VALUES(record_count)
-            """
-            cursor.execute(snapshot_query, (unix_timestamp, iso_timestamp, record_count))
-            
-            # 3. 準備批量寫入 station_records 表
-            records_query = """
-            INSERT INTO station_records (
-                timestamp_unix, station_no, parking_spaces, available_spaces, empty_spaces, 
-                yb2, eyb, forbidden_spaces, available_level
-            ) 
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            INSERT INTO data_snapshots (timestamp_unix, timestamp_iso, record_count, is_keyframe) 
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE record_count = VALUES(record_count), is_keyframe = VALUES(is_keyframe)
             """
+            cursor.executemany(snapshot_query, [
+                (unix_timestamp, iso_timestamp, record_count, int(is_keyframe))
+                for unix_timestamp, iso_timestamp, record_count, is_keyframe, _ in writes
+            ])
             
-            records_to_insert = []
-            for station in stations_data:
-                # 提取 yb2 和 eyb
-                detail = station.get("available_spaces_detail", {})
-                yb2 = detail.get("yb2", 0)
-                eyb = detail.get("eyb", 0)
-                
-                # 準備插入資料
-                records_to_insert.append((
-                    unix_timestamp,
-                    station.get("station_no"),
-                    station.get("parking_spaces"),
-                    station.get("available_spaces"),
-                    station.get("empty_spaces"),
-                    yb2,
-                    eyb,
-                    station.get("forbidden_spaces"),
-                    station.get("available_spaces_level")
-                ))
-
-            # 批量執行插入
-            if records_to_insert:
-                cursor.executemany(records_query, records_to_insert)
-
-            # 4. 提交事務
+            # 批量寫入 station_records 表 (多個快照合併成一批，依筆數由 BulkWriter 挑選寫入策略)
+            records_to_insert = [
+                (unix_timestamp, station_no, *values)
+                for unix_timestamp, _, _, _, station_values in writes
+                for station_no, values in station_values.items()
+            ]
+            self.bulk_writer.write(cursor, "station_records", self.RECORD_COLUMNS, records_to_insert)
+
+            # 同一個交易中更新 station_latest
+            latest = self._collapse_latest(writes)
+            self._upsert_latest(cursor, latest)
+
+            # 提交事務
             conn.commit()
-            print(f"DBManager: 快照 {unix_timestamp} (共 {record_count} 筆) 寫入資料庫成功。")
-            return unix_timestamp
+            self._apply_latest(latest)
 
         except mysql.connector.Error as err:
             conn.rollback()
@@ -179,6 +346,181 @@ class DBManager:
             cursor.close()
             conn.close()
 
+    # --------------------
+    # station_latest：每站最新狀態
+    # --------------------
+    @staticmethod
+    def _collapse_latest(writes):
+        """同一批寫入中每站只保留時間最新的狀態：{station_no: (timestamp_unix, 欄位 tuple)}"""
+        latest = {}
+        for unix_timestamp, _, _, _, station_values in writes:
+            for sno, values in station_values.items():
+                current = latest.get(sno)
+                if current is None or unix_timestamp >= current[0]:
+                    latest[sno] = (unix_timestamp, values)
+        return latest
+
+    def _upsert_latest(self, cursor, latest):
+        """upsert station_latest；較舊 (亂序) 的快照不會覆蓋較新的狀態，墓碑則刪除該站。"""
+        rows = [(sno, ts, *values) for sno, (ts, values) in latest.items() if values != self.TOMBSTONE]
+        if rows:
+            # timestamp_unix 必須最後更新，前面的 IF 才會與舊值比較
+            assignments = ", ".join(
+                f"{col} = IF(VALUES(timestamp_unix) >= timestamp_unix, VALUES({col}), {col})"
+                for col in self.STATE_COLUMNS
+            )
+            cursor.executemany(f"""
+                INSERT INTO station_latest (station_no, timestamp_unix, {', '.join(self.STATE_COLUMNS)})
+                VALUES ({', '.join(['%s'] * (2 + len(self.STATE_COLUMNS)))})
+                ON DUPLICATE KEY UPDATE {assignments},
+                    timestamp_unix = GREATEST(timestamp_unix, VALUES(timestamp_unix))
+            """, rows)
+        tombstones = [(sno, ts) for sno, (ts, values) in latest.items() if values == self.TOMBSTONE]
+        if tombstones:
+            cursor.executemany(
+                "DELETE FROM station_latest WHERE station_no = %s AND timestamp_unix <= %s", tombstones
+            )
+
+    def _apply_latest(self, latest):
+        """交易提交後同步更新記憶體鏡像 (尚未載入時略過，之後由 load_latest 整批讀取)。"""
+        with self._latest_lock:
+            if self._latest is None:
+                return
+            for sno, (ts, values) in latest.items():
+                current = self._latest.get(sno)
+                if current is not None and current["timestamp_unix"] > ts:
+                    continue
+                if values == self.TOMBSTONE:
+                    self._latest.pop(sno, None)
+                else:
+                    self._latest[sno] = {"station_no": sno, "timestamp_unix": ts,
+                                         **dict(zip(self.STATE_COLUMNS, values))}
+
+    def load_latest(self):
+        """
+        由 station_latest 整批載入記憶體鏡像 (約一千多列的主鍵掃描)。
+        多個行程各自寫入時，定期呼叫以取得其他行程的更新。
+        """
+        rows = self._execute_query(f"""
+            SELECT station_no, timestamp_unix, {', '.join(self.STATE_COLUMNS)} FROM station_latest
+        """, fetch_all=True)
+        with self._latest_lock:
+            self._latest = {row["station_no"]: row for row in rows}
+        return len(rows)
+
+    def latest_timestamp(self):
+        """記憶體鏡像中最新的 timestamp_unix (尚未載入時為 None)，作為即時狀態的資料版本。"""
+        with self._latest_lock:
+            if self._latest is None:
+                return None
+            return max((row["timestamp_unix"] for row in self._latest.values()), default=0)
+
+    def get_latest_states(self, station_nos=None):
+        """
+        取得站點的最新狀態：鏡像已載入時直接查 dict，否則以主鍵讀取 station_latest。
+        :param station_nos: 站點編號列表，None 表示全部
+        :return: {station_no: 狀態 dict}
+        """
+        with self._latest_lock:
+            if self._latest is not None:
+                if station_nos is None:
+                    return {sno: dict(row) for sno, row in self._latest.items()}
+                return {sno: dict(self._latest[sno]) for sno in station_nos if sno in self._latest}
+
+        query = f"SELECT station_no, timestamp_unix, {', '.join(self.STATE_COLUMNS)} FROM station_latest"
+        params = None
+        if station_nos is not None:
+            station_nos = list(station_nos)
+            if not station_nos:
+                return {}
+            query += f" WHERE station_no IN ({', '.join(['%s'] * len(station_nos))})"
+            params = tuple(station_nos)
+        rows = self._execute_query(query, params, fetch_all=True)
+        return {row["station_no"]: row for row in rows}
+
+    # --------------------
+    # station_meta：站點登錄資料 (由 StationRegistry 維護)
+    # --------------------
+    META_COLUMNS = ("name", "area", "address", "lat", "lng", "capacity")
+
+    def get_station_meta(self, active_only=False):
+        """所有站點的登錄資料 (名稱、行政區、地址、座標、車柱數)。"""
+        query = f"SELECT station_no, {', '.join(self.META_COLUMNS)}, active FROM station_meta"
+        if active_only:
+            query += " WHERE active = 1"
+        rows = self._execute_query(query, fetch_all=True)
+        for row in rows:
+            row["lat"], row["lng"] = float(row["lat"]), float(row["lng"])
+            row["active"] = bool(row["active"])
+        return rows
+
+    def upsert_station_meta(self, records):
+        """
+        寫入新增或變動的站點，並重新標記為啟用。
+        :param records: [{"station_no", "name", "area", "address", "lat", "lng", "capacity"}]
+        """
+        if not records:
+            return 0
+        columns = ("station_no",) + self.META_COLUMNS
+        updates = ", ".join(f"{col} = VALUES({col})" for col in self.META_COLUMNS)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(f"""
+                INSERT INTO station_meta ({', '.join(columns)}, active)
+                VALUES ({', '.join(['%s'] * len(columns))}, 1)
+                ON DUPLICATE KEY UPDATE {updates}, active = 1
+            """, [tuple(record.get(col) for col in columns) for record in records])
+            conn.commit()
+            return len(records)
+        except mysql.connector.Error as err:
+            conn.rollback()
+            print(f"DBManager: 站點登錄資料寫入失敗: {err}")
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def deactivate_stations(self, station_nos):
+        """官方清單中已消失的站點標記為停用 (保留資料供歷史查詢)。"""
+        station_nos = list(station_nos)
+        if not station_nos:
+            return 0
+        self._execute_query(
+            f"UPDATE station_meta SET active = 0 WHERE station_no IN ({', '.join(['%s'] * len(station_nos))})",
+            tuple(station_nos)
+        )
+        return len(station_nos)
+
+    def save_station_bikes(self, timestamp_unix: int, results) -> int:
+        """
+        批次寫入逐站抓取的車輛清單 (api.get_all_bike_async 的 writer)。
+        :param results: [(station_no, 車輛 list 或錯誤 dict)]，錯誤的站點會略過
+        """
+        rows = [
+            (timestamp_unix, sno, len(bikes), json.dumps(bikes, ensure_ascii=False))
+            for sno, bikes in results if isinstance(bikes, list)
+        ]
+        if not rows:
+            return 0
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.executemany("""
+                INSERT INTO station_bike_snapshots (timestamp_unix, station_no, bike_count, bikes_json)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE bike_count = VALUES(bike_count), bikes_json = VALUES(bikes_json)
+            """, rows)
+            conn.commit()
+            return len(rows)
+        except mysql.connector.Error as err:
+            conn.rollback()
+            print(f"DBManager: 車輛清單寫入失敗: {err}")
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
     # --------------------
     # DBManager 內的擴充方法 (供 Analyzer 呼叫)
     # --------------------
@@ -197,6 +539,125 @@ class DBManager:
         return self._execute_query(query, fetch_all=True)
 
 
+    def iter_snapshot_states(self, start_ts: int, end_ts: int, station_no=None, station_nos=None):
+        """
+        依時間順序產生 [start_ts, end_ts] 內每個快照的完整站點狀態 (as-of 語意)：
+        從 start_ts 之前最近的關鍵幀開始，依序套用之後各 tick 的變動列。
+        full 模式下每個快照都是關鍵幀，結果與逐一查詢相同。
+        :param station_no: 只還原單一站點
+        :param station_nos: 只還原這些站點 (以一個 IN (...) 查詢取得)；ALL_STATIONS 表示全部站點
+        :yield: (timestamp_unix, {station_no: row})；state dict 會被重複使用，呼叫端不可保留其參考
+        """
+        if station_no is None and station_nos is None:
+            raise ValueError("需指定 station_no 或 station_nos (全部站點請傳入 DBManager.ALL_STATIONS)")
+        base_ts = self._keyframe_at_or_before(start_ts)
+        if base_ts is None:
+            base_ts = start_ts
+
+        ticks = self._execute_query("""
+            SELECT timestamp_unix, is_keyframe FROM data_snapshots
+            WHERE timestamp_unix BETWEEN %s AND %s
+            ORDER BY timestamp_unix ASC
+        """, params=(base_ts, end_ts), fetch_all=True)
+        if not ticks:
+            return
+
+        columns = ", ".join(self.STATE_COLUMNS)
+        station_filter = ""
+        params = (base_ts, end_ts)
+        if station_no is not None:
+            station_filter = "AND station_no = %s"
+            params += (station_no,)
+        elif station_nos is not self.ALL_STATIONS:
+            station_filter = f"AND station_no IN ({', '.join(['%s'] * len(station_nos))})"
+            params += tuple(station_nos)
+        rows = self._execute_query(f"""
+            SELECT timestamp_unix, station_no, {columns}
+            FROM station_records
+            WHERE timestamp_unix BETWEEN %s AND %s {station_filter}
+            ORDER BY timestamp_unix ASC
+        """, params=params, fetch_all=True)
+
+        state = {}
+        i = 0
+        for tick in ticks:
+            ts = tick['timestamp_unix']
+            if tick['is_keyframe']:
+                state.clear()
+            while i < len(rows) and rows[i]['timestamp_unix'] <= ts:
+                row = rows[i]
+                if all(row[c] is None for c in self.STATE_COLUMNS):
+                    state.pop(row['station_no'], None)
+                else:
+                    state[row['station_no']] = row
+                i += 1
+            if ts >= start_ts:
+                yield ts, state
+
+    def _keyframe_at_or_before(self, ts: int):
+        """ts 之前 (含) 最近的關鍵幀時間；沒有時回傳 None。"""
+        # 沿主鍵由 ts 往回掃描，遇到第一個關鍵幀即停止 (最多掃過一個關鍵幀間隔的列)；
+        # MAX(...) WHERE is_keyframe = 1 沒有可用的索引，會掃描整段主鍵範圍
+        row = self._execute_query("""
+            SELECT timestamp_unix AS ts FROM data_snapshots
+            WHERE timestamp_unix <= %s AND is_keyframe = 1
+            ORDER BY timestamp_unix DESC
+            LIMIT 1
+        """, params=(ts,), fetch_one=True)
+        return row['ts'] if row else None
+
+    def get_snapshot_ticks(self, start_ts: int, end_ts: int):
+        """取得範圍內所有快照時間點與是否為關鍵幀，依時間排序。"""
+        return self._execute_query("""
+            SELECT timestamp_unix, is_keyframe FROM data_snapshots
+            WHERE timestamp_unix BETWEEN %s AND %s
+            ORDER BY timestamp_unix ASC
+        """, params=(start_ts, end_ts), fetch_all=True)
+
+    def iter_record_chunks(self, start_ts: int, end_ts: int, chunk_size=50000):
+        """
+        以單一查詢、不緩衝 (server 端逐批送出) 的方式依時間順序讀取 station_records，
+        每次產生最多 chunk_size 筆 tuple：(timestamp_unix, station_no, *STATE_COLUMNS)。
+        """
+        columns = ", ".join(self.STATE_COLUMNS)
+        yield from self._iter_unbuffered(f"""
+            SELECT timestamp_unix, station_no, {columns}
+            FROM station_records
+            WHERE timestamp_unix BETWEEN %s AND %s
+            ORDER BY timestamp_unix ASC
+        """, (start_ts, end_ts), chunk_size)
+
+    def _iter_unbuffered(self, query, params, chunk_size):
+        """
+        以一個連線執行不緩衝查詢，每次產生最多 chunk_size 筆 tuple；整個結果不會同時存在記憶體中。
+        連線在讀完前一直被佔用，因此先取得 STREAM_SLOTS 中的一個名額。
+        """
+        with self._stream_slots:
+            yield from self._iter_unbuffered_on_connection(query, params, chunk_size)
+
+    def _iter_unbuffered_on_connection(self, query, params, chunk_size):
+        conn = self.get_connection()
+        cursor = conn.cursor(buffered=False)
+        finished = False
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    finished = True
+                    break
+                yield rows
+        finally:
+            try:
+                if not finished:
+                    # 呼叫端提前結束 (break / 例外)：先讀掉剩餘的列，否則下一個取得此連線的查詢會遇到 Unread result found
+                    conn.consume_results()
+                cursor.close()
+            except mysql.connector.Error:
+                # 無法清空時中斷連線，連線池下次取出時會重新連線
+                conn.disconnect()
+            conn.close()
+
     def get_snapshot_by_timestamp(self, dt: datetime):
         """
         根據精確時間戳 (DATETIME) 從 DB 獲取單次快照的所有站點數據。
@@ -205,59 +666,266 @@ class DBManager:
         # 轉換 datetime 為 ISO 格式字串，忽略微秒
         iso_str = dt.isoformat().split('.')[0] 
         
-        query = """
-        SELECT 
-            sr.station_no,
-            sr.available_spaces,
-            s.timestamp_iso AS timestamp
-        FROM station_records sr
-        JOIN data_snapshots s ON sr.timestamp_unix = s.timestamp_unix
-        WHERE s.timestamp_iso = %s 
-        """
-        
-        # 使用通用查詢方法執行
-        return self._execute_query(query, params=(iso_str,), fetch_all=True)
+        snapshot = self._execute_query("""
+            SELECT timestamp_unix, timestamp_iso FROM data_snapshots WHERE timestamp_iso = %s
+        """, params=(iso_str,), fetch_one=True)
+        if not snapshot:
+            return []
+
+        ts = snapshot['timestamp_unix']
+        result = []
+        for _, state in self.iter_snapshot_states(ts, ts, station_nos=self.ALL_STATIONS):
+            result = [{
+                "station_no": row['station_no'],
+                "available_spaces": row['available_spaces'],
+                "timestamp": snapshot['timestamp_iso'],
+            } for row in state.values()]
+        return result
+
 
+    def get_range_matrix(self, station_nos, start: datetime, end: datetime):
+        """
+        多站範圍查詢 (一個 IN (...) 查詢)：回傳 (timestamps, {station_no: [可借車數或 None]})，
+        每個站點的 list 與 timestamps 一一對應。
+        """
+        station_nos = list(station_nos)
+        timestamps = []
+        series = {sno: [] for sno in station_nos}
+        if not station_nos:
+            return timestamps, series
+        for ts, state in self.iter_snapshot_states(int(start.timestamp()), int(end.timestamp()),
+                                                   station_nos=station_nos):
+            timestamps.append(ts)
+            for sno in station_nos:
+                row = state.get(sno)
+                series[sno].append(row['available_spaces'] if row is not None else None)
+        return timestamps, series
 
-    def get_range_logs(self, station_no: str, start: datetime, end: datetime, batch_size=5000, max_workers=5):
+    def iter_range_logs(self, station_no: str, start: datetime, end: datetime, chunk_size=5000):
         """
-        根據站點編號和時間範圍從 station_records 獲取記錄（多線程分批按 timestamp 抓取）。
+        依時間順序逐筆產生該站每個快照時間點的可借車數 (as-of 語意，相容 delta 儲存模式)。
+        只查一次關鍵幀，之後以一個不緩衝的查詢 (data_snapshots LEFT JOIN 該站的 station_records)
+        由 server 端逐批送出，只佔用一個連線，記憶體用量與範圍長度無關。
         """
+        if station_no is None:
+            raise ValueError("需指定 station_no")
         start_ts = int(start.timestamp())
         end_ts = int(end.timestamp())
-        all_rows = []
+        base_ts = self._keyframe_at_or_before(start_ts)
+        if base_ts is None:
+            base_ts = start_ts
 
-        # 先取得第一批的起始 timestamp
-        batch_starts = [start_ts]
+        tombstone = " AND ".join(f"r.{c} IS NULL" for c in self.STATE_COLUMNS)
+        query = f"""
+            SELECT s.timestamp_unix, s.is_keyframe, r.station_no, r.available_spaces, {tombstone} AS is_tombstone
+            FROM data_snapshots s
+            LEFT JOIN station_records r ON r.timestamp_unix = s.timestamp_unix AND r.station_no = %s
+            WHERE s.timestamp_unix BETWEEN %s AND %s
+            ORDER BY s.timestamp_unix ASC
+        """
 
-        def fetch_batch(batch_start):
-            query = """
-            SELECT timestamp_unix, available_spaces
-            FROM station_records
-            WHERE station_no = %s
-            AND timestamp_unix BETWEEN %s AND %s
-            AND timestamp_unix > %s
-            ORDER BY timestamp_unix ASC
-            LIMIT %s
-            """
-            rows = self._execute_query(query, params=(station_no, start_ts, end_ts, batch_start, batch_size), fetch_all=True)
-            for row in rows:
-                row['timestamp'] = datetime.fromtimestamp(row.pop('timestamp_unix'))
-            return rows
+        # 目前這個 tick 結束後該站是否存在與其值；同一 tick 的列都套用完才輸出
+        present, value, current_ts = False, None, None
+        for chunk in self._iter_unbuffered(query, (station_no, base_ts, end_ts), chunk_size):
+            for ts, is_keyframe, row_station, available, is_tombstone in chunk:
+                if ts != current_ts:
+                    if present and current_ts is not None and current_ts >= start_ts:
+                        yield {"timestamp": datetime.fromtimestamp(current_ts), "available_spaces": value}
+                    current_ts = ts
+                    if is_keyframe:
+                        present = False
+                if row_station is not None:
+                    present = not is_tombstone
+                    value = available
+        if present and current_ts is not None and current_ts >= start_ts:
+            yield {"timestamp": datetime.fromtimestamp(current_ts), "available_spaces": value}
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = []
-            current_start = start_ts
-            while True:
-                future = executor.submit(fetch_batch, current_start)
-                rows = future.result()
-                if not rows:
-                    break
-                all_rows.extend(rows)
-                # 下一批從最後一筆 timestamp 往後抓
-                current_start = int(rows[-1]['timestamp'].timestamp())
+    def get_range_logs(self, station_no: str, start: datetime, end: datetime):
+        """根據站點編號和時間範圍獲取該站每個快照時間點的可借車數。"""
+        return list(self.iter_range_logs(station_no, start, end))
+
+    # --------------------
+    # 每小時 / 每日彙總表 (station_hourly / station_daily)
+    # --------------------
+    ROLLUP_TABLES = {"hour": "station_hourly", "day": "station_daily"}
+
+    @staticmethod
+    def _aggregate_rollup(rows, bucket_of):
+        """
+        將依時間排序的 (timestamp_unix, station_no, available_spaces) 彙總成
+        {(station_no, bucket_unix): [count, sum, min, max, delta_sum, first, last]}。
+        """
+        buckets = {}
+        for row in rows:
+            value = row['available_spaces']
+            if value is None:
+                continue
+            key = (row['station_no'], bucket_of(row['timestamp_unix']))
+            agg = buckets.get(key)
+            if agg is None:
+                buckets[key] = [1, value, value, value, 0, value, value]
+                continue
+            agg[0] += 1
+            agg[1] += value
+            agg[2] = min(agg[2], value)
+            agg[3] = max(agg[3], value)
+            agg[4] += abs(value - agg[6])
+            agg[6] = value
+        return buckets
+
+    @staticmethod
+    def _daily_from_hourly(rows, day_of):
+        """
+        將依 (station_no, bucket_unix) 排序的 station_hourly 列合併成每日彙總，格式同 _aggregate_rollup。
+        相鄰兩個小時之間的變化量由前一小時的 last 與後一小時的 first 補上，結果與直接彙總原始資料相同。
+        """
+        buckets = {}
+        for row in rows:
+            key = (row['station_no'], day_of(row['bucket_unix']))
+            agg = buckets.get(key)
+            if agg is None:
+                buckets[key] = [
+                    row['sample_count'], row['sum_available'], row['min_available'], row['max_available'],
+                    row['delta_sum'], row['first_available'], row['last_available'],
+                ]
+                continue
+            agg[0] += row['sample_count']
+            agg[1] += row['sum_available']
+            agg[2] = min(agg[2], row['min_available'])
+            agg[3] = max(agg[3], row['max_available'])
+            agg[4] += row['delta_sum'] + abs(row['first_available'] - agg[6])
+            agg[6] = row['last_available']
+        return buckets
+
+    def _replace_rollup(self, cursor, table, buckets):
+        # 每個區間都是重新計算的完整結果，直接覆寫；重跑同一區間不會重複累計
+        query = f"""
+        INSERT INTO {table} (
+            station_no, bucket_unix, sample_count, sum_available, min_available,
+            max_available, delta_sum, first_available, last_available
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            sample_count = VALUES(sample_count),
+            sum_available = VALUES(sum_available),
+            min_available = VALUES(min_available),
+            max_available = VALUES(max_available),
+            delta_sum = VALUES(delta_sum),
+            first_available = VALUES(first_available),
+            last_available = VALUES(last_available)
+        """
+        values = [(station_no, bucket, *agg) for (station_no, bucket), agg in buckets.items()]
+        if values:
+            cursor.executemany(query, values)
+
+    # 晚於進度才提交、時間戳卻較早的快照 (loader 延遲、write-behind 佇列) 會落在進度之前；
+    # 每次從進度往前這段範圍所在的整點開始重新計算，讓這些快照仍能併入彙總表
+    ROLLUP_GRACE_SECONDS = 2 * 3600
+
+    def compact_rollups(self, batch_hours=6):
+        """
+        增量彙總 station_records 到 station_hourly / station_daily。
+        從「上次進度 - ROLLUP_GRACE_SECONDS」所在的整點開始，每批 batch_hours 個整點，
+        以 as-of 狀態重新計算每小時彙總並覆寫，再由該日所有的每小時彙總重算每日彙總。
+        供排程定期呼叫；回傳本次處理的原始筆數。
+        """
+        state = self._execute_query(
+            "SELECT last_timestamp_unix FROM rollup_state WHERE name = 'station_rollup'", fetch_one=True
+        )
+        if state:
+            start = state['last_timestamp_unix'] - self.ROLLUP_GRACE_SECONDS
+        else:
+            first = self._execute_query("SELECT MIN(timestamp_unix) AS ts FROM data_snapshots", fetch_one=True)
+            if not first or first['ts'] is None:
+                return 0
+            start = first['ts']
+        latest = self._execute_query("SELECT MAX(timestamp_unix) AS ts FROM data_snapshots", fetch_one=True)
+        if not latest or latest['ts'] is None:
+            return 0
+        latest = latest['ts']
+
+        day_starts = {}
+
+        def day_of(ts):
+            # 以本地時間 00:00 為日界；同一小時內的 ts 共用一次換算
+            hour = ts - ts % 3600
+            if hour not in day_starts:
+                d = datetime.fromtimestamp(hour)
+                day_starts[hour] = int(datetime(d.year, d.month, d.day).timestamp())
+            return day_starts[hour]
+
+        def next_day(day):
+            d = datetime.fromtimestamp(day) + timedelta(days=1)
+            return int(datetime(d.year, d.month, d.day).timestamp())
+
+        processed = 0
+        hour = start - start % 3600
+        while hour <= latest:
+            # 批次以整點切齊，每個小時都在同一批內完整重算
+            upper = min(hour + batch_hours * 3600 - 1, latest)
 
-        return all_rows
+            # 以 as-of 還原每個 tick 的完整狀態 (delta 模式下未變動的站點不會有新列)
+            rows = [
+                {"timestamp_unix": ts, "station_no": sno, "available_spaces": row['available_spaces']}
+                for ts, state in self.iter_snapshot_states(hour, upper, station_nos=self.ALL_STATIONS)
+                for sno, row in state.items()
+            ]
+            hourly = self._aggregate_rollup(rows, lambda ts: ts - ts % 3600)
+
+            conn = self.get_connection()
+            cursor = conn.cursor(dictionary=True)
+            try:
+                self._replace_rollup(cursor, "station_hourly", hourly)
+                day, last_day = day_of(hour), day_of(upper)
+                while day <= last_day:
+                    cursor.execute("""
+                        SELECT station_no, bucket_unix, sample_count, sum_available, min_available,
+                               max_available, delta_sum, first_available, last_available
+                        FROM station_hourly
+                        WHERE bucket_unix >= %s AND bucket_unix < %s
+                        ORDER BY station_no, bucket_unix
+                    """, (day, next_day(day)))
+                    self._replace_rollup(cursor, "station_daily", self._daily_from_hourly(cursor.fetchall(), day_of))
+                    day = next_day(day)
+                cursor.execute("""
+                    INSERT INTO rollup_state (name, last_timestamp_unix) VALUES ('station_rollup', %s)
+                    ON DUPLICATE KEY UPDATE last_timestamp_unix = VALUES(last_timestamp_unix)
+                """, (upper,))
+                conn.commit()
+            except mysql.connector.Error as err:
+                conn.rollback()
+                print(f"DBManager: 彙總表寫入失敗: {err}")
+                raise
+            finally:
+                cursor.close()
+                conn.close()
+
+            processed += len(rows)
+            hour = upper + 1
+
+        if processed:
+            print(f"DBManager: 彙總完成，處理 {processed} 筆，進度至 {latest}")
+        return processed
+
+    def get_rollup_watermark(self):
+        """彙總表已處理到的 timestamp_unix；尚未彙總過時回傳 None。"""
+        state = self._execute_query(
+            "SELECT last_timestamp_unix FROM rollup_state WHERE name = 'station_rollup'", fetch_one=True
+        )
+        return state['last_timestamp_unix'] if state else None
+
+    def get_rollup_range(self, station_no: str, start: datetime, end: datetime, resolution="hour"):
+        """從 station_hourly / station_daily 讀取單站在時間範圍內的彙總資料。"""
+        table = self.ROLLUP_TABLES[resolution]
+        query = f"""
+        SELECT bucket_unix, sample_count, min_available, max_available, avg_available, delta_sum
+        FROM {table}
+        WHERE station_no = %s AND bucket_unix BETWEEN %s AND %s
+        ORDER BY bucket_unix ASC
+        """
+        return self._execute_query(
+            query, params=(station_no, int(start.timestamp()), int(end.timestamp())), fetch_all=True
+        )
 
     def get_all_station_nos(self):
         query = "SELECT DISTINCT station_no FROM station_records"
@@ -371,25 +1039,9 @@ class DBManager:
             fav_ids = [f['station_no'] for f in favorites_data]
 
             # 3. 統一獲取這些站點的「最新即時狀態」
-            # 我們從 station_records 抓取最新的快照資訊
+            # 由 station_latest (或其記憶體鏡像) 以主鍵讀取，不再掃描 station_records
             all_target_ids = list(set(recent_ids + fav_ids))
-            stations_info = {}
-            
-            if all_target_ids:
-                # 這裡使用一個子查詢來確保抓到的是每個站點最新的那一筆資料
-                format_strings = ','.join(['%s'] * len(all_target_ids))
-                query = f"""
-                    SELECT r.* FROM station_records r
-                    INNER JOIN (
-                        SELECT station_no, MAX(id) as max_id 
-                        FROM station_records 
-                        WHERE station_no IN ({format_strings})
-                        GROUP BY station_no
-                    ) as latest ON r.id = latest.max_id
-                """
-                cursor.execute(query, tuple(all_target_ids))
-                for row in cursor.fetchall():
-                    stations_info[row['station_no']] = row
+            stations_info = self.get_latest_states(all_target_ids) if all_target_ids else {}
 
             # 4. 組合回傳結果，保持最近使用的順序
             recent_list = [stations_info[sid] for sid in recent_ids if sid in stations_info]
@@ -0,0 +1,75 @@
+import math
+import numpy as np
+
+"""時間序列降採樣：依時間桶彙總 (avg / min / max / last) 或以 LTTB 保留曲線形狀，讓回應大小取決於圖表而非原始資料量"""
+
+# /range?resolution=... 可用的時間桶 (秒)
+RESOLUTIONS = {"5m": 300, "15m": 900, "1h": 3600, "1d": 86400}
+AGGREGATES = ("avg", "min", "max", "last")
+
+
+def bucket_seconds_for(start_ts, end_ts, max_points):
+    """讓 [start_ts, end_ts] 最多切成 max_points 個時間桶的桶寬 (秒，至少 1)。"""
+    return max(1, math.ceil((end_ts - start_ts + 1) / max_points))
+
+
+def bucket_aggregate(timestamps, values, bucket_seconds, agg="avg", utc_offset=0):
+    """
+    依時間桶彙總 (向量化，timestamps 需已排序)。
+    桶的邊界為 (timestamp + utc_offset) 的整數倍：傳入當地 UTC 偏移時對齊當地時間 (1d 的桶從當地午夜開始)，
+    傳入 -start_ts 時從 start_ts 起算。
+    :return: (每個非空桶的起始 Unix 時間, 彙總值)
+    """
+    if agg not in AGGREGATES:
+        raise ValueError(f"不支援的 agg: {agg}")
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if not len(timestamps):
+        return timestamps, values
+
+    buckets = (timestamps + utc_offset) // bucket_seconds
+    # timestamps 已排序，每個桶在陣列中是連續的一段
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    bucket_ts = buckets[starts] * bucket_seconds - utc_offset
+
+    if agg == "avg":
+        counts = np.diff(np.r_[starts, len(values)])
+        result = np.add.reduceat(values, starts) / counts
+    elif agg == "min":
+        result = np.minimum.reduceat(values, starts)
+    elif agg == "max":
+        result = np.maximum.reduceat(values, starts)
+    else:
+        result = values[np.r_[starts[1:], len(values)] - 1]
+    return bucket_ts, result
+
+
+def lttb(timestamps, values, n_out):
+    """
+    Largest-Triangle-Three-Buckets：挑出 n_out 個原始點，保留峰值與轉折，畫出的曲線與原始資料相近。
+    :return: 被選中點的 index (遞增)
+    """
+    if n_out < 3:
+        raise ValueError("LTTB 至少需要 3 個點")
+    n = len(timestamps)
+    if n_out >= n:
+        return np.arange(n)
+    x = np.asarray(timestamps, dtype=np.float64)
+    y = np.asarray(values, dtype=np.float64)
+
+    # 頭尾固定保留，中間的點平均分成 n_out - 2 個桶
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 下一個桶的平均點 (最後一個桶則用最後一點)
+        if i + 2 < len(edges):
+            nxt_x, nxt_y = x[hi:edges[i + 2]].mean(), y[hi:edges[i + 2]].mean()
+        else:
+            nxt_x, nxt_y = x[n - 1], y[n - 1]
+        area = np.abs((x[prev] - nxt_x) * (y[lo:hi] - y[prev]) - (x[prev] - x[lo:hi]) * (nxt_y - y[prev]))
+        prev = lo + int(np.argmax(area))
+        selected[i + 1] = prev
+    return selected
@@ -0,0 +1,96 @@
+from datetime import datetime, timezone
+from flask import current_app, request, jsonify
+from response_cache import dumps
+
+"""HTTP 條件快取：依資料版本產生 ETag / Last-Modified，符合 If-None-Match / If-Modified-Since 時回傳 304 且不產生內容"""
+
+# 回應內容可以是一般的 dict / list (以 jsonify 序列化)，
+# 或是 response_cache.EncodedBody (預先序列化與壓縮好的 bytes，用 send_encoded 直接送出)
+# 很長的結果則以 stream_ndjson 邊產生邊送出
+
+# 會隨新資料改變：可以快取，但每次使用前都要以 ETag 向伺服器確認
+REVALIDATE = "public, no-cache"
+
+
+def make_etag(*parts):
+    return "-".join(str(p) for p in parts)
+
+
+def _http_datetime(timestamp_unix):
+    return datetime.fromtimestamp(int(timestamp_unix), tz=timezone.utc)
+
+
+def is_not_modified(etag, last_modified=None):
+    """If-None-Match 優先；沒有送 If-None-Match 時才比較 If-Modified-Since (秒精度)。"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag) or request.if_none_match.star_tag
+    if last_modified is not None and request.if_modified_since is not None:
+        return _http_datetime(last_modified) <= request.if_modified_since
+    return False
+
+
+def _apply_headers(response, etag, last_modified, cache_control):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _http_datetime(last_modified)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+def conditional(etag, build, last_modified=None, cache_control=REVALIDATE, make_response=jsonify):
+    """
+    :param etag: 由資料版本組成的字串 (不含引號)；None 表示不快取，直接回傳 build() 的結果
+    :param build: 產生回應內容的函式，只有在需要完整回應時才呼叫
+    :param last_modified: 資料最後變動的 Unix 時間
+    """
+    if etag is None:
+        return make_response(build())
+    if is_not_modified(etag, last_modified):
+        return _apply_headers(current_app.response_class(status=304), etag, last_modified, cache_control)
+    return _apply_headers(make_response(build()), etag, last_modified, cache_control)
+
+
+def send_encoded(body):
+    """直接送出 EncodedBody 中符合 Accept-Encoding 的版本，不再重新序列化或壓縮。"""
+    encoding, data = body.choose(request.accept_encodings)
+    response = current_app.response_class(data, mimetype="application/json")
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    if body.gzip is not None:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def wants_ndjson():
+    """?format=ndjson，或 Accept 偏好 application/x-ndjson 勝過 application/json。"""
+    if request.args.get("format") == "ndjson":
+        return True
+    return request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def stream_ndjson(rows, flush_rows=500):
+    """
+    以 chunked transfer 逐行送出 NDJSON (每列一個 JSON 物件)。
+    每累積 flush_rows 列送出一個 chunk；rows 可以是 generator，整個回應不會一次存在記憶體中。
+    內容送出後無法再改回 4xx / 5xx，途中發生錯誤時以最後一行 {"error": ...} 告知客戶端。
+    """
+    def generate():
+        chunk = []
+        try:
+            for row in rows:
+                chunk.append(dumps(row))
+                if len(chunk) >= flush_rows:
+                    yield b"\n".join(chunk) + b"\n"
+                    chunk = []
+        except Exception as e:
+            print(f"stream_ndjson: 串流中斷: {e}")
+            chunk.append(dumps({"error": str(e)}))
+        if chunk:
+            yield b"\n".join(chunk) + b"\n"
+
+    response = current_app.response_class(generate(), mimetype=NDJSON_MIMETYPE)
+    response.headers["X-Accel-Buffering"] = "no"    # 反向代理 (nginx) 不要緩衝整個回應
+    return response
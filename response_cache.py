@@ -0,0 +1,60 @@
+import gzip
+import json
+
+try:
+    import orjson
+except ImportError:     # 沒有安裝 orjson 時退回標準函式庫
+    orjson = None
+
+try:
+    import brotli
+except ImportError:     # 沒有安裝 brotli 時只提供 gzip
+    brotli = None
+
+"""預先序列化並壓縮好的回應內容：同一份資料只 encode / 壓縮一次，之後直接送出 bytes"""
+
+# 只有超過此大小的內容才另外存壓縮版本 (小回應壓縮的效益低於 header 開銷)
+MIN_COMPRESS_BYTES = 1024
+
+
+def dumps(payload):
+    """
+    序列化為 UTF-8 bytes，非字串 key 轉為字串。
+    key 依 dict 的建立順序輸出、不另外排序：orjson 的 OPT_SORT_KEYS 會在轉成字串後才排序，
+    {0: .., 1: .., 10: ..} 這類以小時為 key 的結果會變成 "0", "1", "10", "11", ..., "2" 的順序。
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+
+
+class EncodedBody:
+    """一個回應的 identity / gzip / br 版本。"""
+
+    __slots__ = ("identity", "gzip", "br")
+
+    def __init__(self, payload):
+        self.identity = dumps(payload)
+        self.gzip = None
+        self.br = None
+        if len(self.identity) >= MIN_COMPRESS_BYTES:
+            # mtime=0 讓相同內容產生相同的 bytes
+            self.gzip = gzip.compress(self.identity, compresslevel=6, mtime=0)
+            if brotli is not None:
+                self.br = brotli.compress(self.identity, quality=5)
+
+    @property
+    def nbytes(self):
+        return len(self.identity) + len(self.gzip or b"") + len(self.br or b"")
+
+    def choose(self, accept_encoding):
+        """
+        依 Accept-Encoding 挑選版本。
+        :param accept_encoding: werkzeug 的 request.accept_encodings
+        :return: (content_encoding 或 None, bytes)
+        """
+        if self.br is not None and accept_encoding["br"]:
+            return "br", self.br
+        if self.gzip is not None and accept_encoding["gzip"]:
+            return "gzip", self.gzip
+        return None, self.identity
@@ -0,0 +1,242 @@
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from snapshot_store import (
+    SnapshotStore, HourlyRollup, FIELDS, MISSING, pack_layout, unpack_layout, write_layout, rollup_arrays,
+)
+
+"""將 SnapshotStore / HourlyRollup 放進 multiprocessing.shared_memory，供多個 WSGI worker 唯讀共用"""
+
+# 共三種區段：
+# - "{name}_ctl"：目前的世代 (generation)，讀取端發現世代改變時才重新 attach
+# - "{name}_{generation}"：該世代的 meta 與 HourlyRollup (每次發布重寫，只有數百 KB)
+# - "{name}_data_{generation}"：預留容量的 時間 × 站點 陣列，跨世代沿用；
+#   每次發布只把新列附加在已發布列之後，滾動視窗移除的列只是移動起點，
+#   容量 (列或站點) 不足、或 store 被重新載入 / 亂序插入時才配置新的資料區段。
+# 已發布世代看得到的列不會再被改寫，讀取端可以一直持有舊世代的 view。
+
+
+def _segment_name(name, generation):
+    return f"{name}_{generation}"
+
+
+def _data_segment_name(name, generation):
+    return f"{name}_data_{generation}"
+
+
+def _attach(segment_name):
+    """attach 既有區段；取消 resource_tracker 登記，避免 worker 結束時把區段刪掉。"""
+    shm = shared_memory.SharedMemory(name=segment_name)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+def _create(segment_name, header, placed, total):
+    shm = shared_memory.SharedMemory(name=segment_name, create=True, size=total)
+    write_layout(shm.buf, header, placed)
+    return shm
+
+
+class SharedStorePublisher:
+    """由單一 loader 行程使用：把新的快照列附加到共享的資料區段，並發布新的世代。"""
+
+    def __init__(self, name="youbike_snapshots", keep=2, row_headroom=0.25, min_headroom_rows=1440,
+                 station_headroom=64):
+        self.name = name
+        self.keep = keep
+        self.row_headroom = row_headroom                # 配置資料區段時多預留的列數比例
+        self.min_headroom_rows = min_headroom_rows
+        self.station_headroom = station_headroom
+        self.generation = 0
+        self._segments = []     # [(generation, meta SharedMemory, 資料區段名稱)]
+        self._data = {}         # {資料區段名稱: SharedMemory}
+        self._data_name = None
+        self._arrays = None     # 目前資料區段的可寫 view
+        self._source = None     # 上次發布的 SnapshotStore
+        self._start = 0         # 上次發布的第一列在資料區段中的位置
+        self._end = 0
+        try:
+            self._ctl = shared_memory.SharedMemory(name=f"{name}_ctl", create=True, size=8)
+        except FileExistsError:
+            # 上一個 loader 未清理乾淨，沿用其控制區段並接續世代編號
+            self._ctl = shared_memory.SharedMemory(name=f"{name}_ctl")
+            self.generation = int(np.frombuffer(self._ctl.buf, dtype=np.int64, count=1)[0])
+
+    def _allocate(self, store, generation):
+        """配置新的資料區段 (格子預設為 MISSING)，容量為目前大小再加上預留空間。"""
+        n_ts, n_st = len(store), len(store.station_nos)
+        rows = n_ts + max(int(n_ts * self.row_headroom), self.min_headroom_rows)
+        stations = n_st + self.station_headroom
+        arrays = {
+            "timestamps": np.broadcast_to(np.zeros(1, dtype=store.timestamps.dtype), (rows,)),
+            "hours": np.broadcast_to(np.zeros(1, dtype=store.hours.dtype), (rows,)),
+        }
+        for f in FIELDS:
+            arrays[f"col:{f}"] = np.broadcast_to(np.full(1, MISSING, dtype=store.columns[f].dtype), (rows, stations))
+        name = _data_segment_name(self.name, generation)
+        shm = _create(name, *pack_layout(arrays, {}))
+        self._data[name] = shm
+        self._data_name = name
+        _, self._arrays = unpack_layout(shm.buf, writeable=True)
+        self._source = store
+        self._start = self._end = 0
+        return shm.size
+
+    def _appendable_from(self, store):
+        """
+        上次發布的列若仍是 store 開頭的連續一段 (只在開頭被滾動視窗移除)，回傳 (移除列數, 沿用列數)；
+        store 被替換、亂序插入或容量不足時回傳 None。
+        """
+        if self._arrays is None or store is not self._source or not len(store):
+            return None
+        n_ts, n_st = len(store), len(store.station_nos)
+        published = self._arrays["timestamps"][self._start:self._end]
+        evicted = int(np.searchsorted(published, store.timestamps[0]))
+        kept = len(published) - evicted
+        if kept > n_ts or not np.array_equal(published[evicted:], store.timestamps[:kept]):
+            return None
+        rows, stations = self._arrays["col:available_spaces"].shape
+        if self._end + n_ts - kept > rows or n_st > stations:
+            return None
+        return evicted, kept
+
+    def publish(self, store: SnapshotStore, rollup: HourlyRollup):
+        n_ts, n_st = len(store), len(store.station_nos)
+        generation = self.generation + 1
+
+        appendable = self._appendable_from(store)
+        allocated = 0
+        if appendable is None:
+            allocated = self._allocate(store, generation)
+            kept = 0
+        else:
+            evicted, kept = appendable
+            self._start += evicted
+
+        # 新列寫在所有已發布世代看得到的範圍之後
+        start, end = self._end, self._end + n_ts - kept
+        arrays = self._arrays
+        arrays["timestamps"][start:end] = store.timestamps[kept:n_ts]
+        arrays["hours"][start:end] = store.hours[kept:n_ts]
+        for f in FIELDS:
+            arrays[f"col:{f}"][start:end, :n_st] = store.columns[f][kept:n_ts, :n_st]
+        self._end = end
+
+        meta = {
+            "station_nos": store.station_nos, "last_ts": rollup.last_ts,
+            "data_segment": self._data_name, "start": self._start, "size": self._end - self._start,
+        }
+        shm = _create(_segment_name(self.name, generation), *pack_layout(rollup_arrays(rollup, n_st), meta))
+
+        # 資料寫完後才更新世代，讀取端不會看到寫到一半的區段
+        np.frombuffer(self._ctl.buf, dtype=np.int64, count=1)[0] = generation
+        self.generation = generation
+        self._segments.append((generation, shm, self._data_name))
+
+        # 舊世代只移除名稱；已 attach 的 worker 仍可繼續使用原本的對映直到切換
+        while len(self._segments) > self.keep:
+            _, old, _ = self._segments.pop(0)
+            old.close()
+            old.unlink()
+        in_use = {data_name for _, _, data_name in self._segments}
+        for data_name in [n for n in self._data if n not in in_use]:
+            old = self._data.pop(data_name)
+            old.close()
+            old.unlink()
+
+        note = f"新配置資料區段 {allocated / 2**20:.1f} MiB" if allocated else "沿用資料區段"
+        print(f"SharedStore: 發布世代 {generation}，{n_ts} 個時間點 × {n_st} 站，寫入 {end - start} 列 ({note})")
+        return generation
+
+    def close(self):
+        for _, shm, _ in self._segments:
+            shm.close()
+            shm.unlink()
+        self._segments = []
+        self._arrays = None
+        for shm in self._data.values():
+            shm.close()
+            shm.unlink()
+        self._data = {}
+        self._ctl.close()
+        self._ctl.unlink()
+
+
+class SharedStoreReader:
+    """由 web worker 使用：以零複製的唯讀 view attach 最新世代。"""
+
+    def __init__(self, name="youbike_snapshots"):
+        self.name = name
+        self.generation = None
+        self._ctl = None
+        self._shm = None
+        self._data_shm = None
+        self._data_arrays = None
+        self._retired = []      # 已切換掉、但可能仍有 request 持有 view 的舊區段
+        self.store = None
+        self.rollup = None
+
+    def _published_generation(self):
+        if self._ctl is None:
+            try:
+                self._ctl = _attach(f"{self.name}_ctl")
+            except FileNotFoundError:
+                return None
+        generation = int(np.frombuffer(self._ctl.buf, dtype=np.int64, count=1)[0])
+        return generation or None
+
+    def refresh(self):
+        """若 loader 發布了新世代就重新 attach；回傳是否有切換。"""
+        generation = self._published_generation()
+        if generation is None or generation == self.generation:
+            return False
+        try:
+            shm = _attach(_segment_name(self.name, generation))
+        except FileNotFoundError:
+            # 世代剛被淘汰，下次再試
+            return False
+        meta, arrays = unpack_layout(shm.buf)
+        data_shm = self._data_shm
+        if data_shm is None or data_shm.name != meta["data_segment"]:
+            try:
+                data_shm = _attach(meta["data_segment"])
+            except FileNotFoundError:
+                del arrays
+                shm.close()
+                return False
+
+        if data_shm is not self._data_shm:
+            if self._data_shm is not None:
+                self._retired.append(self._data_shm)
+            self._data_shm = data_shm
+            _, self._data_arrays = unpack_layout(data_shm.buf)
+
+        lo, hi, n_st = meta["start"], meta["start"] + meta["size"], len(meta["station_nos"])
+        data = self._data_arrays
+        self.store = SnapshotStore.from_arrays(
+            meta["station_nos"],
+            data["timestamps"][lo:hi],
+            data["hours"][lo:hi],
+            {f: data[f"col:{f}"][lo:hi, :n_st] for f in FIELDS},
+        )
+        self.rollup = HourlyRollup.from_arrays(
+            {attr: arrays[f"rollup:{attr}"] for attr in HourlyRollup.ARRAYS}, meta["last_ts"]
+        )
+        if self._shm is not None:
+            self._retired.append(self._shm)
+        self._shm = shm
+        self.generation = generation
+        self._close_retired()
+        return True
+
+    def _close_retired(self):
+        still_used = []
+        for shm in self._retired:
+            try:
+                shm.close()
+            except BufferError:
+                # 仍有 request 持有舊世代的陣列 view，下次切換時再釋放
+                still_used.append(shm)
+        self._retired = still_used
@@ -0,0 +1,56 @@
+import threading
+
+"""single-flight：同一個 key 同時只有一個執行緒實際計算，其他執行緒等待並共用同一個結果"""
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    快取未命中時以 do(key, fn) 包住昂貴的計算 (DB 查詢、序列化)：
+    冷啟動時多個 request 同時查同一站，只會打一次 DB，其餘等待結果。
+    fn 丟出例外時，同一批等待者都會收到相同的例外；之後的呼叫會重新計算。
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0     # 直接共用他人結果的次數 (統計用)
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "shared": self.shared}
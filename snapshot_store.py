@@ -0,0 +1,581 @@
+from datetime import datetime
+import json
+import numpy as np
+
+"""欄式 (columnar) 快照儲存：以 時間 × 站點 的 NumPy 陣列取代 list of dict"""
+
+# 每個快照中需保存的數值欄位 (順序即輸出順序)
+FIELDS = (
+    "parking_spaces",
+    "available_spaces",
+    "empty_spaces",
+    "yb2",
+    "eyb",
+    "forbidden_spaces",
+    "available_level",
+)
+
+# 缺值標記：該時間點沒有這個站點的資料
+MISSING = -1
+# 批次載入時尚未填值的格子 (delta 儲存模式下需由上一個時間點補上)
+UNSET = -2
+
+
+class SnapshotStore:
+    """
+    以欄式陣列保存多個時間點的全站快照。
+    - station_index: {station_no: 欄位索引}
+    - timestamps / hours: 依時間排序的 timestamp_unix 與其「小時」
+    - columns[field]: shape = (時間點數, 站點數) 的 int16 陣列，缺值為 MISSING
+    """
+
+    def __init__(self, initial_capacity=1024, initial_stations=1024):
+        self.station_index = {}
+        self.station_nos = []
+        self.ts_index = {}              # {timestamp_unix: 列索引}
+        self.size = 0
+        self.fill_value = MISSING       # 新站點欄位的初始值；批次載入期間為 UNSET
+        self.timestamps = np.zeros(initial_capacity, dtype=np.int64)
+        self.hours = np.zeros(initial_capacity, dtype=np.int8)
+        self.columns = {
+            f: np.full((initial_capacity, initial_stations), MISSING, dtype=np.int16)
+            for f in FIELDS
+        }
+
+    @classmethod
+    def from_arrays(cls, station_nos, timestamps, hours, columns):
+        """
+        以現成陣列 (例如共享記憶體上的唯讀 view) 建立 store，不複製資料。
+        columns[field] 的 shape 需為 (len(timestamps), len(station_nos))。
+        """
+        store = cls.__new__(cls)
+        store.station_nos = list(station_nos)
+        store.station_index = {sno: i for i, sno in enumerate(store.station_nos)}
+        store.timestamps = timestamps
+        store.hours = hours
+        store.columns = dict(columns)
+        store.size = len(timestamps)
+        store.fill_value = MISSING
+        store.ts_index = {ts: i for i, ts in enumerate(timestamps.tolist())}
+        return store
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, ts_unix):
+        return ts_unix in self.ts_index
+
+    @property
+    def nbytes(self):
+        """實際使用中的陣列位元組數 (不含預留容量)。"""
+        n_ts, n_st = self.size, len(self.station_nos)
+        per_cell = sum(col.itemsize for col in self.columns.values())
+        return n_ts * (self.timestamps.itemsize + self.hours.itemsize) + n_ts * n_st * per_cell
+
+    @property
+    def allocated_nbytes(self):
+        """已配置的陣列位元組數 (含預留的列與站點容量)，即實際佔用的記憶體。"""
+        return self.timestamps.nbytes + self.hours.nbytes + sum(col.nbytes for col in self.columns.values())
+
+    def clear(self):
+        self.__init__()
+
+    # -------------------------------------------------
+    # 容量管理
+    # -------------------------------------------------
+    def _grow_rows(self, needed):
+        cap = self.timestamps.shape[0]
+        if needed <= cap:
+            return
+        new_cap = max(needed, cap * 2)
+        self.timestamps = np.resize(self.timestamps, new_cap)
+        self.hours = np.resize(self.hours, new_cap)
+        for f, col in self.columns.items():
+            grown = np.full((new_cap, col.shape[1]), MISSING, dtype=col.dtype)
+            grown[:self.size] = col[:self.size]
+            self.columns[f] = grown
+
+    def _grow_stations(self, needed):
+        cap = next(iter(self.columns.values())).shape[1]
+        if needed <= cap:
+            return
+        new_cap = max(needed, cap * 2)
+        for f, col in self.columns.items():
+            grown = np.full((col.shape[0], new_cap), MISSING, dtype=col.dtype)
+            grown[:self.size, cap:] = self.fill_value
+            grown[:, :cap] = col
+            self.columns[f] = grown
+
+    def _station_col(self, station_no):
+        col = self.station_index.get(station_no)
+        if col is None:
+            col = len(self.station_nos)
+            self._grow_stations(col + 1)
+            self.station_index[station_no] = col
+            self.station_nos.append(station_no)
+        return col
+
+    def _row_for(self, ts_unix):
+        """回傳 ts_unix 所在列；不存在時插入新列 (通常是附加在最後)。"""
+        row = self.ts_index.get(ts_unix)
+        if row is not None:
+            return row
+
+        self._grow_rows(self.size + 1)
+        if self.size == 0 or ts_unix > self.timestamps[self.size - 1]:
+            row = self.size
+        else:
+            # 亂序寫入 (少見)：插入到正確位置並整體往後移一列
+            row = int(np.searchsorted(self.timestamps[:self.size], ts_unix))
+            self.timestamps[row + 1:self.size + 1] = self.timestamps[row:self.size]
+            self.hours[row + 1:self.size + 1] = self.hours[row:self.size]
+            for col in self.columns.values():
+                col[row + 1:self.size + 1] = col[row:self.size]
+                col[row] = MISSING
+            for ts, r in self.ts_index.items():
+                if r >= row:
+                    self.ts_index[ts] = r + 1
+
+        self.timestamps[row] = ts_unix
+        self.hours[row] = datetime.fromtimestamp(ts_unix).hour
+        self.ts_index[ts_unix] = row
+        self.size += 1
+        return row
+
+    # -------------------------------------------------
+    # 寫入
+    # -------------------------------------------------
+    def append(self, ts_unix, rows):
+        """
+        寫入一個時間點的快照。
+        :param rows: 已格式化的站點 dict 列表 (需含 station_no 與 FIELDS 中的欄位)
+        """
+        row = self._row_for(int(ts_unix))
+        cols = [self._station_col(r["station_no"]) for r in rows]
+        for f in FIELDS:
+            values = [r.get(f) for r in rows]
+            self.columns[f][row, cols] = [MISSING if v is None else v for v in values]
+        return row
+
+    # -------------------------------------------------
+    # 批次載入 (預熱用)
+    # -------------------------------------------------
+    def reserve_ticks(self, timestamps):
+        """
+        一次建立所有時間點的列 (store 需為空，timestamps 需已排序)，格子初始為 UNSET，
+        之後以 load_rows 分批填入，最後呼叫 fill_forward。
+        """
+        n = len(timestamps)
+        self._grow_rows(n)
+        self.timestamps[:n] = timestamps
+        self.hours[:n] = [datetime.fromtimestamp(ts).hour for ts in timestamps]
+        for col in self.columns.values():
+            col[:n] = UNSET
+        self.ts_index = {ts: i for i, ts in enumerate(timestamps)}
+        self.size = n
+        self.fill_value = UNSET
+
+    def load_rows(self, chunk, fields=FIELDS):
+        """
+        以向量化方式寫入一批 DB 列：每列為 (timestamp_unix, station_no, *fields)。
+        NULL (墓碑列) 寫為 MISSING；不在 reserve_ticks 範圍內的列會被略過。
+        """
+        if not chunk:
+            return
+        arr = np.array(chunk, dtype=object)
+        ts = arr[:, 0].astype(np.int64)
+        rows = np.searchsorted(self.timestamps[:self.size], ts)
+        rows = np.minimum(rows, self.size - 1)
+        valid = self.timestamps[rows] == ts
+
+        uniq, inverse = np.unique(arr[:, 1], return_inverse=True)
+        cols = np.array([self._station_col(sno) for sno in uniq], dtype=np.int64)[inverse]
+
+        values = arr[:, 2:]
+        values = np.where(values == None, MISSING, values).astype(np.int16)  # noqa: E711
+        for i, f in enumerate(fields):
+            self.columns[f][rows[valid], cols[valid]] = values[valid, i]
+
+    def fill_forward(self, keyframes):
+        """
+        依時間順序補值：關鍵幀中未出現的站點為 MISSING，
+        其他時間點未出現的站點沿用上一個時間點的值 (as-of 語意)。
+        """
+        n_st = len(self.station_nos)
+        keyframes = np.asarray(keyframes, dtype=bool)
+        self.fill_value = MISSING
+        for col in self.columns.values():
+            col[:self.size, n_st:] = MISSING
+            block = col[:self.size, :n_st]
+            if keyframes.all():
+                block[block == UNSET] = MISSING
+                continue
+            for r in range(self.size):
+                row = block[r]
+                unset = row == UNSET
+                if r == 0 or keyframes[r]:
+                    row[unset] = MISSING
+                else:
+                    row[unset] = block[r - 1][unset]
+
+    def seed_first_row(self, base):
+        """
+        以 base 的最後一列補上第一列仍為 UNSET 的格子 (需在 fill_forward 前呼叫)。
+        用於補齊「起點不是關鍵幀」的增量載入：base 最後一列即是起點之前的完整狀態。
+        """
+        if not self.size or not len(base):
+            return
+        n_base = len(base.station_nos)
+        cols = np.array([self._station_col(sno) for sno in base.station_nos], dtype=np.int64)
+        for f, col in self.columns.items():
+            first = col[0, cols]
+            unset = first == UNSET
+            first[unset] = base.columns[f][base.size - 1, :n_base][unset]
+            col[0, cols] = first
+
+    def extend(self, other):
+        """
+        把 other 的所有列依序接在最後 (other 的時間需都晚於本 store)，站點依站號對應。
+        整塊向量化複製，回傳新列的 range。
+        """
+        n = other.size
+        if not n:
+            return range(self.size, self.size)
+        if self.size and other.timestamps[0] <= self.timestamps[self.size - 1]:
+            raise ValueError("extend 的資料需晚於現有的最後一個時間點")
+        n_other = len(other.station_nos)
+        cols = np.array([self._station_col(sno) for sno in other.station_nos], dtype=np.int64)
+        start = self.size
+        self._grow_rows(start + n)
+        self.timestamps[start:start + n] = other.timestamps[:n]
+        self.hours[start:start + n] = other.hours[:n]
+        for f, col in self.columns.items():
+            col[start:start + n] = MISSING
+            col[start:start + n, cols] = other.columns[f][:n, :n_other]
+        for i, ts in enumerate(other.timestamps[:n].tolist()):
+            self.ts_index[ts] = start + i
+        self.size += n
+        return range(start, start + n)
+
+    def evict_before(self, cutoff_ts):
+        """
+        移除 cutoff_ts 之前的所有列 (滾動視窗)，剩下的列整批往前搬移一次。
+        回傳移除的列數；空出來的站點欄位保留 (索引不變)。
+        """
+        n = int(np.searchsorted(self.timestamps[:self.size], cutoff_ts, side="left"))
+        if n == 0:
+            return 0
+        keep = self.size - n
+        self.timestamps[:keep] = self.timestamps[n:self.size]
+        self.hours[:keep] = self.hours[n:self.size]
+        for col in self.columns.values():
+            col[:keep] = col[n:self.size]
+            col[keep:self.size] = MISSING
+        self.size = keep
+        self.ts_index = {ts: i for i, ts in enumerate(self.timestamps[:keep].tolist())}
+        return n
+
+    # -------------------------------------------------
+    # 讀取
+    # -------------------------------------------------
+    def get_snapshot(self, ts_unix):
+        """還原為 /data/<ts> 的 list of dict 格式 (缺值欄位為 None)；不存在時回傳 None。"""
+        row = self.ts_index.get(ts_unix)
+        if row is None:
+            return None
+
+        n_st = len(self.station_nos)
+        values = {f: self.columns[f][row, :n_st] for f in FIELDS}
+        present = np.flatnonzero(values["available_spaces"] != MISSING)
+        iso_str = datetime.fromtimestamp(ts_unix).isoformat().split('.')[0]
+
+        picked = {}
+        for f in FIELDS:
+            column = values[f][present]
+            picked[f] = column.tolist()
+            for i in np.flatnonzero(column == MISSING).tolist():
+                picked[f][i] = None
+        result = []
+        for i, col in enumerate(present.tolist()):
+            item = {"station_no": self.station_nos[col]}
+            for f in FIELDS:
+                item[f] = picked[f][i]
+            item["timestamp"] = iso_str
+            result.append(item)
+        return result
+
+    def range_matrix(self, start_ts, end_ts, station_nos, field="available_spaces"):
+        """
+        多站的時間序列一次切出：回傳 (timestamps, values)，values 為 時間 × len(station_nos) 的陣列，
+        不存在的站點或缺值為 MISSING。
+        """
+        ts = self.timestamps[:self.size]
+        lo = int(np.searchsorted(ts, start_ts, side="left"))
+        hi = int(np.searchsorted(ts, end_ts, side="right"))
+        cols = [self.station_index.get(sno) for sno in station_nos]
+        known = [i for i, col in enumerate(cols) if col is not None]
+        values = np.full((hi - lo, len(station_nos)), MISSING, dtype=np.int16)
+        if known:
+            values[:, known] = self.columns[field][lo:hi, [cols[i] for i in known]]
+        return ts[lo:hi], values
+
+    def _station_series(self, station_no):
+        """回傳 (小時, 可借車數) 兩個只含有效值的陣列，依時間排序。"""
+        col = self.station_index.get(station_no)
+        if col is None:
+            return np.empty(0, dtype=np.int8), np.empty(0, dtype=np.int16)
+        series = self.columns["available_spaces"][:self.size, col]
+        mask = series != MISSING
+        return self.hours[:self.size][mask], series[mask]
+
+    def hourly_avg(self, station_no):
+        """每小時平均可借車數，長度 24 的 list。"""
+        hours, values = self._station_series(station_no)
+        sums = np.bincount(hours, weights=values, minlength=24)
+        counts = np.bincount(hours, minlength=24)
+        avg = np.divide(sums, counts, out=np.zeros(24), where=counts > 0)
+        return [round(float(v), 2) for v in avg]
+
+    def hourly_delta(self, station_no):
+        """每小時可借車數的絕對變化量總和 (只計算同一小時內相鄰的兩筆)。"""
+        hours, values = self._station_series(station_no)
+        if values.size < 2:
+            return {h: 0.0 for h in range(24)}
+        diffs = np.abs(np.diff(values.astype(np.int32)))
+        same_hour = hours[1:] == hours[:-1]
+        flow = np.bincount(hours[1:][same_hour], weights=diffs[same_hour], minlength=24)
+        return {h: round(float(flow[h]), 2) for h in range(24)}
+
+
+class HourlyRollup:
+    """
+    依 站點 × 小時 累計的串流統計，每寫入一個快照以 O(站點數) 更新。
+    - sums / counts: 可借車數總和與筆數 (用於每小時平均)
+    - flow: 同一小時內相鄰兩筆的絕對變化量總和 (用於每小時變化量)
+    - prev_value / prev_hour: 每站上一筆有效值與其小時
+    """
+
+    def __init__(self, n_stations=0):
+        self.sums = np.zeros((24, n_stations), dtype=np.float64)
+        self.counts = np.zeros((24, n_stations), dtype=np.int64)
+        self.flow = np.zeros((24, n_stations), dtype=np.float64)
+        self.prev_value = np.full(n_stations, MISSING, dtype=np.int32)
+        self.prev_hour = np.full(n_stations, -1, dtype=np.int8)
+        self.last_ts = None
+
+    # 可被匯出 / 還原的陣列 (例如放進共享記憶體)
+    ARRAYS = ("sums", "counts", "flow", "prev_value", "prev_hour")
+
+    @classmethod
+    def from_arrays(cls, arrays, last_ts=None):
+        rollup = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(rollup, name, arrays[name])
+        rollup.last_ts = last_ts
+        return rollup
+
+    @classmethod
+    def from_store(cls, store):
+        """依時間順序重播 store 內所有快照，建立完整的統計。"""
+        rollup = cls(len(store.station_nos))
+        n_st = len(store.station_nos)
+        available = store.columns["available_spaces"]
+        for row in range(store.size):
+            rollup.add(int(store.timestamps[row]), int(store.hours[row]), available[row, :n_st])
+        return rollup
+
+    def _ensure_stations(self, n_stations):
+        old = self.prev_value.shape[0]
+        if n_stations <= old:
+            return
+        pad = n_stations - old
+        self.sums = np.pad(self.sums, ((0, 0), (0, pad)))
+        self.counts = np.pad(self.counts, ((0, 0), (0, pad)))
+        self.flow = np.pad(self.flow, ((0, 0), (0, pad)))
+        self.prev_value = np.pad(self.prev_value, (0, pad), constant_values=MISSING)
+        self.prev_hour = np.pad(self.prev_hour, (0, pad), constant_values=-1)
+
+    def add(self, ts_unix, hour, values):
+        """
+        加入一個時間點的可借車數向量 (依 station_index 排列，缺值為 MISSING)。
+        呼叫端需保證 ts_unix 依序遞增。
+        """
+        self._ensure_stations(values.shape[0])
+        n = values.shape[0]
+        values = values.astype(np.int32)
+        present = values != MISSING
+
+        self.sums[hour, :n][present] += values[present]
+        self.counts[hour, :n][present] += 1
+
+        prev_value = self.prev_value[:n]
+        same_hour = present & (self.prev_hour[:n] == hour) & (prev_value != MISSING)
+        self.flow[hour, :n][same_hour] += np.abs(values[same_hour] - prev_value[same_hour])
+
+        self.prev_value[:n][present] = values[present]
+        self.prev_hour[:n][present] = hour
+        self.last_ts = ts_unix
+
+    def remove_row(self, store, row):
+        """
+        從統計中扣掉 store 第 row 列 (需為統計中最舊的一列) 的貢獻，成本為 O(站點數)：
+        - sums / counts 直接扣除
+        - flow 扣掉這一筆與同站下一筆有效值之間的變化量 (同一小時才有計入)
+        - 被扣掉的是該站最後一筆有效值時，清除 prev_value，之後的新資料不再與它配對
+        """
+        n_st = len(store.station_nos)
+        self._ensure_stations(n_st)
+        available = store.columns["available_spaces"]
+        hour = int(store.hours[row])
+        values = available[row, :n_st].astype(np.int32)
+        present = values != MISSING
+
+        self.sums[hour, :n_st][present] -= values[present]
+        self.counts[hour, :n_st][present] -= 1
+
+        # 各站在 row 之後的下一筆有效值 (通常下一列就有)
+        next_value = np.full(n_st, MISSING, dtype=np.int32)
+        next_hour = np.full(n_st, -1, dtype=np.int8)
+        pending = present.copy()
+        r = row + 1
+        while r < store.size and pending.any():
+            found = pending & (available[r, :n_st] != MISSING)
+            next_value[found] = available[r, :n_st][found]
+            next_hour[found] = store.hours[r]
+            pending &= ~found
+            r += 1
+
+        paired = present & (next_value != MISSING) & (next_hour == hour)
+        self.flow[hour, :n_st][paired] -= np.abs(next_value[paired] - values[paired])
+        self.prev_value[:n_st][pending] = MISSING
+        self.prev_hour[:n_st][pending] = -1
+
+    def hourly_avg(self, col):
+        if col is None or col >= self.counts.shape[1]:
+            return [0.0] * 24
+        sums, counts = self.sums[:, col], self.counts[:, col]
+        avg = np.divide(sums, counts, out=np.zeros(24), where=counts > 0)
+        return [round(float(v), 2) for v in avg]
+
+    def hourly_delta(self, col):
+        if col is None or col >= self.flow.shape[1]:
+            return {h: 0.0 for h in range(24)}
+        flow = self.flow[:, col]
+        return {h: round(float(flow[h]), 2) for h in range(24)}
+
+    def _gather(self, array, cols):
+        """取出多站的 24 × len(cols) 子矩陣；不存在的站點 (None 或超出範圍) 為 0。"""
+        out = np.zeros((24, len(cols)), dtype=np.float64)
+        known = [i for i, col in enumerate(cols) if col is not None and col < array.shape[1]]
+        if known:
+            out[:, known] = array[:, [cols[i] for i in known]]
+        return out
+
+    def hourly_avg_many(self, cols):
+        """多站每小時平均，一次向量化計算；回傳 len(cols) 個長度 24 的 list。"""
+        sums, counts = self._gather(self.sums, cols), self._gather(self.counts, cols)
+        avg = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+        return np.round(avg, 2).T.tolist()
+
+    def hourly_delta_many(self, cols):
+        """多站每小時變化量；回傳 len(cols) 個長度 24 的 list (index 即小時)。"""
+        return np.round(self._gather(self.flow, cols), 2).T.tolist()
+
+
+# -------------------------------------------------
+# 二進位佈局：[8 bytes: meta 長度][meta JSON][對齊 64 bytes 的各陣列資料]
+# 共享記憶體 (shared_store) 與磁碟 checkpoint 共用
+# -------------------------------------------------
+_ALIGN = 64
+_HEADER = 8
+
+
+def _align(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def pack_layout(arrays, meta):
+    """
+    計算一組陣列的二進位佈局；各陣列的位置記錄在 meta["arrays"]。
+    :param arrays: {key: array}，可為 np.broadcast_to 的常數陣列 (寫入時即以該值填滿)
+    :return: (header bytes, [(offset, array)], 總長度)
+    """
+    layout = []
+    offset = 0
+    for key, arr in arrays.items():
+        offset = _align(offset)
+        layout.append({"key": key, "dtype": arr.dtype.str, "shape": arr.shape, "offset": offset})
+        offset += arr.nbytes
+    meta = dict(meta, arrays=layout)
+    meta_bytes = json.dumps(meta).encode("utf-8")
+
+    data_start = _align(_HEADER + len(meta_bytes))
+    header = len(meta_bytes).to_bytes(_HEADER, "little") + meta_bytes
+    placed = [(data_start + item["offset"], arrays[item["key"]]) for item in layout]
+    return header, placed, max(data_start + offset, 1)
+
+
+def unpack_layout(buffer, writeable=False):
+    """以零複製的 view 還原 pack_layout 寫入的 (meta, {key: array})。"""
+    meta_len = int.from_bytes(bytes(buffer[:_HEADER]), "little")
+    meta = json.loads(bytes(buffer[_HEADER:_HEADER + meta_len]).decode("utf-8"))
+    data_start = _align(_HEADER + meta_len)
+
+    arrays = {}
+    for item in meta["arrays"]:
+        arr = np.ndarray(tuple(item["shape"]), dtype=np.dtype(item["dtype"]),
+                         buffer=buffer, offset=data_start + item["offset"])
+        if not writeable:
+            arr.flags.writeable = False
+        arrays[item["key"]] = arr
+    return meta, arrays
+
+
+def rollup_arrays(rollup, n_st):
+    """HourlyRollup 中前 n_st 站的陣列，以 pack_layout 的 key 命名。"""
+    return {f"rollup:{attr}": getattr(rollup, attr)[..., :n_st] for attr in HourlyRollup.ARRAYS}
+
+
+def export_layout(store, rollup, extra_meta=None):
+    """
+    計算 store / rollup 的二進位佈局。
+    :return: (header bytes, [(offset, array)], 總長度)
+    """
+    n_ts, n_st = len(store), len(store.station_nos)
+    arrays = {
+        "timestamps": store.timestamps[:n_ts],
+        "hours": store.hours[:n_ts],
+    }
+    for f in FIELDS:
+        arrays[f"col:{f}"] = store.columns[f][:n_ts, :n_st]
+    arrays.update(rollup_arrays(rollup, n_st))
+
+    meta = dict(extra_meta or {})
+    meta.update({"station_nos": store.station_nos, "last_ts": rollup.last_ts})
+    return pack_layout(arrays, meta)
+
+
+def write_layout(buffer, header, placed):
+    """把 export_layout 的結果寫入 buffer (memoryview / mmap)。"""
+    buffer[:len(header)] = header
+    for offset, src in placed:
+        dst = np.ndarray(src.shape, dtype=src.dtype, buffer=buffer, offset=offset)
+        dst[...] = src
+
+
+def import_layout(buffer, writeable=False):
+    """
+    以零複製的 view 還原 (store, rollup, meta)。
+    writeable=False 時陣列為唯讀 (共享記憶體)；checkpoint 以 copy-on-write 對映時可寫。
+    """
+    meta, arrays = unpack_layout(buffer, writeable)
+    store = SnapshotStore.from_arrays(
+        meta["station_nos"],
+        arrays["timestamps"],
+        arrays["hours"],
+        {f: arrays[f"col:{f}"] for f in FIELDS},
+    )
+    rollup = HourlyRollup.from_arrays(
+        {attr: arrays[f"rollup:{attr}"] for attr in HourlyRollup.ARRAYS}, meta["last_ts"]
+    )
+    return store, rollup, meta
@@ -0,0 +1,129 @@
+import math
+import numpy as np
+
+"""站點座標的網格空間索引：查詢只計算附近格子內的站點距離，不對全部站點做 haversine"""
+
+EARTH_RADIUS = 6371000  # 地球半徑 (公尺)，與 api.haversine 相同
+
+
+def haversine_many(lat, lng, lats, lngs):
+    """api.haversine 的向量化版本：一個點對多個點的距離 (公尺)。"""
+    lat, lng = math.radians(lat), math.radians(lng)
+    lats, lngs = np.radians(lats), np.radians(lngs)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+class StationSpatialIndex:
+    """
+    以等距圓柱投影把經緯度換成公尺，切成 cell_size 公尺見方的格子：
+    - 半徑查詢只走訪與圓相交的格子
+    - k 近鄰查詢由中心格往外一圈一圈擴張，第 k 近的距離小於已走訪範圍時即停止
+    高雄市範圍內投影誤差遠小於格子大小，最終距離仍以 haversine 計算。
+    """
+
+    # 超過此圈數時改為對全部站點計算距離，走訪格子的成本不再隨距離成長
+    MAX_WALK_RINGS = 40
+
+    def __init__(self, stations, cell_size=250):
+        """
+        :param stations: [{"station_no", "lat", "lng", ...}]，其餘欄位 (如 name) 會原樣回傳
+        """
+        self.cell_size = cell_size
+        self.stations = [s for s in stations if s.get("lat") is not None and s.get("lng") is not None]
+        self.lats = np.array([float(s["lat"]) for s in self.stations], dtype=np.float64)
+        self.lngs = np.array([float(s["lng"]) for s in self.stations], dtype=np.float64)
+        self.lat0 = float(self.lats.mean()) if len(self.stations) else 0.0
+        self._cos_lat0 = math.cos(math.radians(self.lat0))
+
+        cells = {}
+        if len(self.stations):
+            cx, cy = self._cell_of(self.lats, self.lngs)
+            for i, key in enumerate(zip(cx.tolist(), cy.tolist())):
+                cells.setdefault(key, []).append(i)
+        self.cells = {key: np.array(idx, dtype=np.int64) for key, idx in cells.items()}
+        if self.cells:
+            xs = [key[0] for key in self.cells]
+            ys = [key[1] for key in self.cells]
+            self._bounds = (min(xs), max(xs), min(ys), max(ys))
+        else:
+            self._bounds = None
+
+    def __len__(self):
+        return len(self.stations)
+
+    def _cell_of(self, lat, lng):
+        x = np.radians(lng) * EARTH_RADIUS * self._cos_lat0
+        y = np.radians(lat) * EARTH_RADIUS
+        return np.floor(x / self.cell_size).astype(np.int64), np.floor(y / self.cell_size).astype(np.int64)
+
+    def _ring(self, cx, cy, r):
+        """與中心格 Chebyshev 距離恰為 r 的格子中，有站點的那些。"""
+        if r == 0:
+            idx = self.cells.get((cx, cy))
+            return [idx] if idx is not None else []
+        found = []
+        for dx in range(-r, r + 1):
+            for dy in (-r, r):
+                idx = self.cells.get((cx + dx, cy + dy))
+                if idx is not None:
+                    found.append(idx)
+        for dy in range(-r + 1, r):
+            for dx in (-r, r):
+                idx = self.cells.get((cx + dx, cy + dy))
+                if idx is not None:
+                    found.append(idx)
+        return found
+
+    def _inside(self, cx, cy):
+        min_x, max_x, min_y, max_y = self._bounds
+        return min_x <= cx <= max_x and min_y <= cy <= max_y
+
+    def _max_ring(self, cx, cy):
+        """從中心格出發，涵蓋所有有站點格子所需的圈數 (中心格在網格範圍內時不超過網格邊長)。"""
+        min_x, max_x, min_y, max_y = self._bounds
+        return max(abs(cx - min_x), abs(cx - max_x), abs(cy - min_y), abs(cy - max_y))
+
+    def _select(self, lat, lng, idx, radius, k):
+        dist = haversine_many(lat, lng, self.lats[idx], self.lngs[idx])
+        if radius is not None:
+            keep = dist <= radius
+            idx, dist = idx[keep], dist[keep]
+        order = np.argsort(dist, kind="stable")
+        if k is not None:
+            order = order[:k]
+        return [(float(dist[i]), self.stations[idx[i]]) for i in order]
+
+    def nearby(self, lat, lng, radius=None, k=10):
+        """
+        :param radius: 搜尋半徑 (公尺)，None 表示不限距離
+        :param k: 最多回傳幾站，None 表示半徑內全部
+        :return: [(distance_m, station)]，依距離由近到遠
+        """
+        if not self.cells or (radius is None and k is None):
+            return []
+        cx, cy = (int(v) for v in self._cell_of(np.float64(lat), np.float64(lng)))
+        max_ring = self._max_ring(cx, cy)
+        if radius is not None:
+            max_ring = min(max_ring, int(math.ceil(radius / self.cell_size)))
+        if not self._inside(cx, cy) or max_ring > self.MAX_WALK_RINGS:
+            # 查詢點在網格範圍外，或需要走訪的圈數太多：直接對全部站點計算距離 (站點數少，向量化很快)
+            return self._select(lat, lng, np.arange(len(self.stations)), radius, k)
+
+        candidates = []
+        n_candidates = 0
+        for r in range(max_ring + 1):
+            ring = self._ring(cx, cy, r)
+            candidates.extend(ring)
+            n_candidates += sum(len(idx) for idx in ring)
+            # r 圈以內的格子涵蓋了至少 r * cell_size 公尺內的所有站點
+            if k is not None and n_candidates >= k and r >= 1:
+                idx = np.concatenate(candidates)
+                dist = haversine_many(lat, lng, self.lats[idx], self.lngs[idx])
+                kth = np.partition(dist, k - 1)[k - 1]
+                if kth <= r * self.cell_size:
+                    break
+
+        if not candidates:
+            return []
+        return self._select(lat, lng, np.concatenate(candidates), radius, k)
@@ -0,0 +1,178 @@
+import hashlib
+import threading
+import requests
+
+"""站點登錄資料：常駐記憶體的 {sno: 站名、行政區、座標、車柱數}，以 station_meta 持久化，只在官方清單有差異時寫入"""
+
+OFFICIAL_STATIONS_URL = "https://api.kcg.gov.tw/Api/Service/Get/b4dd9c40-9027-4125-8666-06bef1756092"
+
+
+def _to_float(value):
+    return float(value) if value not in (None, "") else None
+
+
+def record_from_official(item):
+    """官方 JSON 的單站資料轉為登錄資料格式；沒有座標的站點回傳 None。"""
+    lat, lng = _to_float(item.get("lat")), _to_float(item.get("lng"))
+    if lat is None or lng is None:
+        return None
+    return {
+        "station_no": item.get("sno", ""),
+        "name": item.get("sna", ""),
+        "area": item.get("sarea", ""),
+        "address": item.get("ar", ""),
+        "lat": round(lat, 6),
+        "lng": round(lng, 6),
+        "capacity": int(item.get("tot", 0) or 0),
+    }
+
+
+class StationRegistry:
+    """
+    - load(): 啟動時由 station_meta 載入，不連網 (資料表為空時由寫入端向官方抓取一次)
+    - refresh(): 慢速排程呼叫；以 ETag / Last-Modified 條件請求與內容雜湊跳過未變動的官方清單，
+                 有變動時只 upsert 新增 / 變動的站點，並停用已消失的站點
+    - observe(): 抓取即時資料時順便比對，發現新站或座標變動才寫入
+    登錄資料改變時呼叫 listener(records)，例如重建空間索引。
+    read_only=True 供多 worker 部署的 worker 行程使用：只讀 station_meta，官方清單只由寫入端 (cache_loader) 抓取。
+    """
+
+    FIELDS = ("name", "area", "address", "lat", "lng", "capacity")
+
+    def __init__(self, db_manager, source_url=OFFICIAL_STATIONS_URL, read_only=False):
+        self.db_manager = db_manager
+        self.source_url = source_url
+        self.read_only = read_only
+        self.stations = {}      # {station_no: 登錄資料 dict}，只含啟用中的站點
+        self.listeners = []
+        self.version = 0        # 登錄資料每次變動加一 (行程內的快取 key 用)
+        self.content_tag = ""   # 站名與行政區的摘要，各行程相同 (HTTP ETag 用)
+        self._etag = None
+        self._last_modified = None
+        self._digest = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __contains__(self, station_no):
+        return station_no in self.stations
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def _notify(self):
+        records = self.records()
+        for callback in self.listeners:
+            try:
+                callback(records)
+            except Exception as e:
+                print(f"StationRegistry: 回呼失敗: {e}")
+
+    def _update_content_tag(self):
+        # annotate 只會補上站名與行政區，ETag 只需隨這兩個欄位改變
+        h = hashlib.sha1()
+        for sno in sorted(self.stations):
+            station = self.stations[sno]
+            h.update(f"{sno}\t{station['name']}\t{station['area']}\n".encode())
+        self.content_tag = h.hexdigest()[:12]
+
+    # --- 讀取 ---
+    def get(self, station_no):
+        return self.stations.get(station_no)
+
+    def station_nos(self):
+        return set(self.stations)
+
+    def records(self):
+        return list(self.stations.values())
+
+    def annotate(self, rows, key="station_no"):
+        """在每列資料補上站名與行政區 (就地修改並回傳 rows)。"""
+        for row in rows:
+            station = self.stations.get(row.get(key))
+            if station is not None:
+                row.setdefault("name", station["name"])
+                row.setdefault("area", station["area"])
+        return rows
+
+    # --- 載入與更新 ---
+    def load(self):
+        """由 station_meta 載入啟用中的站點；資料表為空時才向官方抓取。"""
+        rows = self.db_manager.get_station_meta(active_only=True)
+        with self._lock:
+            self.stations = {
+                row["station_no"]: {"station_no": row["station_no"], **{f: row[f] for f in self.FIELDS}}
+                for row in rows
+            }
+            self.version += 1
+            self._update_content_tag()
+        print(f"StationRegistry: 由資料庫載入 {len(rows)} 站")
+        if not rows and not self.read_only:
+            self.refresh()
+        else:
+            self._notify()
+        return len(self.stations)
+
+    def refresh(self):
+        """以條件請求抓取官方清單並套用差異，回傳變動的站點數 (未變動為 0)；read_only 時不連網。"""
+        if self.read_only:
+            return 0
+        headers = {"User-Agent": "Mozilla/5.0"}
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+        try:
+            resp = requests.get(self.source_url, headers=headers, timeout=10)
+            if resp.status_code == 304:
+                return 0
+            resp.raise_for_status()
+            digest = hashlib.sha1(resp.content).hexdigest()
+            if digest == self._digest:
+                return 0
+            items = resp.json()["data"]["data"]["retVal"]
+        except Exception as e:
+            print(f"StationRegistry: 抓取官方站點清單失敗: {e}")
+            return 0
+
+        changed = self.merge(items, complete=True)
+        self._etag = resp.headers.get("ETag")
+        self._last_modified = resp.headers.get("Last-Modified")
+        self._digest = digest
+        print(f"StationRegistry: 官方清單 {len(items)} 站，變動 {changed} 站")
+        return changed
+
+    def observe(self, items):
+        """即時資料中出現新站或資料變動時更新登錄資料 (不處理消失的站點)。"""
+        return self.merge(items, complete=False)
+
+    def merge(self, items, complete=False):
+        """
+        與記憶體中的登錄資料比對，只寫入差異。
+        :param items: 官方 JSON 的 retVal
+        :param complete: items 是否為完整清單；是的話不在清單中的站點會被停用
+        """
+        incoming = {}
+        for item in items:
+            record = record_from_official(item)
+            if record is not None and record["station_no"]:
+                incoming[record["station_no"]] = record
+
+        with self._lock:
+            changed = [record for sno, record in incoming.items() if self.stations.get(sno) != record]
+            removed = set(self.stations) - set(incoming) if complete else set()
+            if not changed and not removed:
+                return 0
+            self.db_manager.upsert_station_meta(changed)
+            self.db_manager.deactivate_stations(removed)
+            stations = dict(self.stations)
+            for record in changed:
+                stations[record["station_no"]] = record
+            for sno in removed:
+                stations.pop(sno, None)
+            self.stations = stations
+            self.version += 1
+            self._update_content_tag()
+        self._notify()
+        return len(changed) + len(removed)
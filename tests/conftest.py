@@ -0,0 +1,114 @@
+import importlib
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_manager import DBManager
+
+"""測試共用：以記憶體取代 MySQL 的 DBManager (只實作快照讀寫用到的查詢)，不需連線 DB"""
+
+
+class FakeDBManager(DBManager):
+    """
+    snapshots: {timestamp_unix: is_keyframe}
+    records: station_records 的列 dict，依寫入順序保存 (NULL 欄位即墓碑列)
+    """
+
+    def __init__(self, storage_mode="full", keyframe_interval=3600):
+        with mock.patch("db_manager.pooling.MySQLConnectionPool"):
+            super().__init__({}, storage_mode=storage_mode, keyframe_interval=keyframe_interval,
+                             bulk_writer=object())
+        self.snapshots = {}
+        self.records = []
+
+    def _write_snapshots(self, writes):
+        for unix_timestamp, _, _, is_keyframe, station_values in writes:
+            self.snapshots[unix_timestamp] = int(is_keyframe)
+            for station_no, values in station_values.items():
+                self.records.append({
+                    "timestamp_unix": unix_timestamp, "station_no": station_no,
+                    **dict(zip(self.STATE_COLUMNS, values)),
+                })
+
+    def _sorted_records(self, start_ts, end_ts):
+        return sorted(
+            (r for r in self.records if start_ts <= r["timestamp_unix"] <= end_ts),
+            key=lambda r: r["timestamp_unix"],
+        )
+
+    def _execute_query(self, query, params=None, fetch_one=False, fetch_all=False):
+        query = " ".join(query.split())
+        if "AND is_keyframe = 1 ORDER BY timestamp_unix DESC LIMIT 1" in query:
+            keyframes = [ts for ts, kf in self.snapshots.items() if kf and ts <= params[0]]
+            return {"ts": max(keyframes)} if keyframes else None
+        if query.startswith("SELECT COUNT(*) AS n FROM data_snapshots"):
+            return {"n": sum(1 for ts in self.snapshots if ts >= params[0])}
+        if query.startswith("SELECT timestamp_unix, is_keyframe"):
+            return [
+                {"timestamp_unix": ts, "is_keyframe": kf}
+                for ts, kf in sorted(self.snapshots.items()) if params[0] <= ts <= params[1]
+            ]
+        if "FROM station_records" in query and "BETWEEN" in query:
+            station_nos = params[2:]
+            return [r for r in self._sorted_records(params[0], params[1])
+                    if not station_nos or r["station_no"] in station_nos]
+        raise NotImplementedError(query)
+
+    def _iter_unbuffered(self, query, params, chunk_size):
+        query = " ".join(query.split())
+        if "LEFT JOIN station_records r" in query:
+            station_no, start_ts, end_ts = params
+            by_tick = {}
+            for r in self._sorted_records(start_ts, end_ts):
+                if r["station_no"] == station_no:
+                    by_tick.setdefault(r["timestamp_unix"], []).append(r)
+            rows = []
+            for ts, kf in sorted(self.snapshots.items()):
+                if not start_ts <= ts <= end_ts:
+                    continue
+                for r in by_tick.get(ts) or [None]:
+                    if r is None:
+                        rows.append((ts, kf, None, None, 1))
+                    else:
+                        tombstone = int(all(r[c] is None for c in self.STATE_COLUMNS))
+                        rows.append((ts, kf, station_no, r["available_spaces"], tombstone))
+        elif query.startswith("SELECT timestamp_unix, station_no,") and "FROM station_records" in query:
+            rows = [
+                (r["timestamp_unix"], r["station_no"], *(r[c] for c in self.STATE_COLUMNS))
+                for r in self._sorted_records(*params)
+            ]
+        else:
+            raise NotImplementedError(query)
+        for i in range(0, len(rows), chunk_size):
+            yield rows[i:i + chunk_size]
+
+
+@pytest.fixture
+def fake_db():
+    return FakeDBManager
+
+
+@pytest.fixture
+def import_app(monkeypatch, tmp_path):
+    # app 匯入時會在目前目錄建立 logs/ 與 cache/
+    monkeypatch.chdir(tmp_path)
+    imported = []
+
+    def load(role):
+        monkeypatch.setenv("YOUBIKE_CACHE_ROLE", role)
+        sys.modules.pop("app", None)
+        with mock.patch("db_manager.DBManager") as db_class, \
+                mock.patch("analyzer.Analyzer.attach_shared_store"):
+            db_class.return_value.get_snapshot_ticks.return_value = []
+            module = importlib.import_module("app")
+        imported.append(module)
+        return module
+
+    yield load
+    for module in imported:
+        module.scheduler.shutdown(wait=False)
+        module.write_queue.shutdown()
+    sys.modules.pop("app", None)
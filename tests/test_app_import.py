@@ -0,0 +1,28 @@
+"""匯入 app 的冒煙測試：以 mock 取代 DBManager，確認模組層級的初始化與排程設定可以執行"""
+
+
+def scheduled(module):
+    return [job.func for job in module.scheduler.get_jobs()]
+
+
+def writer_jobs(module):
+    return [module.API.get_YouBike2_API, module.db_manager.compact_rollups,
+            module.analyzer.save_checkpoint, module.registry.refresh]
+
+
+def test_standalone_schedules_writer_jobs(import_app):
+    app = import_app("standalone")
+    jobs = scheduled(app)
+    assert app.scheduler.running
+    for func in writer_jobs(app) + [app.db_manager.load_latest]:
+        assert jobs.count(func) == 1
+
+
+def test_worker_skips_writer_jobs(import_app):
+    app = import_app("worker")
+    jobs = scheduled(app)
+    for func in writer_jobs(app):
+        assert func not in jobs
+    assert jobs.count(app.registry.load) == 1
+    assert app.registry.read_only
+    assert jobs.count(app.db_manager.load_latest) == 1
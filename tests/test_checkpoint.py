@@ -0,0 +1,111 @@
+import random
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from analyzer import Analyzer
+from checkpoint import load_checkpoint
+
+"""checkpoint：存檔後讀回需完全相同；由 checkpoint 暖啟動並補上缺口後，需與從 DB 完整載入的結果相同"""
+
+STATIONS = [f"s{k}" for k in range(8)]
+
+
+def save_ticks(db, start_ts, end_ts, rng, step=60):
+    for ts in range(start_ts, end_ts, step):
+        db.save_snapshot({
+            "timestamp": datetime.fromtimestamp(ts).isoformat(),
+            "stations": [{"station_no": sno, "available_spaces": rng.randint(0, 5)}
+                         for sno in STATIONS if rng.random() < 0.8],
+        })
+
+
+def assert_same_analyzer(actual, expected):
+    store, ref = actual.snapshot_store, expected.snapshot_store
+    assert store.timestamps[:len(store)].tolist() == ref.timestamps[:len(ref)].tolist()
+    for ts in ref.timestamps[:len(ref)].tolist():
+        assert store.get_snapshot(ts) == ref.get_snapshot(ts)
+    cols = [store.station_index[sno] for sno in ref.station_nos]
+    for name in ("sums", "counts", "flow"):
+        assert np.allclose(getattr(actual.hourly_rollup, name)[:, cols],
+                           getattr(expected.hourly_rollup, name)[:, :len(cols)]), name
+
+
+def loaded_analyzer(db):
+    analyzer = Analyzer(db)
+    analyzer.load_previous_week_snapshots()
+    return analyzer
+
+
+def test_checkpoint_round_trip(fake_db, tmp_path):
+    now = int(datetime.now().timestamp())
+    db = fake_db("full")
+    save_ticks(db, now - 3 * 3600, now, random.Random(0))
+    analyzer = loaded_analyzer(db)
+
+    path = str(tmp_path / "snapshots.ckpt")
+    watermark = analyzer.save_checkpoint(path)
+    store, rollup, loaded_watermark = load_checkpoint(path)
+
+    source = analyzer.snapshot_store
+    assert loaded_watermark == watermark == int(source.timestamps[len(source) - 1])
+    assert store.station_nos == source.station_nos
+    n_rows, n_st = len(source), len(source.station_nos)
+    assert len(store) == n_rows
+    for f, col in source.columns.items():
+        assert np.array_equal(store.columns[f][:n_rows, :n_st], col[:n_rows, :n_st])
+    for name in ("sums", "counts", "flow", "prev_value", "prev_hour"):
+        assert np.array_equal(getattr(rollup, name), getattr(analyzer.hourly_rollup, name))
+
+
+@pytest.mark.parametrize("storage_mode", ["full", "delta"])
+@pytest.mark.parametrize("gap_minutes", [20, 150])
+def test_warm_start_catches_up_to_cold_load(fake_db, tmp_path, storage_mode, gap_minutes):
+    """缺口短時逐時間點補上，超過 CATCHUP_BULK_SECONDS 時改用分段批次讀取；兩者結果都需與完整載入相同"""
+    rng = random.Random(1)
+    now = int(datetime.now().timestamp())
+    db = fake_db(storage_mode, keyframe_interval=10 ** 6)
+    save_ticks(db, now - 4 * 3600, now - gap_minutes * 60, rng)
+    path = str(tmp_path / "snapshots.ckpt")
+    loaded_analyzer(db).save_checkpoint(path)
+
+    save_ticks(db, now - gap_minutes * 60, now - 30, rng)
+    warm = Analyzer(db)
+    warm.warm_start(path)
+    assert_same_analyzer(warm, loaded_analyzer(db))
+
+
+def test_bulk_catch_up_skips_as_of_queries(fake_db, tmp_path, monkeypatch):
+    rng = random.Random(2)
+    now = int(datetime.now().timestamp())
+    db = fake_db("delta", keyframe_interval=10 ** 6)
+    save_ticks(db, now - 4 * 3600, now - 3 * 3600, rng)
+    path = str(tmp_path / "snapshots.ckpt")
+    loaded_analyzer(db).save_checkpoint(path)
+    save_ticks(db, now - 3 * 3600, now - 30, rng)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("bulk catch-up should not replay snapshots one by one")
+
+    monkeypatch.setattr(db, "iter_snapshot_states", fail)
+    warm = Analyzer(db)
+    warm.warm_start(path)
+    assert len(warm.snapshot_store) == 4 * 60
+
+
+def test_stale_checkpoint_falls_back_to_full_load(fake_db, tmp_path):
+    rng = random.Random(3)
+    now = int(datetime.now().timestamp())
+    db = fake_db("full")
+    save_ticks(db, now - 9 * 24 * 3600, now - 8 * 24 * 3600, rng, step=3600)
+    path = str(tmp_path / "snapshots.ckpt")
+    old = Analyzer(db, window_days=30)
+    old.load_previous_week_snapshots()
+    old.save_checkpoint(path)
+
+    save_ticks(db, now - 3600, now - 30, rng)
+    warm = Analyzer(db)
+    warm.warm_start(path)
+    assert_same_analyzer(warm, loaded_analyzer(db))
+    assert int(warm.snapshot_store.timestamps[0]) >= now - 3600
@@ -0,0 +1,51 @@
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+"""/data/<ts>：ETag 相符或已有編碼快取時不還原快照；空結果不帶 ETag、不進快取"""
+
+BASE_TS = 1760000000
+
+
+@pytest.fixture
+def client_app(import_app):
+    app = import_app("standalone")
+    for i in range(3):
+        app.analyzer._ingest_snapshot(BASE_TS + i * 60, [
+            {"station_no": "500101001", "available_spaces": i},
+            {"station_no": "500101002", "available_spaces": 5},
+        ])
+    return app
+
+
+def path(ts):
+    return f"/data/{datetime.fromtimestamp(ts).isoformat()}"
+
+
+def test_snapshot_materialized_once(client_app):
+    client = client_app.app.test_client()
+    with mock.patch.object(client_app.analyzer, "get_snapshot_by_timestamp",
+                           wraps=client_app.analyzer.get_snapshot_by_timestamp) as materialize:
+        first = client.get(path(BASE_TS + 60))
+        assert first.status_code == 200
+        assert [row["available_spaces"] for row in first.get_json()] == [1, 5]
+        # 擷取時沒有的欄位回傳 null，與直接查 DB 的結果相同
+        assert first.get_json()[0]["yb2"] is None
+        etag = first.headers["ETag"]
+        # 回應帶有登錄資料，站名變動時需能重新驗證，不可標記為 immutable
+        assert first.headers["Cache-Control"] == client_app.REVALIDATE
+
+        assert client.get(path(BASE_TS + 60)).status_code == 200
+        not_modified = client.get(path(BASE_TS + 60), headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert materialize.call_count == 1
+
+
+def test_missing_snapshot_is_not_cached(client_app):
+    client = client_app.app.test_client()
+    response = client.get(path(BASE_TS + 30))
+    assert response.status_code == 200
+    assert response.get_json() == []
+    assert "ETag" not in response.headers
+    assert client_app.analyzer.cached_response(("snapshot", BASE_TS + 30, client_app.registry.content_tag)) is None
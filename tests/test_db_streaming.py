@@ -0,0 +1,121 @@
+import threading
+import time
+
+import mysql.connector
+
+from db_manager import DBManager
+
+"""不緩衝的串流查詢：同時佔用的連線數有上限；提前結束時連線不可帶著未讀完的結果歸還"""
+
+
+class FakeCursor:
+    def __init__(self, conn, rows):
+        self.conn = conn
+        self.rows = list(rows)
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchmany(self, size):
+        time.sleep(0.01)
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, pool, rows):
+        self.pool = pool
+        self.rows = rows
+        self.open_cursor = None
+        self.connected = True
+
+    def cursor(self, **kwargs):
+        self.open_cursor = FakeCursor(self, self.rows)
+        return self.open_cursor
+
+    def consume_results(self):
+        if self.pool.fail_consume:
+            raise mysql.connector.errors.InterfaceError("Lost connection")
+        self.open_cursor.rows = []
+
+    def disconnect(self):
+        self.connected = False
+
+    def close(self):
+        self.pool.release(self)
+
+
+class FakePool:
+    def __init__(self, rows):
+        self.rows = rows
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        self.fail_consume = False
+        self.returned = []
+
+    def get_connection(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        return FakeConnection(self, self.rows)
+
+    def release(self, conn):
+        with self.lock:
+            self.active -= 1
+            self.returned.append(conn)
+
+
+def stream(db, chunk_size=2):
+    return DBManager._iter_unbuffered(db, "SELECT ...", (), chunk_size)
+
+
+def test_stream_slots_cap_concurrent_connections(fake_db):
+    db = fake_db("full")
+    db._stream_slots = threading.BoundedSemaphore(2)
+    pool = FakePool([(i,) for i in range(10)])
+    db.get_connection = pool.get_connection
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(sum(len(c) for c in stream(db))))
+               for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == [10] * 6
+    assert pool.peak == 2
+    assert pool.active == 0
+
+
+def test_early_exit_drains_unread_rows(fake_db):
+    db = fake_db("full")
+    pool = FakePool([(i,) for i in range(10)])
+    db.get_connection = pool.get_connection
+
+    chunks = stream(db)
+    assert next(chunks) == [(0,), (1,)]
+    chunks.close()
+
+    conn, = pool.returned
+    assert conn.open_cursor.rows == []
+    assert conn.connected
+    assert pool.active == 0
+
+
+def test_early_exit_disconnects_when_drain_fails(fake_db):
+    db = fake_db("full")
+    pool = FakePool([(i,) for i in range(10)])
+    pool.fail_consume = True
+    db.get_connection = pool.get_connection
+
+    for _ in stream(db):
+        break
+
+    conn, = pool.returned
+    assert not conn.connected
+    assert pool.active == 0
@@ -0,0 +1,133 @@
+import random
+from datetime import datetime
+
+import pytest
+
+"""delta 儲存模式：只寫入變動站點與定期關鍵幀，讀回的每個時間點狀態需與 full 模式完全相同"""
+
+BASE_TS = 1760000000
+STATIONS = [f"5001010{i:02d}" for i in range(12)]
+
+
+def make_snapshots(n_ticks, seed=0):
+    """每分鐘一個快照；多數站點維持不變，少數變動，偶爾有站點暫時消失"""
+    rng = random.Random(seed)
+    state = {sno: rng.randint(0, 20) for sno in STATIONS}
+    snapshots = []
+    for i in range(n_ticks):
+        for sno in rng.sample(STATIONS, 3):
+            state[sno] = rng.randint(0, 20)
+        present = [sno for sno in STATIONS if not (sno == STATIONS[0] and 10 <= i < 25)]
+        snapshots.append({
+            "timestamp": datetime.fromtimestamp(BASE_TS + i * 60).isoformat(),
+            "stations": [{
+                "station_no": sno,
+                "parking_spaces": 20,
+                "available_spaces": state[sno],
+                "empty_spaces": 20 - state[sno],
+                "yb2": state[sno],
+                "eyb": 0,
+                "forbidden_spaces": 0,
+                "available_level": state[sno] * 5,
+            } for sno in present],
+        })
+    return snapshots
+
+
+def saved_pair(fake_db, n_ticks=60):
+    full, delta = fake_db("full"), fake_db("delta", keyframe_interval=600)
+    for snapshot in make_snapshots(n_ticks):
+        full.save_snapshot(snapshot)
+        delta.save_snapshot(snapshot)
+    return full, delta
+
+
+def states(db, start_ts, end_ts, **kwargs):
+    return {
+        ts: {sno: tuple(row[c] for c in db.STATE_COLUMNS) for sno, row in state.items()}
+        for ts, state in db.iter_snapshot_states(start_ts, end_ts, **kwargs)
+    }
+
+
+def test_delta_writes_fewer_rows(fake_db):
+    full, delta = saved_pair(fake_db)
+    assert len(delta.records) < len(full.records) / 2
+    assert sum(delta.snapshots.values()) == 6
+
+
+@pytest.mark.parametrize("start, end", [(0, 59), (7, 30), (13, 13), (24, 59)])
+def test_delta_states_match_full(fake_db, start, end):
+    full, delta = saved_pair(fake_db)
+    start_ts, end_ts = BASE_TS + start * 60, BASE_TS + end * 60
+    expected = states(full, start_ts, end_ts, station_nos=full.ALL_STATIONS)
+    assert len(expected) == end - start + 1
+    assert states(delta, start_ts, end_ts, station_nos=delta.ALL_STATIONS) == expected
+
+    subset = [STATIONS[0], STATIONS[5], "missing"]
+    assert states(delta, start_ts, end_ts, station_nos=subset) == {
+        ts: {sno: row for sno, row in state.items() if sno in subset} for ts, state in expected.items()
+    }
+
+
+def test_delta_range_matrix_matches_full(fake_db):
+    full, delta = saved_pair(fake_db)
+    args = ([STATIONS[0], STATIONS[3]], datetime.fromtimestamp(BASE_TS + 5 * 60),
+            datetime.fromtimestamp(BASE_TS + 40 * 60))
+    assert delta.get_range_matrix(*args) == full.get_range_matrix(*args)
+
+
+@pytest.mark.parametrize("station_no", [STATIONS[0], STATIONS[4], "missing"])
+def test_range_logs_stream_matches_full(fake_db, station_no):
+    """/range 的串流查詢：delta 與 full 相同，也與逐 tick 還原的狀態一致 (STATIONS[0] 中途消失又出現)"""
+    full, delta = saved_pair(fake_db)
+    start, end = datetime.fromtimestamp(BASE_TS + 7 * 60), datetime.fromtimestamp(BASE_TS + 50 * 60)
+    expected = [
+        (datetime.fromtimestamp(ts), row[1])
+        for ts, state in states(full, BASE_TS + 7 * 60, BASE_TS + 50 * 60, station_no=station_no).items()
+        for sno, row in state.items()
+    ]
+    for db in (full, delta):
+        logs = [(log["timestamp"], log["available_spaces"])
+                for log in db.iter_range_logs(station_no, start, end, chunk_size=7)]
+        assert logs == expected
+
+
+def test_iter_snapshot_states_requires_station_filter(fake_db):
+    _, delta = saved_pair(fake_db, n_ticks=3)
+    with pytest.raises(ValueError):
+        list(delta.iter_snapshot_states(BASE_TS, BASE_TS + 120))
+
+
+def test_foreign_write_forces_keyframe(fake_db):
+    """其他行程寫入的快照不在本行程的 delta 狀態中，下一次寫入需改寫完整關鍵幀"""
+    snapshots = make_snapshots(3)
+    loader, other = fake_db("delta", keyframe_interval=3600), fake_db("full")
+    other.snapshots, other.records = loader.snapshots, loader.records
+
+    loader.save_snapshot(snapshots[0])
+    other.save_snapshot(snapshots[1])
+    loader.save_snapshot(snapshots[2])
+
+    ts = BASE_TS + 2 * 60
+    assert loader.snapshots[ts] == 1
+    reference = fake_db("full")
+    for snapshot in snapshots:
+        reference.save_snapshot(snapshot)
+    assert states(loader, ts, ts, station_nos=loader.ALL_STATIONS) == \
+        states(reference, ts, ts, station_nos=reference.ALL_STATIONS)
+
+
+@pytest.mark.parametrize("present", [0, 1])
+def test_ensure_schema_adds_is_keyframe_once(fake_db, present):
+    """尚未執行 migration 的既有資料庫在啟動時補上 is_keyframe，已存在時不做任何變更"""
+    db = fake_db("delta")
+    executed = []
+
+    def execute(query, params=None, fetch_one=False, fetch_all=False):
+        executed.append(" ".join(query.split()))
+        return {"n": present} if fetch_one else None
+
+    db._execute_query = execute
+    assert db.ensure_schema() is (not present)
+    alters = [q for q in executed if q.startswith("ALTER TABLE data_snapshots ADD COLUMN is_keyframe")]
+    assert len(alters) == 1 - present
@@ -0,0 +1,128 @@
+import random
+from datetime import datetime
+
+from conftest import FakeDBManager
+
+"""彙總表：進度之後才寫入、時間戳較早的快照只要落在寬限範圍內就會併入，重跑不會重複累計"""
+
+BASE_TS = 1760000000
+STATIONS = [f"5001010{i:02d}" for i in range(6)]
+STEP = 300
+
+
+class RollupCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+
+    def execute(self, query, params=None):
+        query = " ".join(query.split())
+        if query.startswith("INSERT INTO rollup_state"):
+            self.db.watermark = params[0]
+        elif "FROM station_hourly WHERE bucket_unix >= %s AND bucket_unix < %s" in query:
+            self.result = [
+                {"station_no": sno, "bucket_unix": bucket, **dict(zip(self.db.ROLLUP_FIELDS, agg))}
+                for (sno, bucket), agg in sorted(self.db.tables["station_hourly"].items())
+                if params[0] <= bucket < params[1]
+            ]
+        else:
+            raise NotImplementedError(query)
+
+    def executemany(self, query, values):
+        table = query.split()[2]
+        for station_no, bucket, *agg in values:
+            self.db.tables[table][(station_no, bucket)] = agg
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class RollupConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, **kwargs):
+        return RollupCursor(self.db)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RollupDB(FakeDBManager):
+    ROLLUP_FIELDS = ("sample_count", "sum_available", "min_available", "max_available",
+                     "delta_sum", "first_available", "last_available")
+
+    def __init__(self):
+        super().__init__("full")
+        self.watermark = None
+        self.tables = {"station_hourly": {}, "station_daily": {}}
+
+    def get_connection(self):
+        return RollupConnection(self)
+
+    def _execute_query(self, query, params=None, fetch_one=False, fetch_all=False):
+        query = " ".join(query.split())
+        if query.startswith("SELECT last_timestamp_unix FROM rollup_state"):
+            return None if self.watermark is None else {"last_timestamp_unix": self.watermark}
+        if query.startswith("SELECT MIN(timestamp_unix) AS ts FROM data_snapshots"):
+            return {"ts": min(self.snapshots, default=None)}
+        if query.startswith("SELECT MAX(timestamp_unix) AS ts FROM data_snapshots"):
+            return {"ts": max(self.snapshots, default=None)}
+        return super()._execute_query(query, params, fetch_one, fetch_all)
+
+
+def make_snapshots(n_ticks, seed=0):
+    """每 5 分鐘一個快照，跨越本地時間的日界"""
+    rng = random.Random(seed)
+    return [{
+        "timestamp": datetime.fromtimestamp(BASE_TS + i * STEP).isoformat(),
+        "stations": [{"station_no": sno, "available_spaces": rng.randint(0, 20)}
+                     for sno in STATIONS if rng.random() > 0.2],
+    } for i in range(n_ticks)]
+
+
+def expected_tables(snapshots):
+    rows = sorted(({
+        "timestamp_unix": int(datetime.fromisoformat(s["timestamp"]).timestamp()),
+        "station_no": st["station_no"], "available_spaces": st["available_spaces"],
+    } for s in snapshots for st in s["stations"]), key=lambda r: r["timestamp_unix"])
+
+    def day_of(ts):
+        d = datetime.fromtimestamp(ts)
+        return int(datetime(d.year, d.month, d.day).timestamp())
+
+    return {
+        "station_hourly": RollupDB._aggregate_rollup(rows, lambda ts: ts - ts % 3600),
+        "station_daily": RollupDB._aggregate_rollup(rows, day_of),
+    }
+
+
+def test_late_snapshot_within_grace_is_rolled_up():
+    snapshots = make_snapshots(30 * 12)
+    late = snapshots[-15:-10]
+    db = RollupDB()
+    for snapshot in snapshots:
+        if snapshot not in late:
+            db.save_snapshot(snapshot)
+    db.compact_rollups(batch_hours=4)
+    assert db.watermark == BASE_TS + (len(snapshots) - 1) * STEP
+
+    # 時間戳早於進度約一小時的快照在彙總之後才寫入
+    for snapshot in late:
+        db.save_snapshot(snapshot)
+    db.compact_rollups(batch_hours=4)
+    expected = expected_tables(snapshots)
+    assert db.tables == expected
+
+    # 沒有新資料時重跑，寬限範圍內的區間以覆寫更新，不會重複累計
+    db.compact_rollups(batch_hours=4)
+    assert db.tables == expected
@@ -0,0 +1,91 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from shared_store import SharedStorePublisher, SharedStoreReader
+from snapshot_store import FIELDS, HourlyRollup, SnapshotStore
+
+"""共享記憶體發布：每次只附加新列，容量不足或資料被改寫時才配置新的資料區段；讀取端看到的內容與 store 相同"""
+
+BASE_TS = 1760000000
+
+
+@pytest.fixture
+def shared(monkeypatch):
+    # 發布端與讀取端在同一行程：讀取端不可取消發布端的 resource_tracker 登記
+    monkeypatch.setattr("shared_store.resource_tracker.unregister", lambda *args: None)
+    name = f"test_{uuid.uuid4().hex[:8]}"
+    publisher = SharedStorePublisher(name, min_headroom_rows=4, station_headroom=2)
+    reader = SharedStoreReader(name)
+    yield publisher, reader
+    reader.store = reader.rollup = reader._data_arrays = None
+    reader._retired += [shm for shm in (reader._shm, reader._data_shm) if shm is not None]
+    reader._close_retired()
+    publisher.close()
+
+
+def append(store, i, stations=3):
+    store.append(BASE_TS + i * 60, [
+        {"station_no": f"50010100{k}", "available_spaces": (i + k) % 7, "yb2": k}
+        for k in range(stations)
+    ])
+
+
+def publish(publisher, reader, store):
+    publisher.publish(store, HourlyRollup.from_store(store))
+    assert reader.refresh()
+    n, n_st = len(store), len(store.station_nos)
+    assert reader.store.station_nos == store.station_nos
+    assert reader.store.timestamps.tolist() == store.timestamps[:n].tolist()
+    for f in FIELDS:
+        assert np.array_equal(reader.store.columns[f], store.columns[f][:n, :n_st])
+    assert np.array_equal(reader.rollup.sums, HourlyRollup.from_store(store).sums[:, :n_st])
+    return reader.store
+
+
+def test_publish_appends_rows_in_place(shared):
+    publisher, reader = shared
+    store = SnapshotStore(initial_capacity=8, initial_stations=4)
+    for i in range(4):
+        append(store, i)
+    publish(publisher, reader, store)
+    data_segment = publisher._data_name
+
+    earlier = reader.store
+    append(store, 4)
+    store.evict_before(BASE_TS + 60)
+    publish(publisher, reader, store)
+    assert publisher._data_name == data_segment
+    # 先前世代的 view 不受影響
+    assert earlier.timestamps.tolist() == [BASE_TS + i * 60 for i in range(4)]
+
+    # 新站點在預留的站點容量內
+    append(store, 5, stations=4)
+    assert publish(publisher, reader, store).get_snapshot(BASE_TS + 4 * 60)[0]["yb2"] == 0
+    assert publisher._data_name == data_segment
+
+
+@pytest.mark.parametrize("change", ["rows", "stations", "out_of_order", "reloaded"])
+def test_publish_reallocates_when_needed(shared, change):
+    publisher, reader = shared
+    store = SnapshotStore(initial_capacity=8, initial_stations=4)
+    for i in range(1, 5):
+        append(store, i)
+    publish(publisher, reader, store)
+    data_segment = publisher._data_name
+
+    if change == "rows":
+        for i in range(5, 10):
+            append(store, i)
+    elif change == "stations":
+        append(store, 5, stations=6)
+    elif change == "out_of_order":
+        append(store, 0)
+    else:
+        reloaded = SnapshotStore()
+        for i in range(1, 5):
+            append(reloaded, i)
+        store = reloaded
+    publish(publisher, reader, store)
+    assert publisher._data_name != data_segment
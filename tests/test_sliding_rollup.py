@@ -0,0 +1,79 @@
+import random
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from analyzer import Analyzer
+from snapshot_store import HourlyRollup, SnapshotStore
+
+"""滾動視窗：逐筆加入與滑出後的 hourly_rollup，需與只用視窗內資料重新計算的結果相同"""
+
+BASE_TS = 1760000000
+
+
+def snapshot(ts, rng):
+    stations = [f"s{k}" for k in range(rng.randint(3, 12)) if rng.random() > 0.3]
+    return {
+        "timestamp": datetime.fromtimestamp(ts).isoformat(),
+        "stations": [{"station_no": sno, "available_spaces": rng.randint(0, 20)} for sno in stations],
+    }
+
+
+def recomputed(analyzer):
+    """只取視窗內 (最新時間點往前 window_days 天) 的列，從頭建立 HourlyRollup"""
+    store = analyzer.snapshot_store
+    cutoff = int(store.timestamps[len(store) - 1]) - analyzer.window_days * 24 * 3600
+    window = SnapshotStore()
+    for ts in store.timestamps[:len(store)].tolist():
+        if ts >= cutoff:
+            window.append(ts, store.get_snapshot(ts))
+    return window, HourlyRollup.from_store(window)
+
+
+def assert_rollup_matches(analyzer):
+    store, rollup = analyzer.snapshot_store, analyzer.hourly_rollup
+    window, expected = recomputed(analyzer)
+    for sno, col in store.station_index.items():
+        ref_col = window.station_index.get(sno)
+        for name in ("sums", "counts", "flow"):
+            actual = getattr(rollup, name)[:, col]
+            wanted = getattr(expected, name)[:, ref_col] if ref_col is not None else np.zeros(24)
+            assert np.allclose(actual, wanted), (name, sno)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_sliding_rollup_matches_recompute(fake_db, seed):
+    rng = random.Random(seed)
+    db = fake_db("full")
+    analyzer = Analyzer(db, window_days=1)
+    analyzer.EVICT_BATCH = 7
+
+    ts = BASE_TS
+    for i in range(1500):
+        ts += rng.randint(60, 900)
+        if i % 400 == 200:
+            # 亂序的舊資料 (例如延遲的 /upload) 會觸發重建
+            db.save_snapshot(snapshot(ts - 5000, rng))
+        db.save_snapshot(snapshot(ts, rng))
+        if i % 150 == 0:
+            assert_rollup_matches(analyzer)
+
+    assert analyzer._expired_rows > 0
+    assert_rollup_matches(analyzer)
+    assert analyzer.get_hourly_avg("s1") == analyzer.hourly_rollup.hourly_avg(
+        analyzer.snapshot_store.station_index["s1"])
+
+
+def test_compaction_keeps_rollup(fake_db):
+    rng = random.Random(2)
+    analyzer = Analyzer(fake_db("full"), window_days=1)
+    ts = BASE_TS
+    for _ in range(400):
+        ts += rng.randint(300, 600)
+        analyzer._ingest_snapshot(ts, snapshot(ts, rng)["stations"])
+
+    analyzer._compact_window()
+    assert analyzer._expired_rows == 0
+    assert analyzer.snapshot_store.timestamps[0] >= ts - 24 * 3600
+    assert_rollup_matches(analyzer)
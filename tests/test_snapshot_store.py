@@ -0,0 +1,24 @@
+from snapshot_store import FIELDS, SnapshotStore
+
+"""SnapshotStore：回應中的缺值為 None (與直接查 DB 相同)；記憶體用量需含預留容量"""
+
+BASE_TS = 1760000000
+
+
+def test_missing_fields_are_returned_as_none():
+    store = SnapshotStore()
+    store.append(BASE_TS, [
+        {"station_no": "500101001", "available_spaces": 3, "yb2": 2, "eyb": None},
+        {"station_no": "500101002", "available_spaces": 0, "yb2": 0, "eyb": 0},
+    ])
+    first, second = store.get_snapshot(BASE_TS)
+    assert first["available_spaces"] == 3 and first["yb2"] == 2
+    assert first["eyb"] is None and first["parking_spaces"] is None
+    assert [second[f] for f in ("available_spaces", "yb2", "eyb")] == [0, 0, 0]
+
+
+def test_allocated_nbytes_includes_reserved_capacity():
+    store = SnapshotStore(initial_capacity=16, initial_stations=8)
+    store.append(BASE_TS, [{"station_no": "500101001", "available_spaces": 1}])
+    assert store.nbytes == 8 + 1 + len(FIELDS) * 2
+    assert store.allocated_nbytes == 16 * (8 + 1) + 16 * 8 * len(FIELDS) * 2
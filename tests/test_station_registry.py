@@ -0,0 +1,19 @@
+from unittest import mock
+
+import pytest
+
+from station_registry import StationRegistry
+
+"""站點登錄資料：只有寫入端會向官方抓取站點清單，worker 只讀 station_meta"""
+
+
+@pytest.mark.parametrize("read_only, fetches", [(False, 1), (True, 0)])
+def test_empty_station_meta_fetches_only_in_writer(read_only, fetches):
+    db = mock.Mock()
+    db.get_station_meta.return_value = []
+    registry = StationRegistry(db, read_only=read_only)
+    with mock.patch("station_registry.requests.get") as get:
+        get.return_value.status_code = 304
+        registry.load()
+        registry.refresh()
+    assert get.call_count == fetches * 2
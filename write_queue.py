@@ -0,0 +1,152 @@
+from collections import OrderedDict
+import queue
+import threading
+import time
+import uuid
+
+"""/upload 的 write-behind 佇列：request 只負責排入，專屬的 writer 執行緒把多個快照合併成一個交易寫入"""
+
+
+class WriteQueueFull(Exception):
+    """佇列已滿，呼叫端應回應 429 並請客戶端稍後重送。"""
+
+
+class WriteQueueClosed(Exception):
+    """行程正在關閉，不再接受新的寫入。"""
+
+
+class WriteBehindQueue:
+    """
+    - max_pending: 尚未寫入的快照上限，超過時 submit 丟出 WriteQueueFull (backpressure)
+    - max_batch / linger: writer 取得第一筆後最多再等 linger 秒，湊滿 max_batch 筆就以一個交易寫入
+    - max_tickets: 保留狀態的 ticket 數量上限，超過時先淘汰最舊的已完成 ticket
+    """
+
+    def __init__(self, db_manager, max_pending=256, max_batch=32, linger=0.2, max_tickets=10000):
+        self.db_manager = db_manager
+        self.max_batch = max_batch
+        self.linger = linger
+        self.max_tickets = max_tickets
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._tickets = OrderedDict()   # {ticket: 狀態 dict}
+        self._tickets_lock = threading.Lock()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._writer.start()
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    # --- request 端 ---
+    def submit(self, converted_data):
+        """排入一個轉換後的快照，回傳 ticket。"""
+        if self._closed:
+            raise WriteQueueClosed("write-behind queue 已關閉")
+        ticket = uuid.uuid4().hex
+        self._set_status(ticket, {
+            "ticket": ticket,
+            "status": "queued",
+            "record_count": len(converted_data.get("stations", [])),
+            "submitted_at": time.time(),
+        })
+        try:
+            self._queue.put_nowait((ticket, converted_data))
+        except queue.Full:
+            with self._tickets_lock:
+                self._tickets.pop(ticket, None)
+            raise WriteQueueFull(f"寫入佇列已滿 ({self._queue.maxsize} 筆)")
+        return ticket
+
+    def status(self, ticket):
+        """回傳 ticket 狀態 (queued / writing / done / failed)，未知的 ticket 回傳 None。"""
+        with self._tickets_lock:
+            entry = self._tickets.get(ticket)
+            return dict(entry) if entry is not None else None
+
+    def stats(self):
+        with self._tickets_lock:
+            counts = {}
+            for entry in self._tickets.values():
+                counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return {"pending": self._queue.qsize(), "max_pending": self._queue.maxsize, "tickets": counts}
+
+    def _set_status(self, ticket, fields):
+        with self._tickets_lock:
+            entry = self._tickets.setdefault(ticket, {})
+            entry.update(fields)
+            self._tickets.move_to_end(ticket)
+            # 只淘汰已完成的 ticket；仍在佇列中的不會被移除
+            if len(self._tickets) > self.max_tickets:
+                for old in list(self._tickets):
+                    if len(self._tickets) <= self.max_tickets:
+                        break
+                    if self._tickets[old]["status"] in ("done", "failed"):
+                        del self._tickets[old]
+
+    # --- writer 執行緒 ---
+    def _next_batch(self):
+        """阻塞取得第一筆，之後在 linger 秒內盡量湊滿 max_batch 筆；收到 None (關閉訊號) 時回傳 None。"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 關閉訊號放回佇列，寫完這批後再結束
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._write(batch)
+
+    def _write(self, batch):
+        for ticket, _ in batch:
+            self._set_status(ticket, {"status": "writing"})
+        # 依快照時間排序，delta 模式才能以正確的前一個狀態計算差異
+        batch.sort(key=lambda item: item[1].get("timestamp", ""))
+        try:
+            saved = self.db_manager.save_snapshots([data for _, data in batch])
+            for (ticket, _), unix_timestamp in zip(batch, saved):
+                self._set_status(ticket, {"status": "done", "saved_timestamp": unix_timestamp,
+                                          "finished_at": time.time()})
+        except Exception as e:
+            if len(batch) == 1:
+                ticket = batch[0][0]
+                print(f"WriteBehindQueue: 快照寫入失敗 ({ticket}): {e}")
+                self._set_status(ticket, {"status": "failed", "error": str(e), "finished_at": time.time()})
+                return
+            # 合併的交易失敗時逐筆重試，避免單一壞資料拖累同批的其他快照
+            print(f"WriteBehindQueue: 合併寫入 {len(batch)} 筆失敗，改為逐筆寫入: {e}")
+            for item in batch:
+                self._write([item])
+
+    def shutdown(self, timeout=30):
+        """停止接受新的寫入，等待佇列中已排入的快照寫完。回傳是否在 timeout 內完成。"""
+        if self._closed:
+            return not self._writer.is_alive()
+        self._closed = True
+        pending = self._queue.qsize()
+        if pending:
+            print(f"WriteBehindQueue: 關閉中，等待 {pending} 筆快照寫入...")
+        # 關閉訊號排在最後，前面的快照都會先寫完；佇列滿時阻塞等待空位
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._writer.join(timeout)
+        drained = not self._writer.is_alive()
+        if not drained:
+            print(f"WriteBehindQueue: 關閉逾時，仍有 {self._queue.qsize()} 筆未寫入")
+        return drained